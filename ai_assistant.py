@@ -4,23 +4,37 @@ Simplified implementation with flat database structure
 """
 import os
 import json
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterator, List, Optional, Any
 from datetime import datetime
 from config import config
 from utils import logger
+from utils.request_cache import get_document, set_document, update_document, invalidate_document
+from utils.syllabus import SYLLABUS_INDEX
+from utils.cache import cache
+from utils.model_selector import ModelSelector
+from utils.answer_cache import AnswerCache, TermWeights, syllabus_documents
+from utils.chat_writer import ChatMessage, chat_messages, write_exchange
+from utils.chat_threads import thread_page
 # Import will be done in __init__ to handle errors gracefully
 # Remove global Firebase client - will be initialized when needed
 
 class AIAssistant:
     """Simplified AI Assistant class with flat database structure"""
 
-    def __init__(self):
-        """Initialize AI Assistant with Gemini API"""
+    def __init__(self, genai=None, store=None):
+        """
+        Initialize AI Assistant with Gemini API
+        Nothing here calls the API: models are probed in the background and
+        chosen per request (see utils.model_selector.ModelSelector).
+        Args:
+            genai: Stand-in for the google.generativeai module (tests)
+            store: Disk cache holding the last known good model
+        """
         self.ai_available = False
-        self.model = None
+        self.models = None
+        self.answers = None
         self.genai = None
         self.error_message = None
-        self.model_name = None
         
         try:
             # Check if API key is set
@@ -35,17 +49,18 @@ class AIAssistant:
             os.environ['GOOGLE_API_KEY'] = api_key.strip()
             
             # Import the Google Generative AI package
-            try:
-                import google.generativeai as genai
-                self.genai = genai
-                logger.info("Successfully imported google.generativeai")
-            except ImportError as e:
-                self.error_message = "Required package not installed. Please run: pip install google-genai"
-                logger.error(f"{self.error_message}: {str(e)}")
-                print(f"AI IMPORT ERROR: {self.error_message}")
-                return
+            if genai is None:
+                try:
+                    import google.generativeai as genai
+                    logger.info("Successfully imported google.generativeai")
+                except ImportError as e:
+                    self.error_message = "Required package not installed. Please run: pip install google-genai"
+                    logger.error(f"{self.error_message}: {str(e)}")
+                    print(f"AI IMPORT ERROR: {self.error_message}")
+                    return
+            self.genai = genai
             
-            # Configure the API
+            # Configure the API (local only, no network round trip)
             try:
                 genai.configure(api_key=api_key.strip())
                 logger.info("Successfully configured Gemini API")
@@ -55,107 +70,23 @@ class AIAssistant:
                 print(f"AI CONFIG ERROR: {self.error_message}")
                 return
 
-            try:
-                # Try to list models, but don't fail if it's not available
-                try:
-                    available_models = genai.list_models()
-                    logger.info("Successfully connected to Gemini API")
-                    logger.info(f"Available models: {[m.name for m in available_models]}")
-                except AttributeError:
-                    logger.warning("list_models() not available in this version of google-genai")
-                    # Use known working models
-                    model_names = [
-                        'models/gemini-2.5-flash',
-                        'models/gemini-2.5-pro',
-                        'models/gemini-2.0-flash',
-                        'models/gemini-flash-latest'
-                    ]
-                    logger.info(f"Using default models: {model_names}")
-                
-                # Set the API key in the environment for future use
-                os.environ['GOOGLE_API_KEY'] = api_key.strip()
-                logger.info("Successfully configured Gemini API")
-            except Exception as e:
-                self.error_message = f"Failed to configure Gemini API: {str(e)}"
-                logger.error(self.error_message, exc_info=True)
-                print(f"AI CONFIG ERROR: {self.error_message}")
-                return  # Properly return None from __init__
-            
-            # Define the models to try in order of preference
-            model_names = [
-                'models/gemini-2.5-flash',  # Latest and most capable model
-                'models/gemini-2.5-pro',    # Alternative model
-                'models/gemini-2.0-flash',  # Fallback model
-                'models/gemini-flash-latest'  # Always points to latest flash model
-            ]
-            
-            # Log the models we'll try to use
-            logger.info(f"Will try to initialize with models: {model_names}")
-            
-            # Check if we have any models to try
-            if not model_names:
-                self.error_message = "No models available to initialize"
-                logger.error(self.error_message)
-                return
-            
-            for model_name in model_names:
-                try:
-                    logger.info(f"Attempting to initialize model: {model_name}")
-                    
-                    try:
-                        # Initialize the model with default settings first
-                        logger.info(f"Initializing model: {model_name}")
-                        
-                        # Try with minimal configuration first
-                        self.model = genai.GenerativeModel(model_name=model_name)
-                        
-                        # Test the connection with a simple prompt
-                        logger.info("Testing model with a simple prompt...")
-                        chat = self.model.start_chat(history=[])
-                        response = chat.send_message(
-                            "Hello, please respond with 'Ready' if you can hear me.",
-                            stream=False
-                        )
-                        
-                        # If we get here, the model is working
-                        logger.info(f"Successfully initialized model: {model_name}")
-                        
-                    except Exception as model_error:
-                        error_msg = f"Failed to initialize model {model_name}: {str(model_error)}"
-                        logger.error(error_msg)
-                        continue  # Try the next model
-                    
-                    if response and hasattr(response, 'text'):
-                        logger.info(f"Successfully initialized with model: {model_name}")
-                        logger.info(f"Model response: {response.text}")
-                        print(f"AI SUCCESS: Initialized with model {model_name}")
-                        self.ai_available = True
-                        self.model_name = model_name
-                        self.chat = chat  # Store chat session for future use
-                        return  # Properly return None from __init__
-                    
-                    logger.warning(f"Model {model_name} responded with empty content")
-                    self.error_message = f"Model {model_name} returned empty response"
-                        
-                except Exception as model_error:
-                    import traceback
-                    error_details = str(model_error)
-                    error_trace = traceback.format_exc()
-                    logger.error(f"Failed to initialize model {model_name}: {error_details}")
-                    logger.error(f"Error trace: {error_trace}")
-                    print(f"MODEL ERROR ({model_name}): {error_details[:200]}")
-                    print(f"Full error available in logs")
-                    continue
-            
-            # If we get here, no models worked
-            self.error_message = (
-                "Failed to initialize any available Gemini model. "
-                "Please check your API key and internet connection. "
-                "Make sure your API key has access to the Gemini API."
+            env = os.environ.get('FLASK_ENV', 'production')
+            self.models = ModelSelector(
+                genai,
+                store=store if store is not None else cache,
+                probe_interval=config[env].AI_PROBE_INTERVAL,
+                failure_cooldown=config[env].AI_MODEL_COOLDOWN
             )
-            logger.error(self.error_message)
-            print(f"AI MODEL ERROR: {self.error_message}")
-            # No return needed here - just let the function end naturally
+            # Requests are served right away (last known good model first); the probe runs alongside
+            self.models.start_probe()
+            self.answers = AnswerCache(
+                TermWeights(syllabus_documents(SYLLABUS_INDEX.store.skeleton())),
+                ttl=config[env].AI_ANSWER_CACHE_TTL,
+                maxsize=config[env].AI_ANSWER_CACHE_SIZE,
+                threshold=config[env].AI_ANSWER_CACHE_THRESHOLD,
+                modes=[m.strip() for m in config[env].AI_ANSWER_CACHE_MODES.split(',') if m.strip()]
+            )
+            self.ai_available = True
             
         except Exception as e:
             self.error_message = f"Unexpected error during initialization: {str(e)}"
@@ -163,8 +94,12 @@ class AIAssistant:
             print(f"AI INIT ERROR: {self.error_message}")
             import traceback
             traceback.print_exc()
-            
-        self.ai_available = False
+            self.ai_available = False
+
+    @property
+    def model_name(self) -> Optional[str]:
+        """Model the next request will try first"""
+        return self.models.order()[0] if self.models else None
 
     def _get_db(self):
         """Get Firebase Firestore client - import from already initialized firebase_config"""
@@ -182,6 +117,11 @@ class AIAssistant:
                 logger.error(f"Fallback Firebase client also failed: {str(fallback_error)}")
                 raise
 
+    def _get_user_data(self, uid: str) -> Optional[Dict[str, Any]]:
+        """Get a user document through the request-scoped document cache"""
+        user_doc = get_document(self._get_db().collection('users').document(uid))
+        return user_doc.to_dict() if user_doc.exists else None
+
     def get_academic_context(self, user_data: Dict[str, Any]) -> Dict[str, Any]:
         """Extract and format user's academic context for AI prompts"""
         context = {
@@ -201,16 +141,12 @@ class AIAssistant:
             context["grade"] = hs.get('grade')
             context["board"] = hs.get('board')
             # Get subjects from syllabus
-            from templates.academic_data import get_syllabus
-            syllabus = get_syllabus('highschool', hs.get('board'), hs.get('grade'))
-            context["subjects"] = list(syllabus.keys()) if syllabus else []
+            context["subjects"] = list(SYLLABUS_INDEX.get('highschool', hs.get('board'), hs.get('grade')).subjects)
 
         elif user_data.get('purpose') == 'exam_prep' and user_data.get('exam'):
             context["exam_type"] = user_data['exam'].get('type')
             # Get subjects from syllabus
-            from templates.academic_data import get_syllabus
-            syllabus = get_syllabus('exam', user_data['exam'].get('type'))
-            context["subjects"] = list(syllabus.keys()) if syllabus else []
+            context["subjects"] = list(SYLLABUS_INDEX.get('exam', user_data['exam'].get('type')).subjects)
 
         elif user_data.get('purpose') == 'after_tenth' and user_data.get('after_tenth'):
             at = user_data['after_tenth']
@@ -218,9 +154,8 @@ class AIAssistant:
             context["stream"] = at.get('stream')
             context["subjects"] = at.get('subjects', [])
             # Get subjects from syllabus
-            from templates.academic_data import get_syllabus
-            syllabus = get_syllabus('after_tenth', 'CBSE', at.get('grade'), at.get('subjects', []))
-            context["subjects"] = list(syllabus.keys()) if syllabus else at.get('subjects', [])
+            syllabus = SYLLABUS_INDEX.get('after_tenth', 'CBSE', at.get('grade'), at.get('subjects', []))
+            context["subjects"] = list(syllabus.subjects) if syllabus else at.get('subjects', [])
 
         # Get progress data
         from app import calculate_academic_progress
@@ -240,67 +175,57 @@ class AIAssistant:
         return context
 
     def save_message(self, uid: str, chatbot_type: str, role: str, content: str):
-        """Save a chat message to the active thread for this chatbot type"""
+        """Save a single chat message to the active thread for this chatbot type"""
         try:
-            # Validate inputs
-            if chatbot_type not in ['planning', 'doubt']:
-                raise ValueError("Invalid chatbot type")
-            if role not in ['user', 'assistant']:
-                raise ValueError("Invalid role")
-
             # Get user data for timezone
-            from app import get_user_data
             from utils.timezone import get_current_time_for_user
-            user_data = get_user_data(uid)
+            user_data = self._get_user_data(uid)
             if not user_data:
                 raise ValueError("User data not found")
-
-            # Get active thread for this chatbot type
-            active_thread_id = self.get_active_thread_id(uid, chatbot_type)
-            if not active_thread_id:
-                # Create default thread if none exists
-                active_thread_id = self.create_default_thread(uid, chatbot_type)
-                logger.info(f"Created default thread {active_thread_id} for {chatbot_type}")
-
-            # Save message to thread document
-            message_data = {
-                'role': role,
-                'content': content,
-                'timestamp': get_current_time_for_user(user_data)  # Use user's timezone
-            }
-
-            # Use flat structure: users/{uid}/ai_conversations/{chatbot_type}_{thread_id}
-            thread_ref = self._get_db().collection('users').document(uid).collection('ai_conversations').document(f'{chatbot_type}_{active_thread_id}')
-            messages_ref = thread_ref.collection('messages')
-            messages_ref.add(message_data)
-
-            # Update thread metadata
-            from firebase_admin import firestore
-            thread_ref.update({
-                'last_message_at': get_current_time_for_user(user_data),  # Use user's timezone
-                'message_count': firestore.Increment(1)
-            })
-
-            logger.info(f"Message saved successfully for {chatbot_type} thread {active_thread_id}")
-            return active_thread_id
-
+            return self.save_exchange(uid, chatbot_type, chat_messages((role, content, get_current_time_for_user(user_data))))
         except Exception as e:
             logger.error(f"Error saving message: {str(e)}", exc_info=True)
             raise
 
+    def save_exchange(self, uid: str, chatbot_type: str, messages: List[ChatMessage]) -> str:
+        """
+        Save messages to the active thread with its metadata in one batch
+        (run from the chat write-behind queue, after the response was sent)
+        Args:
+            uid: User identifier
+            chatbot_type: 'planning' or 'doubt'
+            messages: Messages from utils.chat_writer.chat_messages
+        Returns:
+            Thread the messages were saved to
+        """
+        if chatbot_type not in ['planning', 'doubt']:
+            raise ValueError("Invalid chatbot type")
+        if any(data['role'] not in ['user', 'assistant'] for _, data in messages):
+            raise ValueError("Invalid role")
+
+        active_thread_id = self.get_active_thread_id(uid, chatbot_type)
+        if not active_thread_id:
+            # Create default thread if none exists
+            active_thread_id = self.create_default_thread(uid, chatbot_type)
+
+        thread_ref = self._get_db().collection('users').document(uid).collection('ai_conversations').document(f'{chatbot_type}_{active_thread_id}')
+        write_exchange(self._get_db(), thread_ref, messages, {'last_message_at': messages[-1][1]['timestamp']})
+        logger.info(f"Saved {len(messages)} messages for {chatbot_type} thread {active_thread_id}")
+        return active_thread_id
+
     def get_active_thread_id(self, uid: str, chatbot_type: str) -> str:
         """Get the active thread ID for a chatbot type"""
         try:
             # Check for active thread document
             active_ref = self._get_db().collection('users').document(uid).collection('ai_conversations').document(f'{chatbot_type}_active_thread')
-            active_doc = active_ref.get()
+            active_doc = get_document(active_ref)
 
             if active_doc.exists:
                 thread_id = active_doc.to_dict().get('thread_id')
                 if thread_id:
                     # Verify thread still exists
                     thread_ref = self._get_db().collection('users').document(uid).collection('ai_conversations').document(f'{chatbot_type}_{thread_id}')
-                    if thread_ref.get().exists:
+                    if get_document(thread_ref).exists:
                         return thread_id
 
             # No valid active thread found
@@ -314,9 +239,8 @@ class AIAssistant:
         """Create a default thread for a chatbot type"""
         try:
             # Get user data for timezone
-            from app import get_user_data
             from utils.timezone import get_current_time_for_user
-            user_data = get_user_data(uid)
+            user_data = self._get_user_data(uid)
             if not user_data:
                 raise ValueError("User data not found")
 
@@ -334,11 +258,11 @@ class AIAssistant:
 
             # Create thread document
             thread_ref = self._get_db().collection('users').document(uid).collection('ai_conversations').document(f'{chatbot_type}_{thread_id}')
-            thread_ref.set(thread_data)
+            set_document(thread_ref, thread_data)
 
             # Set as active thread
             active_ref = self._get_db().collection('users').document(uid).collection('ai_conversations').document(f'{chatbot_type}_active_thread')
-            active_ref.set({'thread_id': thread_id})
+            set_document(active_ref, {'thread_id': thread_id})
 
             logger.info(f"Created default thread {thread_id} for {chatbot_type}")
             return thread_id
@@ -351,9 +275,8 @@ class AIAssistant:
         """Get conversation history for a chatbot type and optional specific thread"""
         try:
             # Get user data for timezone formatting
-            from app import get_user_data
             from utils.timezone import format_timestamp_for_user
-            user_data = get_user_data(uid)
+            user_data = self._get_user_data(uid)
             if not user_data:
                 logger.warning(f"User data not found for {uid}")
                 return []
@@ -390,45 +313,36 @@ class AIAssistant:
             logger.error(f"Error loading conversation history: {str(e)}", exc_info=True)
             return []
 
-    def get_user_threads(self, uid: str, chatbot_type: str):
-        """Get all threads for a user and chatbot type"""
+    def get_user_threads(self, uid: str, chatbot_type: str, limit: int = None, cursor: str = None):
+        """
+        Get a page of threads for a user and chatbot type, most recent first
+        Returns:
+            Tuple of (threads, next_cursor or None when there are no more threads)
+        """
         try:
-            # Get user data for timezone formatting
-            from app import get_user_data
-            from utils.timezone import format_timestamp_for_user
-            user_data = get_user_data(uid)
-            if not user_data:
-                logger.warning(f"User data not found for {uid}")
-                return []
-
             conversations_ref = self._get_db().collection('users').document(uid).collection('ai_conversations')
 
+            # Thread documents carry chatbot_type (the active-thread pointers don't), indexed with last_message_at
+            docs, next_cursor = thread_page(conversations_ref.where('chatbot_type', '==', chatbot_type), limit, cursor)
             threads = []
-            # Find all thread documents for this chatbot type
-            for doc in conversations_ref.stream():
-                doc_id = doc.id
-                # Check if this is a thread document for our chatbot type
-                if doc_id.startswith(f'{chatbot_type}_') and not doc_id.endswith('_active_thread') and not doc_id.endswith('_threads_list'):
-                    thread_data = doc.to_dict()
-                    thread_data['thread_id'] = thread_data.get('thread_id', doc_id.split('_', 1)[1])
-                    threads.append(thread_data)
-
-            # Sort by last message (most recent first)
-            threads.sort(key=lambda x: x.get('last_message_at', ''), reverse=True)
+            for doc in docs:
+                thread_data = doc.to_dict()
+                thread_data['thread_id'] = thread_data.get('thread_id', doc.id.split('_', 1)[1])
+                threads.append(thread_data)
+
             logger.info(f"Found {len(threads)} threads for {chatbot_type}")
-            return threads
+            return threads, next_cursor
 
         except Exception as e:
             logger.error(f"Error getting user threads: {str(e)}", exc_info=True)
-            return []
+            return [], None
 
     def create_new_thread(self, uid: str, chatbot_type: str, title: str = None) -> str:
         """Create a new conversation thread"""
         try:
             # Get user data for timezone
-            from app import get_user_data
             from utils.timezone import get_current_time_for_user
-            user_data = get_user_data(uid)
+            user_data = self._get_user_data(uid)
             if not user_data:
                 raise ValueError("User data not found")
 
@@ -449,11 +363,11 @@ class AIAssistant:
 
             # Create thread document
             thread_ref = self._get_db().collection('users').document(uid).collection('ai_conversations').document(f'{chatbot_type}_{thread_id}')
-            thread_ref.set(thread_data)
+            set_document(thread_ref, thread_data)
 
             # Set as active thread (this automatically switches to the new thread)
             active_ref = self._get_db().collection('users').document(uid).collection('ai_conversations').document(f'{chatbot_type}_active_thread')
-            active_ref.set({'thread_id': thread_id})
+            set_document(active_ref, {'thread_id': thread_id})
 
             logger.info(f"Created new thread {thread_id} for {chatbot_type}")
             return thread_id
@@ -467,13 +381,13 @@ class AIAssistant:
         try:
             # Verify thread exists
             thread_ref = self._get_db().collection('users').document(uid).collection('ai_conversations').document(f'{chatbot_type}_{thread_id}')
-            if not thread_ref.get().exists:
+            if not get_document(thread_ref).exists:
                 logger.warning(f"Thread {thread_id} does not exist for {chatbot_type}")
                 return False
 
             # Update active thread
             active_ref = self._get_db().collection('users').document(uid).collection('ai_conversations').document(f'{chatbot_type}_active_thread')
-            active_ref.set({'thread_id': thread_id})
+            set_document(active_ref, {'thread_id': thread_id})
 
             logger.info(f"Switched to thread {thread_id} for {chatbot_type}")
             return True
@@ -504,6 +418,7 @@ class AIAssistant:
             # Delete thread document
             batch.delete(thread_ref)
             batch.commit()
+            invalidate_document(thread_ref)
 
             logger.info(f"Deleted thread {thread_id} for {chatbot_type}")
             return True
@@ -522,12 +437,12 @@ class AIAssistant:
 
             # Verify thread exists
             thread_ref = self._get_db().collection('users').document(uid).collection('ai_conversations').document(f'{chatbot_type}_{thread_id}')
-            if not thread_ref.get().exists:
+            if not get_document(thread_ref).exists:
                 logger.warning(f"Thread {thread_id} does not exist for {chatbot_type}")
                 return False
 
             # Update thread title
-            thread_ref.update({'title': new_title.strip()})
+            update_document(thread_ref, {'title': new_title.strip()})
 
             logger.info(f"Renamed thread {thread_id} for {chatbot_type} to '{new_title.strip()}'")
             return True
@@ -576,7 +491,7 @@ class AIAssistant:
     def generate_planning_response(self, message: str, context: Dict[str, Any]) -> str:
         """Generate a response for academic planning queries"""
         try:
-            if not self.ai_available or not hasattr(self, 'model') or not self.model:
+            if not self.ai_available or not self.models:
                 error_msg = "AI Assistant is not properly initialized. "
                 if hasattr(self, 'error_message'):
                     error_msg += f"Error: {self.error_message}"
@@ -586,8 +501,8 @@ class AIAssistant:
             # Create a prompt with context
             prompt = self._build_planning_prompt(message, context)
             
-            # Generate response
-            response = self.model.generate_content(prompt)
+            # Generate response (falls through to the next model if one fails)
+            response = self.models.generate(prompt)
             
             # Process and return the response
             if hasattr(response, 'text') and response.text.strip():
@@ -608,21 +523,30 @@ class AIAssistant:
     def generate_doubt_response(self, message: str, context: Dict[str, Any]) -> str:
         """Generate a response for doubt resolution"""
         try:
-            if not self.ai_available or not hasattr(self, 'model') or not self.model:
+            if not self.ai_available or not self.models:
                 error_msg = "AI Assistant is not properly initialized. "
                 if hasattr(self, 'error_message'):
                     error_msg += f"Error: {self.error_message}"
                 logger.error(error_msg)
                 return "I'm sorry, but the AI Assistant is currently unavailable. Please try again later."
             
+            # Popular questions are answered from the cache (unless the mode opted out)
+            use_cache = self._answers_for(context)
+            if use_cache:
+                cached = self.answers.get(message, context)
+                if cached:
+                    return cached
+            
             # Create a prompt with context
             prompt = self._build_doubt_prompt(message, context)
             
-            # Generate response
-            response = self.model.generate_content(prompt)
+            # Generate response (falls through to the next model if one fails)
+            response = self.models.generate(prompt)
             
             # Process and return the response
             if hasattr(response, 'text') and response.text.strip():
+                if use_cache:
+                    self.answers.put(message, context, response.text.strip())
                 return response.text.strip()
             else:
                 logger.warning("Received empty response from model")
@@ -637,6 +561,40 @@ class AIAssistant:
                 "Please try again later or contact support if the problem persists."
             )
 
+    def stream_response(self, kind: str, message: str, context: Dict[str, Any]) -> Iterator[str]:
+        """
+        Stream a planning or doubt response as the model produces it
+        Args:
+            kind: 'planning' or 'doubt'
+            message: The user's message
+            context: Academic context (see get_academic_context)
+        Yields:
+            Text chunks; errors are raised to the caller, which has already sent part of the answer
+        """
+        if not self.ai_available or not self.models:
+            logger.error(f"AI Assistant is not properly initialized. Error: {self.error_message}")
+            yield "I'm sorry, but the AI Assistant is currently unavailable. Please try again later."
+            return
+        if kind != 'doubt':
+            yield from self.models.stream(self._build_planning_prompt(message, context))
+            return
+        use_cache = self._answers_for(context)
+        cached = self.answers.get(message, context) if use_cache else None
+        if cached:
+            yield cached
+            return
+        parts = []
+        for text in self.models.stream(self._build_doubt_prompt(message, context)):
+            parts.append(text)
+            yield text
+        # Only complete answers are cached (a closed stream never gets here)
+        if use_cache and ''.join(parts).strip():
+            self.answers.put(message, context, ''.join(parts).strip())
+
+    def _answers_for(self, context: Dict[str, Any]) -> bool:
+        """Whether doubt answers in this chat mode go through the answer cache"""
+        return self.answers is not None and self.answers.enabled(context.get('mode', 'doubt'))
+
     def _generate_smart_planning_fallback(self, message: str, context: Dict[str, Any]) -> str:
         """Generate an intelligent planning response without AI"""
         user_name = context.get('user_name', 'Student')
@@ -1,14 +1,41 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, send_from_directory, Response, stream_with_context
+from markupsafe import Markup
 from firebase_config import auth, db
 from firebase_admin import auth as admin_auth, storage
 from datetime import datetime, date, timedelta
-from templates.academic_data import get_syllabus, get_available_subjects, ACADEMIC_SYLLABI
 from careers_data import CAREERS_DATA, COURSES_DATA, INTERNSHIPS_DATA, get_career_by_id, get_course_by_id, get_internship_by_id
 from utils import (
     PasswordManager, login_rate_limiter, logger, validate_schema,
-    user_registration_schema, user_login_schema, CacheManager
+    user_registration_schema, user_login_schema, CacheManager,
+    GlobalLeaderboard, BubbleLeaderboard, build_leaderboard_entry, rank_entries,
+    ExclusionResolver, exclusion_key, merge_exclusions
 )
 from utils.timezone import get_current_time_for_user
+from utils.progress import compute_progress_bulk, compute_progress_compiled
+from utils.syllabus import SYLLABUS_INDEX
+from utils.people_search import PeopleSearchIndex
+from utils import fanout
+from utils.heatmap import HeatmapAggregator, institution_scope, class_scope
+from utils.risk import RiskScorer
+from utils.analytics_jobs import AnalyticsJobs
+from utils.roster import Roster, paginate, DEFAULT_PAGE_SIZE
+from utils.broadcast import BroadcastSender
+from utils.inbox import NotificationInbox, INBOX_COL
+from utils.pubsub import LocalBroker, DiskCacheBroker
+from utils.study_log import StudyLog, migrate_legacy_sessions
+from utils.chat_stream import relay_answer
+from utils.chat_writer import ChatWriter, chat_messages, write_exchange
+from utils.chat_threads import ActiveThreads, thread_page
+from utils.calendar_events import (
+    events_in_window, event_times, backfill_event_times, upcoming_events as fetch_upcoming_events
+)
+from utils.cache import cache as disk_cache
+from utils.bubbles import BUBBLES_COL, plan_membership_repairs, apply_membership_repairs
+from utils.syllabus_store import build_store as build_syllabus_store, source_hash as syllabus_source_hash
+from utils.request_cache import (
+    get_document, get_documents, update_document, set_document, delete_document,
+    invalidate_document, request_read_stats
+)
 from config import config
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -17,6 +44,7 @@ from flask_mail import Mail, Message
 import os
 from werkzeug.utils import secure_filename
 import time
+import json
 import uuid
 from functools import wraps
 from firebase_admin import firestore
@@ -26,6 +54,8 @@ import random
 import string
 from marshmallow import ValidationError
 import traceback
+import click
+import atexit
 # AI Assistant import
 from ai_assistant import get_ai_assistant
 # Load environment variables from .env file
@@ -126,92 +156,57 @@ def _get_teacher_profile(uid: str) -> dict | None:
 
 def _get_any_profile(uid: str) -> dict | None:
     """Check all identity collections and return profile + account_type."""
-    # Check collections in order of specificity
-    doc = db.collection(INSTITUTION_ADMINS_COL).document(uid).get()
-    if doc.exists: return {**doc.to_dict(), 'account_type': 'admin'}
-    doc = db.collection(INSTITUTION_TEACHERS_COL).document(uid).get()
-    if doc.exists: return {**doc.to_dict(), 'account_type': 'teacher'}
-    doc = db.collection('users').document(uid).get()
-    if doc.exists: return {**doc.to_dict(), 'account_type': 'student'}
+    # Fetch all three identities in one round trip, then check in order of specificity
+    docs = get_documents(db, [
+        db.collection(INSTITUTION_ADMINS_COL).document(uid),
+        db.collection(INSTITUTION_TEACHERS_COL).document(uid),
+        db.collection('users').document(uid)
+    ])
+    for doc, account_type in zip(docs, ('admin', 'teacher', 'student')):
+        if doc.exists: return {**doc.to_dict(), 'account_type': account_type}
     return None
 
+# Firestore 'in' filters accept at most 30 values
+_IN_QUERY_CHUNK = 30
+
+def _attach_invite_codes(classes):
+    """
+    Fill in each class's active invite code.
+    Codes are denormalized onto class documents; classes created before that
+    are resolved with one 'in' query per 30 classes instead of one query each.
+    """
+    missing = {c['id']: c for c in classes if not c.get('invite_code')}
+    ids = list(missing)
+    for start in range(0, len(ids), _IN_QUERY_CHUNK):
+        invites = db.collection(CLASS_INVITES_COL)\
+            .where('class_id', 'in', ids[start:start + _IN_QUERY_CHUNK])\
+            .where('active', '==', True).stream()
+        for invite in invites:
+            cls = missing.get(invite.get('class_id'))
+            if cls is not None and not cls.get('invite_code'):
+                cls['invite_code'] = invite.get('code')
+    return classes
+
 def _get_institution_analytics(institution_id, class_ids=None):
     """
     Common logic for real-time heatmap and at-risk predictive analytics.
     If class_ids is provided, filter students by those classes.
     """
-    heatmap_data = defaultdict(int)
-    at_risk_students = []
-    
     if not institution_id:
         return {'heatmap': {}, 'at_risk': []}
 
-    # 1. Fetch relevant classes
-    classes_ref = db.collection(CLASSES_COL).where('institution_id', '==', institution_id)
-    classes_docs = list(classes_ref.stream())
-    
+    # 1. Classes and at-risk students (batched roster reads, cached briefly per institution)
+    report = risk_scorer.assess(institution_id, class_ids=class_ids or None)
+
+    # 2. Aggregations (Heatmap), pre-aggregated when sessions are written
     if class_ids:
-        classes_docs = [d for d in classes_docs if d.id in class_ids]
-    
-    classes_map = {d.id: d.to_dict() for d in classes_docs}
-    all_student_ids = set()
-    for _, c_data in classes_map.items():
-        all_student_ids.update(c_data.get('student_uids', []))
-
-    # 2. Aggregations (Heatmap)
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    for sid in all_student_ids:
-        sessions = db.collection('users').document(sid).collection('study_sessions')\
-                     .where('start_time', '>=', thirty_days_ago.isoformat()).stream()
-        for s in sessions:
-            s_data = s.to_dict()
-            h = s_data.get('local_hour')
-            w = s_data.get('local_weekday')
-            if h is not None and w is not None:
-                heatmap_data[f"{w}-{h}"] += 1
-
-    # 3. Risk Analytics
-    for sid in all_student_ids:
-        s_doc = db.collection('users').document(sid).get()
-        if not s_doc.exists: continue
-        s_data = s_doc.to_dict()
-        
-        # Simple Risk model
-        last_str = s_data.get('last_login_date')
-        status = 'healthy'
-        if not last_str: status = 'stagnating'
-        else:
-            days = (datetime.utcnow() - datetime.fromisoformat(last_str)).days
-            if days > 7: status = 'stagnating'
-        
-        # Velocity Momentum
-        results = s_data.get('exam_results', [])
-        momentum = 0
-        if len(results) >= 2:
-            try:
-                sorted_res = sorted(results, key=lambda x: x.get('date', ''), reverse=True)
-                series = [float(r.get('percentage', r.get('score', 0))) for r in sorted_res[:3]][::-1]
-                momentum = series[-1] - series[0]
-                if momentum < -5: status = 'critical' if status == 'stagnating' else 'declining'
-            except: pass
-
-        if status != 'healthy':
-            student_class = "Unknown"
-            for cid, cdata in classes_map.items():
-                if sid in cdata.get('student_uids', []):
-                    student_class = cdata.get('name', cid)
-                    break
-            at_risk_students.append({
-                'uid': sid,
-                'name': s_data.get('name', 'Student'),
-                'class': student_class,
-                'status': status,
-                'momentum': round(momentum, 2)
-            })
+        heatmap_data = heatmaps.read(class_scope(cid) for cid in report['class_ids'])
+    else:
+        heatmap_data = heatmaps.read([institution_scope(institution_id)])
 
     return {
-        'heatmap': dict(heatmap_data),
-        'at_risk': at_risk_students
+        'heatmap': heatmap_data,
+        'at_risk': report['at_risk']
     }
 
 def _institution_login_guard():
@@ -252,6 +247,13 @@ TEST_TYPES = [
     "Pre Annual", "Annual"
 ]
 
+# Shared institution/class exclusion cache (invalidated when syllabus exclusions are edited)
+exclusion_resolver = ExclusionResolver(
+    db,
+    ttl=config[env].EXCLUSION_CACHE_TTL,
+    maxsize=config[env].EXCLUSION_CACHE_SIZE
+)
+
 def require_login(f):
     def wrapper(*args, **kwargs):
         if 'uid' not in session:
@@ -261,135 +263,158 @@ def require_login(f):
     return wrapper
 
 def get_user_data(uid):
-    user_doc = db.collection('users').document(uid).get()
+    user_doc = get_document(db.collection('users').document(uid))
     if user_doc.exists:
         return user_doc.to_dict()
     return None
 
-def calculate_academic_progress(user_data, uid=None):
+def calculate_academic_progress(user_data, uid=None, shared_exclusions=None):
     """
     Calculate academic progress with 3-tier exclusion system:
     Level 1: Institution exclusions (admin)
     Level 2: Class exclusions (teacher)
     Level 3: Personal exclusions (student)
+    shared_exclusions: pre-resolved Level 1 + 2 exclusions (from exclusion_resolver.resolve_bulk)
     """
-    purpose = user_data.get('purpose')
-    chapters_completed = user_data.get('chapters_completed', {})
-    personal_exclusions = user_data.get('academic_exclusions', {})
-    # Fetch institution and class exclusions
-    institution_exclusions = {}
-    class_exclusions = {}
-    inst_id = user_data.get('institution_id')
-    class_ids = user_data.get('class_ids', [])
-    # Level 1: Institution Exclusions
-    if inst_id:
-        try:
-            inst_excl_doc = db.collection('institutions').document(inst_id).collection('syllabus_exclusions').document('current').get()
-            if inst_excl_doc.exists:
-                institution_exclusions = inst_excl_doc.to_dict().get('chapters', {})
-        except:
-            pass
-    # Level 2: Class Exclusions (union of all classes student is in)
-    if class_ids:
-        for class_id in class_ids:
-            try:
-                class_excl_doc = db.collection('classes').document(class_id).collection('excluded_chapters').document('current').get()
-                if class_excl_doc.exists:
-                    class_exclusions.update(class_excl_doc.to_dict().get('chapters', {}))
-            except:
-                pass
-    # Merge all exclusions (union)
-    all_exclusions = {}
-    all_exclusions.update(institution_exclusions)
-    all_exclusions.update(class_exclusions)
-    all_exclusions.update(personal_exclusions)
-    syllabus = {}
-    syllabus_purpose = {
-        'high_school': 'highschool',
-        'exam_prep': 'exam',
-        'after_tenth': 'after_tenth'
-    }.get(purpose, purpose)
-    if purpose == 'high_school' and user_data.get('highschool'):
-        hs = user_data['highschool']
-        syllabus = get_syllabus(syllabus_purpose, hs.get('board'), hs.get('grade'))
-    elif purpose == 'exam_prep' and user_data.get('exam'):
-        syllabus = get_syllabus(syllabus_purpose, user_data['exam'].get('type'))
-    elif purpose == 'after_tenth' and user_data.get('after_tenth'):
-        at = user_data['after_tenth']
-        syllabus = get_syllabus(syllabus_purpose, 'CBSE', at.get('grade'), at.get('subjects', []))
-    if not syllabus:
-        return {
-            'overall': 0,
-            'by_subject': {},
-            'total_chapters': 0,
-            'total_completed': 0,
-            'momentum': 0,
-            'consistency': 0,
-            'readiness': 0
-        }
-    by_subject = {}
-    chapters_by_subject = {}
-    total_chapters = 0
-    total_completed = 0
-    for subject_name, subject_data in syllabus.items():
-        chapters = subject_data.get('chapters', {})
-        subject_completed_data = chapters_completed.get(subject_name, {})
-        subject_valid_count = 0
-        subject_completed_count = 0
-        for chapter_name in chapters.keys():
-            exclusion_key = f"{subject_name}::{chapter_name}"
-            # If chapter is excluded at ANY level, skip it
-            if all_exclusions.get(exclusion_key):
+    # Level 1 + 2: institution and class exclusions (one batched read, cached across requests)
+    if shared_exclusions is None:
+        shared_exclusions = exclusion_resolver.resolve_for_user(user_data)
+    # Level 3 (personal) is applied over them against the compiled syllabus
+    return compute_progress_compiled(user_data, shared_exclusions)
+
+def calculate_academic_progress_bulk(user_docs):
+    """
+    Calculate academic progress for many students at once.
+    Exclusions are resolved in batched reads and each syllabus is compiled once;
+    results are identical to calculate_academic_progress for every student.
+    Args:
+        user_docs: Iterable of (uid, user_data) pairs
+    Returns:
+        Dictionary mapping uid to progress
+    """
+    user_docs = list(user_docs)
+    shared_exclusions = exclusion_resolver.resolve_bulk(exclusion_key(u) for _, u in user_docs)
+    return compute_progress_bulk(user_docs, lambda u: shared_exclusions[exclusion_key(u)])
+
+# Precomputed global leaderboard (kept in sync on every progress-affecting write)
+global_leaderboard = GlobalLeaderboard(db)
+bubble_leaderboards = BubbleLeaderboard(db, max_age=config[env].BUBBLE_LEADERBOARD_MAX_AGE)
+people_search = PeopleSearchIndex(db)
+# Rolling weekday x hour study heatmaps per institution and class
+heatmaps = HeatmapAggregator(db)
+study_log = StudyLog(db)
+# Chat messages are saved after the response is sent; pending writes are flushed at shutdown
+chat_writer = ChatWriter(maxsize=config[env].CHAT_WRITE_QUEUE_SIZE)
+atexit.register(chat_writer.flush)
+# Active SCLERA thread per user and mode, so chat sends don't list threads
+active_threads = ActiveThreads(db, ttl=config[env].SCLERA_ACTIVE_THREAD_TTL)
+risk_scorer = RiskScorer(db, ttl=config[env].RISK_CACHE_TTL)
+# Per-user notification inboxes with unread counters
+inbox = NotificationInbox(db)
+# Server-push channel for notification streams (relayed across workers through the disk cache)
+notification_broker = DiskCacheBroker(disk_cache) if config[env].PUBSUB_BACKEND == 'diskcache' else LocalBroker()
+# Broadcast notifications are written in chunks on background threads
+broadcasts = BroadcastSender(
+    db,
+    parallelism=config[env].BROADCAST_PARALLELISM,
+    chunk_size=config[env].BROADCAST_CHUNK_SIZE,
+    broker=notification_broker
+)
+# Dashboard analytics are computed in the background and served from snapshots
+analytics_jobs = AnalyticsJobs(
+    _get_institution_analytics,
+    workers=config[env].ANALYTICS_WORKERS,
+    max_age=config[env].ANALYTICS_SNAPSHOT_MAX_AGE,
+    interval=config[env].ANALYTICS_REFRESH_INTERVAL
+)
+
+def _allows_bubble_leaderboard(user_data):
+    return bool((user_data.get('privacy_settings') or {}).get('allow_leaderboard', False))
+
+def _refresh_leaderboard_entry(uid, user_data=None):
+    """
+    Recompute and store a student's leaderboard score, in the global ranking and in
+    each bubble they belong to (only if they consented); failures never break the caller
+    """
+    try:
+        if user_data is None:
+            user_data = get_user_data(uid)
+        if not user_data:
+            return None
+        entry = global_leaderboard.upsert(uid, user_data, calculate_academic_progress(user_data, uid))
+        bubble_leaderboards.set_member(
+            user_data.get('bubbles') or [], uid, entry if _allows_bubble_leaderboard(user_data) else None
+        )
+        return entry
+    except Exception as e:
+        logger.error("leaderboard_refresh_error", uid=uid, error=str(e))
+        return None
+
+def _refresh_leaderboard_entries(uids):
+    """
+    _refresh_leaderboard_entry for many students: one batched read, one bulk
+    scoring pass and chunked writes; failures never break the caller
+    """
+    try:
+        user_docs = get_documents(db, [db.collection('users').document(u) for u in dict.fromkeys(uids)])
+        users = [(doc.id, doc.to_dict()) for doc in user_docs if doc.exists]
+        entries = global_leaderboard.upsert_many(users, calculate_academic_progress_bulk(users))
+        bubble_updates = {}
+        for student_uid, user_data in users:
+            if student_uid not in entries:
                 continue
-            subject_valid_count += 1
-            if subject_completed_data.get(chapter_name, False):
-                subject_completed_count += 1
-        if subject_valid_count > 0:
-            by_subject[subject_name] = round((subject_completed_count / subject_valid_count) * 100, 1)
-        else:
-            by_subject[subject_name] = 0
-        
-        # Store chapter counts per subject
-        chapters_by_subject[subject_name] = {
-            'total': subject_valid_count,
-            'completed': subject_completed_count
-        }
-        
-        total_chapters += subject_valid_count
-        total_completed += subject_completed_count
-    # --- AI Analytics Engine ---
-    momentum = 0
-    consistency = 0
-    readiness = 0
-    # 1. Momentum: Last 4 exams gradient
-    results = user_data.get('exam_results', [])
-    if len(results) >= 2:
-        sorted_res = sorted(results, key=lambda x: x.get('date', ''), reverse=True)
-        try:
-            series = [float(r.get('percentage', r.get('score', 0))) for r in sorted_res[:4]][::-1]
-            momentum = round(series[-1] - series[0], 1)
-        except: pass
-    # 2. Consistency: Time pattern stability
-    # In a full app, we analyze study_sessions. Here we use session data if available.
-    # Logic: More sessions per week = higher consistency.
-    sessions_count = len(user_data.get('recent_sessions', [])) # Mocking session density
-    consistency = min(100, sessions_count * 15) # Example calculation
-    # 3. Readiness: Weighted Academic Health
-    avg_score = 0
-    if results:
-        avg_score = sum([float(r.get('percentage', r.get('score', 0))) for r in results]) / len(results)
-    overall = round((total_completed / total_chapters) * 100, 1) if total_chapters > 0 else 0
-    readiness = round((overall * 0.4) + (avg_score * 0.6), 1)
-    return {
-        'overall': overall,
-        'by_subject': by_subject,
-        'chapters_by_subject': chapters_by_subject,
-        'total_chapters': total_chapters,
-        'total_completed': total_completed,
-        'momentum': momentum,
-        'consistency': consistency,
-        'readiness': readiness
+            entry = entries[student_uid] if _allows_bubble_leaderboard(user_data) else None
+            for bubble_id in user_data.get('bubbles') or []:
+                bubble_updates.setdefault(bubble_id, {})[student_uid] = entry
+        bubble_leaderboards.set_members(bubble_updates)
+        return entries
+    except Exception as e:
+        logger.error("leaderboard_refresh_error", uids=len(uids), error=str(e))
+        return {}
+
+def _forget_deleted_user(uid, user_data):
+    """Drop a deleted user's leaderboard entries (global and bubbles) and search entry; failures never break the caller"""
+    try:
+        global_leaderboard.remove(uid)
+        bubble_leaderboards.set_member(user_data.get('bubbles') or [], uid, None)
+    except Exception as e:
+        logger.error("leaderboard_remove_error", uid=uid, error=str(e))
+    try:
+        people_search.remove(uid)
+    except Exception as e:
+        logger.error("search_index_remove_error", uid=uid, error=str(e))
+
+def _recompute_bubble_leaderboard(bubble_id, bubble_data):
+    """Score every consenting member of a bubble and store the bubble's ranking document"""
+    member_uids = bubble_data.get('member_uids', [])
+    # Only members who consented to leaderboard participation are ranked
+    member_docs = get_documents(db, [db.collection('users').document(m) for m in member_uids])
+    consenting = []
+    for member_doc in member_docs:
+        if not member_doc.exists:
+            continue
+        member_data = member_doc.to_dict()
+        if _allows_bubble_leaderboard(member_data):
+            consenting.append((member_doc.id, member_data))
+    # Score all consenting members in one pass (members with calculation errors are skipped)
+    progress_by_uid = calculate_academic_progress_bulk(consenting)
+    entries = {
+        member_uid: build_leaderboard_entry(member_uid, member_data, progress_by_uid[member_uid])
+        for member_uid, member_data in consenting if member_uid in progress_by_uid
     }
+    return bubble_leaderboards.replace(bubble_id, entries)
+
+def _refresh_search_entry(uid, user_data=None):
+    """Update a user's people-search entry (name, grade, school, subjects); failures never break the caller"""
+    try:
+        if user_data is None:
+            user_data = get_user_data(uid)
+        if not user_data:
+            return None
+        return people_search.upsert(uid, user_data)
+    except Exception as e:
+        logger.error("search_index_refresh_error", uid=uid, error=str(e))
+        return None
 
 def calculate_average_percentage(results):
     valid_percentages = []
@@ -407,7 +432,7 @@ def calculate_average_percentage(results):
     return round(sum(valid_percentages) / len(valid_percentages), 1)
 
 def initialize_profile_fields(uid):
-    user_doc = db.collection('users').document(uid).get()
+    user_doc = get_document(db.collection('users').document(uid))
     user_data = user_doc.to_dict() if user_doc.exists else {}
     updates = {}
     defaults = {
@@ -439,10 +464,7 @@ def initialize_profile_fields(uid):
         if key not in user_data:
             updates[key] = default
     if updates:
-        db.collection('users').document(uid).update(updates)
-    uid = session['uid']
-    user_data = get_user_data(uid)
-    name_top_statistics = user_data.get('name')
+        update_document(db.collection('users').document(uid), updates)
 
 # ============================================================================
 # AUTH ROUTES
@@ -521,7 +543,8 @@ def signup():
                 },
                 'created_at': datetime.utcnow().isoformat()
             }
-            db.collection('users').document(uid).set(user_data)
+            set_document(db.collection('users').document(uid), user_data)
+            _refresh_search_entry(uid, user_data)
             session['uid'] = uid
             logger.security_event("user_registered", user_id=uid, ip_address=request.remote_addr)
             if purpose == 'high_school':
@@ -544,9 +567,11 @@ def signup():
 def setup_highschool():
     if request.method == 'POST':
         uid = session['uid']
-        db.collection('users').document(uid).update({
+        update_document(db.collection('users').document(uid), {
             'highschool': {'board': request.form.get('board'), 'grade': request.form.get('grade')}
         })
+        _refresh_leaderboard_entry(uid)
+        _refresh_search_entry(uid)
         flash('Setup complete!', 'success')
         return redirect(url_for('profile_dashboard'))
     return render_template('setup_highschool.html')
@@ -556,7 +581,9 @@ def setup_highschool():
 def setup_exam():
     if request.method == 'POST':
         uid = session['uid']
-        db.collection('users').document(uid).update({'exam': {'type': request.form.get('exam_type')}})
+        update_document(db.collection('users').document(uid), {'exam': {'type': request.form.get('exam_type')}})
+        _refresh_leaderboard_entry(uid)
+        _refresh_search_entry(uid)
         flash('Setup complete!', 'success')
         return redirect(url_for('profile_dashboard'))
     return render_template('setup_exam.html')
@@ -566,13 +593,15 @@ def setup_exam():
 def setup_after_tenth():
     if request.method == 'POST':
         uid = session['uid']
-        db.collection('users').document(uid).update({
+        update_document(db.collection('users').document(uid), {
             'after_tenth': {
                 'stream': request.form.get('stream'),
                 'grade': request.form.get('grade'),
                 'subjects': request.form.getlist('subjects')
             }
         })
+        _refresh_leaderboard_entry(uid)
+        _refresh_search_entry(uid)
         flash('Setup complete!', 'success')
         return redirect(url_for('profile_dashboard'))
     return render_template('setup_after_tenth.html')
@@ -602,7 +631,7 @@ def login():
         try:
             user = admin_auth.get_user_by_email(email)
             uid = user.uid
-            user_doc = db.collection('users').document(uid).get()
+            user_doc = get_document(db.collection('users').document(uid))
             if not user_doc.exists:
                 login_rate_limiter.record_attempt(client_ip)
                 flash('Invalid email or password', 'error')
@@ -620,7 +649,7 @@ def login():
             # Check if this is a legacy SHA-256 hash and upgrade to bcrypt
             if PasswordManager._is_legacy_hash(stored_hash):
                 new_hash = PasswordManager.hash_password(password)
-                db.collection('users').document(uid).update({'password_hash': new_hash})
+                update_document(db.collection('users').document(uid), {'password_hash': new_hash})
                 logger.security_event("password_hash_upgraded", user_id=uid, ip_address=client_ip)
             # Successful login - reset rate limiter
             login_rate_limiter.reset_attempts(client_ip)
@@ -628,7 +657,7 @@ def login():
             session.permanent = True
             logger.security_event("successful_login", user_id=uid, ip_address=client_ip)
             user_ref = db.collection('users').document(uid)
-            snapshot = user_ref.get()
+            snapshot = get_document(user_ref)
             user_data = snapshot.to_dict() if snapshot.exists else {}
             today = date.today().isoformat()
             last_login = user_data.get('last_login_date')
@@ -643,7 +672,7 @@ def login():
                     streak=1
             else:
                 streak = 1
-            user_ref.update({
+            update_document(user_ref, {
                 'last_login_date': today,
                 'login_streak': streak
             })
@@ -682,7 +711,7 @@ def student_join_class():
             return render_template('student_join_class.html')
         try:
             # Find class invite
-            invite_ref = db.collection('class_invites').document(invite_code).get()
+            invite_ref = db.collection(CLASS_INVITES_COL).document(invite_code).get()
             if not invite_ref.exists:
                 flash('Invalid invite code', 'error')
                 return render_template('student_join_class.html')
@@ -699,16 +728,19 @@ def student_join_class():
             # Overlay student with institution/class info (no academic data changes)
             uid = session.get('uid')
             user_ref = db.collection('users').document(uid)
-            user_ref.update({
+            update_document(user_ref, {
                 'institution_id': institution_id,
                 'class_ids': firestore.ArrayUnion([class_id]),
                 'teacher_id': teacher_id
             })
             # Add student to class roster
             class_ref = db.collection('classes').document(class_id)
-            class_ref.update({
+            update_document(class_ref, {
                 'student_uids': firestore.ArrayUnion([uid])
             })
+            # Class exclusions now apply to this student's score
+            _refresh_leaderboard_entry(uid)
+            _refresh_search_entry(uid)
             flash('Successfully joined the class!', 'success')
             return redirect(url_for('profile_dashboard'))
         except Exception as e:
@@ -733,8 +765,10 @@ def institution_teacher_create_class():
         try:
             institution_id = teacher_profile.get('institution_id')
             class_id = str(uuid.uuid4())
-            # Create class
-            db.collection('classes').document(class_id).set({
+            # Generate multi-use invite code
+            invite_code = ''.join(random.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=6))
+            # Create class (the active invite code is kept on the class for dashboards)
+            set_document(db.collection('classes').document(class_id), {
                 'id': class_id,
                 'name': name,
                 'board': board,
@@ -743,11 +777,10 @@ def institution_teacher_create_class():
                 'teacher_id': uid,
                 'institution_id': institution_id,
                 'student_uids': [],
+                'invite_code': invite_code,
                 'created_at': firestore.SERVER_TIMESTAMP
             })
-            # Generate multi-use invite code
-            invite_code = ''.join(random.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=6))
-            db.collection('class_invites').document(invite_code).set({
+            db.collection(CLASS_INVITES_COL).document(invite_code).set({
                 'code': invite_code,
                 'class_id': class_id,
                 'teacher_id': uid,
@@ -774,13 +807,10 @@ def institution_teacher_classes():
         class_docs = db.collection('classes').where('teacher_id', '==', uid).stream()
         for doc in class_docs:
             cls = doc.to_dict()
+            cls['id'] = doc.id
             cls['uid'] = doc.id
-            # Find invite code for this class
-            invite = db.collection('class_invites').where('class_id', '==', doc.id).where('active', '==', True).limit(1).get()
-            if invite:
-                invite = next(iter(invite))
-                cls['invite_code'] = invite.get('code')
             classes.append(cls)
+        _attach_invite_codes(classes)
         return render_template('institution_teacher_classes.html', profile=profile, classes=classes, institution_id=institution_id)
     except Exception as e:
         logger.error("teacher_list_classes_error", error=str(e))
@@ -818,14 +848,14 @@ def signup_admin():
             uid = user.uid
             institution_id = uuid.uuid4().hex
             now = datetime.utcnow().isoformat()
-            db.collection(INSTITUTIONS_COL).document(institution_id).set({
+            set_document(db.collection(INSTITUTIONS_COL).document(institution_id), {
                 'name': institution_name,
                 'created_at': now,
                 'created_by': uid,
                 'status': 'active',
                 'plan': 'Free'
             })
-            db.collection(INSTITUTION_ADMINS_COL).document(uid).set({
+            set_document(db.collection(INSTITUTION_ADMINS_COL).document(uid), {
                 'uid': uid,
                 'name': name,
                 'email': email,
@@ -869,7 +899,7 @@ def login_admin():
                 flash('Invalid admin credentials.', 'error')
                 return redirect(url_for('login_admin'))
             institution_id = profile.get('institution_id')
-            db.collection(INSTITUTION_ADMINS_COL).document(uid).update({
+            update_document(db.collection(INSTITUTION_ADMINS_COL).document(uid), {
                 'last_login_at': datetime.utcnow().isoformat()
             })
             _set_session_identity(uid, 'admin', institution_id=institution_id)
@@ -908,7 +938,7 @@ def signup_teacher():
             user = admin_auth.create_user(email=email, password=password)
             uid = user.uid
             now = datetime.utcnow().isoformat()
-            db.collection(INSTITUTION_TEACHERS_COL).document(uid).set({
+            set_document(db.collection(INSTITUTION_TEACHERS_COL).document(uid), {
                 'uid': uid,
                 'name': name,
                 'email': email,
@@ -953,7 +983,7 @@ def login_teacher():
                 flash('Invalid teacher credentials.', 'error')
                 return redirect(url_for('login_teacher'))
             institution_id = profile.get('institution_id')
-            db.collection(INSTITUTION_TEACHERS_COL).document(uid).update({
+            update_document(db.collection(INSTITUTION_TEACHERS_COL).document(uid), {
                 'last_login_at': datetime.utcnow().isoformat()
             })
             _set_session_identity(uid, 'teacher', institution_id=institution_id)
@@ -1000,6 +1030,7 @@ def institution_teacher_join():
             'status': 'active'
         })
         batch.commit()
+        invalidate_document(db.collection(INSTITUTION_TEACHERS_COL).document(uid))
         _set_session_identity(uid, 'teacher', institution_id=institution_id)
         flash('Successfully joined institution!', 'success')
         return redirect(url_for('institution_teacher_dashboard'))
@@ -1011,7 +1042,7 @@ def institution_admin_dashboard():
     uid = session['uid']
     admin_profile = _get_admin_profile(uid) or {}
     institution_id = admin_profile.get('institution_id') or session.get('institution_id')
-    inst_doc = db.collection(INSTITUTIONS_COL).document(institution_id).get() if institution_id else None
+    inst_doc = get_document(db.collection(INSTITUTIONS_COL).document(institution_id)) if institution_id else None
     institution = inst_doc.to_dict() if inst_doc and inst_doc.exists else {}
     teachers_ref = db.collection(INSTITUTION_TEACHERS_COL).where('institution_id', '==', institution_id)
     teachers = []
@@ -1026,7 +1057,7 @@ def institution_admin_dashboard():
         d['uid'] = s.id
         students.append(d)
     # Analytics (Heatmap + Predictive Risk)
-    analytics = _get_institution_analytics(institution_id)
+    analytics = analytics_jobs.snapshot(institution_id)
     
     context = {
         'profile': admin_profile,
@@ -1034,11 +1065,23 @@ def institution_admin_dashboard():
         'institution_id': institution_id,
         'teachers': teachers,
         'students': students,
-        'heatmap_data': analytics['heatmap'],
-        'at_risk_students': analytics['at_risk']
+        'heatmap_data': analytics['heatmap'] if analytics else {},
+        'at_risk_students': analytics['at_risk'] if analytics else [],
+        'analytics_computed_at': analytics['computed_at'] if analytics else None
     }
     return render_template('institution_admin_dashboard.html', **context)
 
+@app.route('/institution/admin/analytics/refresh', methods=['POST'])
+@require_admin_v2
+def institution_admin_refresh_analytics():
+    admin_profile = _get_admin_profile(session['uid']) or {}
+    institution_id = admin_profile.get('institution_id')
+    if institution_id and analytics_jobs.submit(institution_id):
+        flash('Analytics refresh started. Reload in a moment to see the new snapshot.', 'success')
+    else:
+        flash('Analytics are already being refreshed.', 'info')
+    return redirect(url_for('institution_admin_dashboard'))
+
 @app.route('/institution/admin/teacher_invite', methods=['POST'])
 @require_admin_v2
 def institution_admin_create_teacher_invite():
@@ -1065,13 +1108,13 @@ def institution_admin_disable_teacher(teacher_uid):
     uid = session['uid']
     admin_profile = _get_admin_profile(uid) or {}
     institution_id = admin_profile.get('institution_id')
-    t_doc = db.collection(INSTITUTION_TEACHERS_COL).document(teacher_uid).get()
+    t_doc = get_document(db.collection(INSTITUTION_TEACHERS_COL).document(teacher_uid))
     if not t_doc.exists:
         abort(404)
     t = t_doc.to_dict()
     if t.get('institution_id') != institution_id:
         abort(403)
-    db.collection(INSTITUTION_TEACHERS_COL).document(teacher_uid).update({'status': 'disabled'})
+    update_document(db.collection(INSTITUTION_TEACHERS_COL).document(teacher_uid), {'status': 'disabled'})
     try:
         admin_auth.update_user(teacher_uid, disabled=True)
     except Exception:
@@ -1085,7 +1128,7 @@ def institution_admin_delete_teacher(teacher_uid):
     uid = session['uid']
     admin_profile = _get_admin_profile(uid) or {}
     institution_id = admin_profile.get('institution_id')
-    t_doc = db.collection(INSTITUTION_TEACHERS_COL).document(teacher_uid).get()
+    t_doc = get_document(db.collection(INSTITUTION_TEACHERS_COL).document(teacher_uid))
     if not t_doc.exists:
         abort(404)
     t = t_doc.to_dict()
@@ -1096,7 +1139,7 @@ def institution_admin_delete_teacher(teacher_uid):
         admin_auth.update_user(teacher_uid, disabled=True)
     except Exception:
         pass
-    db.collection(INSTITUTION_TEACHERS_COL).document(teacher_uid).delete()
+    delete_document(db.collection(INSTITUTION_TEACHERS_COL).document(teacher_uid))
     flash('Teacher deleted.', 'success')
     return redirect(url_for('institution_admin_dashboard'))
 
@@ -1106,7 +1149,7 @@ def institution_admin_remove_student(student_uid):
     uid = session['uid']
     admin_profile = _get_admin_profile(uid) or {}
     institution_id = admin_profile.get('institution_id')
-    s_doc = db.collection('users').document(student_uid).get()
+    s_doc = get_document(db.collection('users').document(student_uid))
     if not s_doc.exists:
         abort(404)
     s = s_doc.to_dict()
@@ -1125,6 +1168,10 @@ def institution_admin_remove_student(student_uid):
             'students': firestore.ArrayRemove([student_uid])
         })
     batch.commit()
+    invalidate_document(db.collection('users').document(student_uid),
+                        *[db.collection(CLASSES_COL).document(cid) for cid in class_ids])
+    _refresh_leaderboard_entry(student_uid)
+    _refresh_search_entry(student_uid)
     flash('Student removed from institution (personal dashboard preserved).', 'success')
     return redirect(url_for('institution_admin_dashboard'))
 
@@ -1134,7 +1181,7 @@ def institution_admin_delete_student(student_uid):
     uid = session['uid']
     admin_profile = _get_admin_profile(uid) or {}
     institution_id = admin_profile.get('institution_id')
-    s_doc = db.collection('users').document(student_uid).get()
+    s_doc = get_document(db.collection('users').document(student_uid))
     if not s_doc.exists:
         abort(404)
     s = s_doc.to_dict()
@@ -1145,7 +1192,8 @@ def institution_admin_delete_student(student_uid):
         admin_auth.update_user(student_uid, disabled=True)
     except Exception:
         pass
-    db.collection('users').document(student_uid).delete()
+    delete_document(db.collection('users').document(student_uid))
+    _forget_deleted_user(student_uid, s)
     flash('Student deleted (account disabled).', 'success')
     return redirect(url_for('institution_admin_dashboard'))
 
@@ -1159,26 +1207,38 @@ def institution_teacher_dashboard():
         return redirect(url_for('institution_teacher_join'))
     classes_ref = db.collection(CLASSES_COL).where('institution_id', '==', institution_id).where('teacher_id', '==', uid)
     classes = []
-    # Fetch invite codes for the dashboard view as well
     for c in classes_ref.stream():
         cls_data = c.to_dict()
         cls_data['id'] = c.id
-        # Find invite code for this class
-        invite = db.collection('class_invites').where('class_id', '==', c.id).where('active', '==', True).limit(1).get()
-        if invite:
-            invite_doc = next(iter(invite))
-            cls_data['invite_code'] = invite_doc.get('code')
         classes.append(cls_data)
+    # Invite codes for the dashboard view as well
+    _attach_invite_codes(classes)
     # Analytics (Heatmap + Predictive Risk) for the teacher's classes
     class_ids = [c['id'] for c in classes]
-    analytics = _get_institution_analytics(institution_id, class_ids=class_ids)
+    analytics = analytics_jobs.snapshot(institution_id, class_ids=class_ids)
     
     return render_template('institution_teacher_dashboard.html', 
                            profile=profile, 
                            classes=classes, 
                            institution_id=institution_id,
-                           heatmap_data=analytics['heatmap'],
-                           at_risk_students=analytics['at_risk'])
+                           heatmap_data=analytics['heatmap'] if analytics else {},
+                           at_risk_students=analytics['at_risk'] if analytics else [],
+                           analytics_computed_at=analytics['computed_at'] if analytics else None)
+
+@app.route('/institution/teacher/analytics/refresh', methods=['POST'])
+@require_teacher_v2
+def institution_teacher_refresh_analytics():
+    uid = session['uid']
+    profile = _get_teacher_profile(uid) or {}
+    institution_id = profile.get('institution_id')
+    if not institution_id or profile.get('status') != 'active':
+        return redirect(url_for('institution_teacher_join'))
+    classes = db.collection(CLASSES_COL).where('institution_id', '==', institution_id).where('teacher_id', '==', uid).stream()
+    if analytics_jobs.submit(institution_id, [c.id for c in classes]):
+        flash('Analytics refresh started. Reload in a moment to see the new snapshot.', 'success')
+    else:
+        flash('Analytics are already being refreshed.', 'info')
+    return redirect(url_for('institution_teacher_dashboard'))
 
 @app.route('/institution/teacher/class/<class_id>/upload', methods=['GET', 'POST'])
 @require_teacher_v2
@@ -1186,7 +1246,7 @@ def institution_teacher_upload_file(class_id):
     uid = session['uid']
     profile = _get_teacher_profile(uid) or {}
     # Check if teacher owns the class
-    class_doc = db.collection('classes').document(class_id).get()
+    class_doc = get_document(db.collection('classes').document(class_id))
     if not class_doc.exists or class_doc.to_dict().get('teacher_id') != uid:
         flash('Unauthorized', 'error')
         return redirect(url_for('institution_teacher_dashboard'))
@@ -1290,31 +1350,10 @@ def profile_dashboard():
     saved_career_ids = interests.get('careers', [])
     saved_careers = [get_career_by_id(cid) for cid in saved_career_ids if get_career_by_id(cid)]
     
-    # NEW: Fetch upcoming calendar events for widget
+    # NEW: Fetch upcoming calendar events for widget (next 7 days, indexed by start time)
     upcoming_events = []
     try:
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        week_later = today + timedelta(days=7)
-        # Fix: Fetch events specifically for this user
-        events_ref = db.collection('calendar_events').where('uid', '==', uid).stream()
-        for doc in events_ref:
-            event_data = doc.to_dict()
-            event_data['id'] = doc.id
-            # Normalize date for sorting and display
-            s_date = event_data.get('start_date') or event_data.get('start')
-            if s_date:
-                try:
-                    if isinstance(s_date, str):
-                        dt = datetime.fromisoformat(s_date.replace('Z', '+00:00'))
-                    else:
-                        dt = s_date
-                    
-                    if today <= dt.replace(tzinfo=None) <= week_later:
-                        event_data['display_date'] = dt.strftime('%Y-%m-%d')
-                        upcoming_events.append(event_data)
-                except: pass
-        upcoming_events.sort(key=lambda x: str(x.get('start_date') or x.get('start') or ''))
-        upcoming_events = upcoming_events[:5]
+        upcoming_events = fetch_upcoming_events(db, uid, days=7, limit=5)
     except Exception as e:
         logger.error(f"Fetch upcoming events error: {str(e)}")
     
@@ -1337,25 +1376,11 @@ def profile_dashboard():
     except Exception as e:
         logger.error(f"Calculate performance error: {str(e)}")
 
-    # NEW: Get study time data (last 7 days)
+    # NEW: Get study time data (last 7 days, from the user's rollup document)
     study_time_data = []
     try:
-        daily_totals = defaultdict(int)
-        sessions_ref = db.collection('users').document(uid).collection('study_sessions').stream()
-        for doc in sessions_ref:
-            session_data = doc.to_dict()
-            session_start = session_data.get('start_time', '')
-            if session_start:
-                date_part = session_start.split('T')[0]
-                daily_totals[date_part] += session_data.get('duration_seconds', 0) // 60
-        
-        today = datetime.now()
-        for i in range(6, -1, -1):
-            date = (today - timedelta(days=i)).strftime('%Y-%m-%d')
-            study_time_data.append({
-                'date': date,
-                'minutes': daily_totals.get(date, 0)
-            })
+        today = get_current_time_for_user(user_data)[:10]
+        study_time_data = study_log.summary(uid, today)['daily']
     except Exception as e:
         logger.error(f"Fetch study time error: {str(e)}")
 
@@ -1422,7 +1447,7 @@ def student_files():
         for f in class_files:
             f_data = f.to_dict()
             # Add class name
-            class_doc = db.collection('classes').document(class_id).get()
+            class_doc = get_document(db.collection('classes').document(class_id))
             class_name = class_doc.to_dict().get('name', 'Unknown') if class_doc.exists else 'Unknown'
             f_data['class_name'] = class_name
             files.append(f_data)
@@ -1448,12 +1473,12 @@ def class_management():
         flash('You need to be in an institution and class to access class management.', 'info')
         return redirect(url_for('profile_dashboard'))
 
-    institution_doc = db.collection('institutions').document(institution_id).get()
+    institution_doc = get_document(db.collection('institutions').document(institution_id))
     institution_name = institution_doc.to_dict().get('name', 'Unknown') if institution_doc.exists else 'Unknown'
 
     classes_info = []
     for class_id in class_ids:
-        class_doc = db.collection('classes').document(class_id).get()
+        class_doc = get_document(db.collection('classes').document(class_id))
         if not class_doc.exists:
             continue
         class_data = class_doc.to_dict()
@@ -1500,7 +1525,7 @@ def leave_class(class_id):
         return redirect(url_for('class_management'))
 
     # Remove the class_id from user's class_ids
-    db.collection('users').document(uid).update({
+    update_document(db.collection('users').document(uid), {
         'class_ids': firestore.ArrayRemove([class_id])
     })
 
@@ -1546,28 +1571,12 @@ def calendar_dashboard():
 @app.route('/api/calendar/events', methods=['GET'])
 @require_login
 def get_calendar_events():
-    """Get all calendar events for the logged-in user"""
+    """Get the logged-in user's calendar events, limited to the requested date range"""
     uid = session['uid']
     
     try:
-        # Get date range from query params (optional)
-        start_date = request.args.get('start')
-        end_date = request.args.get('end')
-        
-        events_ref = db.collection('calendar_events').where('uid', '==', uid)
-        
-        events = []
-        for doc in events_ref.stream():
-            event_data = doc.to_dict()
-            event_data['id'] = doc.id
-            
-            # Convert Firestore timestamps to ISO strings for FullCalendar
-            if 'start_date' in event_data and event_data['start_date']:
-                event_data['start'] = event_data['start_date'].isoformat() if hasattr(event_data['start_date'], 'isoformat') else event_data['start_date']
-            if 'end_date' in event_data and event_data['end_date']:
-                event_data['end'] = event_data['end_date'].isoformat() if hasattr(event_data['end_date'], 'isoformat') else event_data['end_date']
-            
-            events.append(event_data)
+        # Only events overlapping FullCalendar's visible window (start/end query params)
+        events = events_in_window(db, uid, request.args.get('start'), request.args.get('end'))
         
         return jsonify({'events': events})
     except Exception as e:
@@ -1617,7 +1626,9 @@ def create_calendar_event():
             'updated_at': firestore.SERVER_TIMESTAMP
         }
         
-        db.collection('calendar_events').document(event_id).set(event_data)
+        db.collection('calendar_events').document(event_id).set({
+            **event_data, **event_times(event_data['start_date'], event_data['end_date'])
+        })
         
         return jsonify({'success': True, 'event': event_data, 'id': event_id})
     except Exception as e:
@@ -1660,6 +1671,11 @@ def update_calendar_event(event_id):
             update_data['end_date'] = data['end_date']
         if 'all_day' in data:
             update_data['all_day'] = data['all_day']
+        if 'start_date' in data or 'end_date' in data:
+            update_data.update(event_times(
+                update_data.get('start_date', event_data.get('start_date')),
+                update_data.get('end_date', event_data.get('end_date'))
+            ))
         
         db.collection('calendar_events').document(event_id).update(update_data)
         
@@ -1714,6 +1730,7 @@ def move_calendar_event(event_id):
         update_data = {
             'start_date': data.get('start_date'),
             'end_date': data.get('end_date'),
+            **event_times(data.get('start_date'), data.get('end_date')),
             'updated_at': firestore.SERVER_TIMESTAMP
         }
         
@@ -1736,16 +1753,10 @@ def get_study_sessions():
     uid = session['uid']
     
     try:
-        # Get last 30 days by default
-        days = int(request.args.get('days', 30))
-        
-        sessions_ref = db.collection('study_sessions').where('uid', '==', uid).order_by('session_date', direction=firestore.Query.DESCENDING).limit(days)
-        
-        sessions = []
-        for doc in sessions_ref.stream():
-            session_data = doc.to_dict()
-            session_data['id'] = doc.id
-            sessions.append(session_data)
+        # Sessions from the last 30 days by default
+        days = max(1, min(int(request.args.get('days', 30)), 366))
+        since = (datetime.utcnow() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        sessions = study_log.recent_sessions(uid, since=since, limit=500)
         
         return jsonify({'sessions': sessions})
     except Exception as e:
@@ -1761,18 +1772,18 @@ def log_study_session():
     
     try:
         data = request.get_json()
+        session_date = data.get('session_date') or datetime.utcnow().isoformat()
+        try:
+            date.fromisoformat(str(session_date)[:10])
+        except ValueError:
+            return jsonify({'error': 'Invalid session_date'}), 400
         
-        session_id = str(uuid.uuid4())
-        session_data = {
-            'id': session_id,
-            'uid': uid,
-            'subject': data.get('subject', 'General'),
-            'duration_minutes': int(data.get('duration_minutes', 0)),
-            'session_date': data.get('session_date', datetime.utcnow().isoformat()),
-            'created_at': firestore.SERVER_TIMESTAMP
-        }
-        
-        db.collection('study_sessions').document(session_id).set(session_data)
+        session_data = study_log.log_session(
+            uid,
+            subject=data.get('subject', 'General'),
+            minutes=max(0, int(data.get('duration_minutes', 0))),
+            session_date=str(session_date)
+        )
         
         return jsonify({'success': True, 'session': session_data})
     except Exception as e:
@@ -1844,42 +1855,9 @@ def get_dashboard_study_time():
     uid = session['uid']
     
     try:
-        # Get last 7 days of study sessions
-        sessions_ref = db.collection('study_sessions').where('uid', '==', uid).order_by('session_date', direction=firestore.Query.DESCENDING).limit(30)
-        
-        # Aggregate by date
-        from collections import defaultdict
-        daily_totals = defaultdict(int)
-        
-        for doc in sessions_ref.stream():
-            session_data = doc.to_dict()
-            session_date = session_data.get('session_date', '')
-            
-            # Extract date part (YYYY-MM-DD)
-            if isinstance(session_date, str):
-                date_part = session_date.split('T')[0]
-            else:
-                date_part = datetime.now().strftime('%Y-%m-%d')
-            
-            daily_totals[date_part] += session_data.get('duration_minutes', 0)
-        
-        # Get last 7 days
-        today = datetime.now()
-        last_7_days = []
-        
-        for i in range(6, -1, -1):
-            date = (today - timedelta(days=i)).strftime('%Y-%m-%d')
-            last_7_days.append({
-                'date': date,
-                'minutes': daily_totals.get(date, 0)
-            })
-        
-        total_week = sum(day['minutes'] for day in last_7_days)
-        
-        return jsonify({
-            'daily': last_7_days,
-            'total_week_hours': round(total_week / 60, 1)
-        })
+        # Last 7 days and 4 weeks, read from the user's rollup document
+        today = get_current_time_for_user(get_user_data(uid) or {})[:10]
+        return jsonify(study_log.summary(uid, today))
     except Exception as e:
         logger.error(f"Get dashboard study time error: {str(e)}")
         return jsonify({'error': 'Failed to fetch study time data'}), 500
@@ -1924,36 +1902,10 @@ def get_upcoming_events():
     uid = session['uid']
     
     try:
-        # Get events from today onwards
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        week_later = today + timedelta(days=7)
+        # Next 7 days, soonest first, straight from the (uid, start_at) index
+        upcoming = fetch_upcoming_events(db, uid, days=7, limit=10)
         
-        events_ref = db.collection('calendar_events').where('uid', '==', uid)
-        
-        upcoming = []
-        for doc in events_ref.stream():
-            event_data = doc.to_dict()
-            event_data['id'] = doc.id
-            
-            # Parse start_date
-            start_date_str = event_data.get('start_date', '')
-            if start_date_str:
-                try:
-                    if isinstance(start_date_str, str):
-                        event_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
-                    else:
-                        event_date = start_date_str
-                    
-                    # Check if within next 7 days
-                    if today <= event_date <= week_later:
-                        upcoming.append(event_data)
-                except:
-                    pass
-        
-        # Sort by date
-        upcoming.sort(key=lambda x: x.get('start_date', ''))
-        
-        return jsonify({'events': upcoming[:10]})  # Limit to 10
+        return jsonify({'events': upcoming})
     except Exception as e:
         logger.error(f"Get upcoming events error: {str(e)}")
         return jsonify({'error': 'Failed to fetch upcoming events'}), 500
@@ -1973,45 +1925,49 @@ def community_dashboard():
         return redirect(url_for('logout'))
 
     # Get connections data
-    connections_data = get_connections_data(uid)
+    connections_data = get_connections_data(uid, user_data)
 
-    # Get user's bubbles (both created and joined)
+    # Get user's bubbles (both created and joined): one array-contains query on member_uids,
+    # so the cost depends on the user's bubble count rather than on every bubble
     user_bubbles = []
-    bubbles_ref = db.collection('bubbles')
-    for bubble_doc in bubbles_ref.stream():
+    member_of = db.collection(BUBBLES_COL).where('member_uids', 'array_contains', uid).stream()
+    for bubble_doc in member_of:
         bubble_data = bubble_doc.to_dict()
         member_uids = bubble_data.get('member_uids', [])
+        user_bubbles.append({
+            'id': bubble_doc.id,
+            'name': bubble_data.get('name'),
+            'description': bubble_data.get('description'),
+            'member_count': len(member_uids),
+            'created_at': bubble_data.get('created_at'),
+            'is_creator': bubble_data.get('creator_uid') == uid
+        })
+    if {b['id'] for b in user_bubbles} != set(user_data.get('bubbles') or []):
+        # users.bubbles disagrees with bubble membership; fixed by `flask repair-bubble-memberships`
+        logger.info("bubble_membership_drift", uid=uid)
 
-        # Show bubbles where user is a member (creator or joined via invitation)
-        if uid in member_uids:
-            user_bubbles.append({
-                'id': bubble_doc.id,
-                'name': bubble_data.get('name'),
-                'description': bubble_data.get('description'),
-                'member_count': len(member_uids),
-                'created_at': bubble_data.get('created_at'),
-                'is_creator': bubble_data.get('creator_uid') == uid
-            })
-
-    # Get user's bubble invitations
+    # Get user's bubble invitations (invitations, then their senders, each in one batched read)
     bubble_invitations = []
-    if hasattr(user_data, 'get') and user_data.get('pending_bubble_invitations'):
-        for invitation_id in user_data.get('pending_bubble_invitations', []):
-            try:
-                invite_doc = db.collection('bubble_invitations').document(invitation_id).get()
-                if invite_doc.exists:
-                    invitation = invite_doc.to_dict()
-                    sender_data = get_user_data(invitation.get('sender_uid'))
-                    sender_name = sender_data.get('name', 'Unknown User') if sender_data else 'Unknown User'
-                    bubble_invitations.append({
-                        'id': invitation_id,
-                        'bubble_name': invitation.get('bubble_name'),
-                        'sender_name': sender_name,
-                        'message': invitation.get('message'),
-                        'created_at': invitation.get('created_at')
-                    })
-            except Exception as e:
-                continue
+    invitation_ids = user_data.get('pending_bubble_invitations', []) if hasattr(user_data, 'get') else []
+    if invitation_ids:
+        try:
+            invite_docs = get_documents(db, [db.collection('bubble_invitations').document(i) for i in invitation_ids])
+            invitations = [(doc.id, doc.to_dict()) for doc in invite_docs if doc.exists]
+            sender_uids = list(dict.fromkeys(inv.get('sender_uid') for _, inv in invitations if inv.get('sender_uid')))
+            sender_docs = get_documents(db, [db.collection('users').document(s) for s in sender_uids])
+            senders = {s: doc.to_dict() for s, doc in zip(sender_uids, sender_docs) if doc.exists}
+            for invitation_id, invitation in invitations:
+                sender_data = senders.get(invitation.get('sender_uid'))
+                sender_name = sender_data.get('name', 'Unknown User') if sender_data else 'Unknown User'
+                bubble_invitations.append({
+                    'id': invitation_id,
+                    'bubble_name': invitation.get('bubble_name'),
+                    'sender_name': sender_name,
+                    'message': invitation.get('message'),
+                    'created_at': invitation.get('created_at')
+                })
+        except Exception as e:
+            logger.error("bubble_invitations_error", uid=uid, error=str(e))
 
     context = {
         'user': user_data,
@@ -2027,67 +1983,84 @@ def community_dashboard():
 
     return render_template('community_dashboard.html', **context)
 
-def get_connections_data(uid):
-    """Helper function to get formatted connections data"""
-    try:
-        user_data = get_user_data(uid)
-        if not user_data:
-            return {'accepted': [], 'pending_sent': [], 'pending_received': []}
+def _build_connections_data(uid, user_data):
+    """
+    Resolve every connection profile and pending request for a user.
+    All referenced user documents come from one batched get_all, and the
+    pending requests from one query run concurrently with it, so the number
+    of round trips does not grow with the number of connections.
+    """
+    connections = user_data.get('connections', {}) or {}
+    accepted = connections.get('accepted', [])
+    pending_sent = connections.get('pending_sent', [])
+    pending_received = connections.get('pending_received', [])
+
+    # One query for all pending requests to this user instead of one per sender
+    requests_future = None
+    if pending_received:
+        requests_future = fanout.submit(lambda: list(
+            db.collection('connections').where('receiver_uid', '==', uid).where('status', '==', 'pending').stream()
+        ))
+
+    conn_uids = list(dict.fromkeys(accepted + pending_sent + pending_received))
+    snapshots = get_documents(db, [db.collection('users').document(conn_uid) for conn_uid in conn_uids])
+    users_by_uid = {conn_uid: snap.to_dict() for conn_uid, snap in zip(conn_uids, snapshots) if snap.exists}
+
+    requests_by_sender = {}
+    if requests_future is not None:
+        for req in requests_future.result():
+            requests_by_sender.setdefault(req.to_dict().get('sender_uid'), req)
+
+    result = {
+        'accepted': [],
+        'pending_sent': [],
+        'pending_received': []
+    }
 
-        connections = user_data.get('connections', {})
+    # Get accepted connections
+    for conn_uid in accepted:
+        conn_data = users_by_uid.get(conn_uid)
+        if conn_data:
+            result['accepted'].append({
+                'uid': conn_uid,
+                'name': conn_data.get('name'),
+                'purpose_display': conn_data.get('purpose', '').replace('_', ' ').title(),
+                'last_active': conn_data.get('last_login_date')
+            })
 
-        # Get detailed info for each connection
-        result = {
-            'accepted': [],
-            'pending_sent': [],
-            'pending_received': []
-        }
+    # Get pending sent requests
+    for conn_uid in pending_sent:
+        conn_data = users_by_uid.get(conn_uid)
+        if conn_data:
+            result['pending_sent'].append({
+                'uid': conn_uid,
+                'name': conn_data.get('name'),
+                'purpose_display': conn_data.get('purpose', '').replace('_', ' ').title()
+            })
 
-        # Get accepted connections
-        for conn_uid in connections.get('accepted', []):
-            conn_data = get_user_data(conn_uid)
-            if conn_data:
-                profile = {
-                    'uid': conn_uid,
-                    'name': conn_data.get('name'),
-                    'purpose_display': conn_data.get('purpose', '').replace('_', ' ').title(),
-                    'last_active': conn_data.get('last_login_date')
-                }
-                result['accepted'].append(profile)
-
-        # Get pending sent requests
-        for conn_uid in connections.get('pending_sent', []):
-            conn_data = get_user_data(conn_uid)
-            if conn_data:
-                profile = {
-                    'uid': conn_uid,
-                    'name': conn_data.get('name'),
-                    'purpose_display': conn_data.get('purpose', '').replace('_', ' ').title()
-                }
-                result['pending_sent'].append(profile)
-
-        # Get pending received requests with connection IDs
-        for conn_uid in connections.get('pending_received', []):
-            # Find connection request
-            conn_requests = db.collection('connections').where('sender_uid', '==', conn_uid).where('receiver_uid', '==', uid).where('status', '==', 'pending').stream()
-            conn_request = None
-            for req in conn_requests:
-                conn_request = req
-                break
-
-            if conn_request:
-                conn_data = get_user_data(conn_uid)
-                if conn_data:
-                    profile = {
-                        'uid': conn_uid,
-                        'name': conn_data.get('name'),
-                        'purpose_display': conn_data.get('purpose', '').replace('_', ' ').title(),
-                        'connection_id': conn_request.id,
-                        'message': conn_request.to_dict().get('message', '')
-                    }
-                    result['pending_received'].append(profile)
+    # Get pending received requests with connection IDs
+    for conn_uid in pending_received:
+        conn_request = requests_by_sender.get(conn_uid)
+        conn_data = users_by_uid.get(conn_uid)
+        if conn_request and conn_data:
+            result['pending_received'].append({
+                'uid': conn_uid,
+                'name': conn_data.get('name'),
+                'purpose_display': conn_data.get('purpose', '').replace('_', ' ').title(),
+                'connection_id': conn_request.id,
+                'message': conn_request.to_dict().get('message', '')
+            })
+
+    return result
 
-        return result
+def get_connections_data(uid, user_data=None):
+    """Helper function to get formatted connections data"""
+    try:
+        if user_data is None:
+            user_data = get_user_data(uid)
+        if not user_data:
+            return {'accepted': [], 'pending_sent': [], 'pending_received': []}
+        return _build_connections_data(uid, user_data)
 
     except Exception as e:
         logger.error(f"Get connections data error: {str(e)}")
@@ -2135,13 +2108,25 @@ def ai_assistant_consent():
 
     if consent:
         # Update user with consent
-        db.collection('users').document(uid).update({'ai_consent': True})
+        update_document(db.collection('users').document(uid), {'ai_consent': True})
         flash('AI Assistant enabled! You can now use AI-powered academic planning and doubt resolution.', 'success')
     else:
         flash('AI Assistant access denied. You can enable it later from your profile.', 'info')
 
     return redirect(url_for('profile_dashboard'))
 
+def _wants_stream():
+    """Whether a chat request asked for a streamed (Server-Sent Events) answer"""
+    return bool((request.get_json(silent=True) or {}).get('stream')) or \
+        'text/event-stream' in request.headers.get('Accept', '')
+
+def _sse_response(events):
+    """Stream Server-Sent Events (with the request context, so handlers can still use it)"""
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/ai/chat/planning', methods=['POST'])
 @require_login
 def ai_chat_planning():
@@ -2164,13 +2149,23 @@ def ai_chat_planning():
         ai = get_ai_assistant()
         academic_context = ai.get_academic_context(user_data)
         
-        # Save user message
-        ai.save_message(uid, 'planning', 'user', message)
+        asked_at = get_current_time_for_user(user_data)
         
-        response = ai.generate_planning_response(message, academic_context)
+        def save(*reply):
+            # User message and answer are saved together, after the response is sent
+            chat_writer.submit(ai.save_exchange, uid, 'planning', chat_messages(('user', message, asked_at), *reply))
         
-        # Save AI response
-        ai.save_message(uid, 'planning', 'assistant', response)
+        if _wants_stream():
+            def on_complete(text):
+                save(('assistant', text, get_current_time_for_user(user_data)))
+                return {'response': text}
+            return _sse_response(relay_answer(
+                ai.stream_response('planning', message, academic_context), on_complete, on_abort=save,
+                route='planning', uid=uid
+            ))
+        
+        response = ai.generate_planning_response(message, academic_context)
+        save(('assistant', response, get_current_time_for_user(user_data)))
         
         return jsonify({'response': response})
     except Exception as e:
@@ -2199,13 +2194,23 @@ def ai_chat_doubt():
         ai = get_ai_assistant()
         academic_context = ai.get_academic_context(user_data)
         
-        # Save user message
-        ai.save_message(uid, 'doubt', 'user', message)
+        asked_at = get_current_time_for_user(user_data)
         
-        response = ai.generate_doubt_response(message, academic_context)
+        def save(*reply):
+            # User message and answer are saved together, after the response is sent
+            chat_writer.submit(ai.save_exchange, uid, 'doubt', chat_messages(('user', message, asked_at), *reply))
         
-        # Save AI response
-        ai.save_message(uid, 'doubt', 'assistant', response)
+        if _wants_stream():
+            def on_complete(text):
+                save(('assistant', text, get_current_time_for_user(user_data)))
+                return {'response': text}
+            return _sse_response(relay_answer(
+                ai.stream_response('doubt', message, academic_context), on_complete, on_abort=save,
+                route='doubt', uid=uid
+            ))
+        
+        response = ai.generate_doubt_response(message, academic_context)
+        save(('assistant', response, get_current_time_for_user(user_data)))
         
         return jsonify({'response': response})
     except Exception as e:
@@ -2240,11 +2245,14 @@ def get_threads(chatbot_type):
 
     try:
         ai = get_ai_assistant()
-        threads = ai.get_user_threads(uid, chatbot_type)
+        threads, next_cursor = ai.get_user_threads(
+            uid, chatbot_type, limit=request.args.get('limit', type=int), cursor=request.args.get('cursor')
+        )
         active_thread_id = ai.get_active_thread_id(uid, chatbot_type)
         return jsonify({
             'threads': threads,
-            'active_thread_id': active_thread_id
+            'active_thread_id': active_thread_id,
+            'next_cursor': next_cursor
         })
     except Exception as e:
         logger.error(f"Error loading threads: {str(e)}")
@@ -2384,71 +2392,35 @@ def search_people():
     school_filter = request.args.get('school')
     subject_filter = request.args.get('subject')
     academic_range = request.args.get('academic_range')
-
-    logger.info(f"MAIN Search request: uid={uid}, query='{query}'")
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', 20, type=int)
 
     if not query or len(query) < 2:
         return jsonify({'error': 'Search query must be at least 2 characters'}), 400
 
     try:
-        logger.info("MAIN: Starting user search query")
-        users_ref = db.collection('users')
-        users = []
-
-        logger.info("MAIN: Iterating through users collection")
-        for doc in users_ref.stream():
-            try:
-                user_data = doc.to_dict()
-                logger.debug(f"MAIN: Processing user: {doc.id}")
-
-                # Skip self
-                if doc.id == uid:
-                    logger.debug("MAIN: Skipping self")
-                    continue
-
-                # Check privacy settings
-                visibility = user_data.get('profile_visibility', {})
-                if not visibility.get('name', True):
-                    logger.debug(f"MAIN: Skipping user {doc.id} - name not visible")
-                    continue
-
-                # Name matching (case-insensitive)
-                name = user_data.get('name', '').lower()
-                if query.lower() not in name:
-                    logger.debug(f"MAIN: Name '{name}' doesn't contain query '{query.lower()}'")
-                    continue
-
-                logger.debug(f"MAIN: User {doc.id} matches search")
-
-                # Build profile for search results
-                profile = {
-                    'uid': doc.id,
-                    'name': user_data.get('name'),
-                    'purpose_display': user_data.get('purpose', '').replace('_', ' ').title(),
-                    'academic_summary': '',
-                    'connection_status': 'none'
-                }
-
-                users.append(profile)
-                logger.debug(f"MAIN: Added user {doc.id} to results")
-
-            except Exception as user_error:
-                logger.error(f"MAIN: Error processing user {doc.id}: {str(user_error)}")
-                continue
-
-        logger.info(f"MAIN: Found {len(users)} matching users")
-
-        # Limit results
-        users = users[:20]
+        entries, next_cursor = people_search.search(
+            query, grade=grade_filter, school=school_filter, subject=subject_filter,
+            limit=limit, cursor=cursor, exclude_uid=uid
+        )
+        users = [{
+            'uid': entry['uid'],
+            'name': entry.get('name'),
+            'purpose_display': entry.get('purpose_display', ''),
+            'academic_summary': '',
+            'connection_status': 'none'
+        } for entry in entries]
+        logger.info("people_search", uid=uid, results=len(users), has_more=bool(next_cursor))
 
         return jsonify({
             'results': users,
             'total': len(users),
-            'query': query
+            'query': query,
+            'next_cursor': next_cursor
         })
 
     except Exception as e:
-        logger.error(f"MAIN: People search error: {str(e)}")
+        logger.error("people_search_error", uid=uid, error=str(e))
         return jsonify({'error': 'Search failed', 'details': str(e)}), 500
 
 # ============================================================================
@@ -2488,9 +2460,10 @@ def create_bubble():
 
         # Add bubble to user's bubbles list
         user_ref = db.collection('users').document(uid)
-        user_ref.update({
+        update_document(user_ref, {
             'bubbles': firestore.ArrayUnion([bubble_id])
         })
+        _refresh_leaderboard_entry(uid)
 
         logger.info(f"Created bubble {bubble_id} by user {uid}")
 
@@ -2533,6 +2506,8 @@ def delete_bubble(bubble_id):
         batch.delete(db.collection('bubbles').document(bubble_id))
 
         batch.commit()
+        invalidate_document(*[db.collection('users').document(m) for m in member_uids])
+        bubble_leaderboards.remove(bubble_id)
 
         return jsonify({
             'success': True,
@@ -2554,9 +2529,11 @@ def update_leaderboard_consent():
 
         # Update user privacy settings
         user_ref = db.collection('users').document(uid)
-        user_ref.update({
+        update_document(user_ref, {
             'privacy_settings.allow_leaderboard': allow_leaderboard
         })
+        # Add to (or drop from) the user's bubble rankings
+        _refresh_leaderboard_entry(uid)
 
         return jsonify({
             'success': True,
@@ -2602,9 +2579,10 @@ def join_bubble_by_code():
         })
 
         # Add bubble to user's bubbles list
-        db.collection('users').document(uid).update({
+        update_document(db.collection('users').document(uid), {
             'bubbles': firestore.ArrayUnion([bubble_id])
         })
+        _refresh_leaderboard_entry(uid)
 
         return jsonify({
             'success': True,
@@ -2665,7 +2643,7 @@ def send_bubble_invitation(bubble_id):
         db.collection('bubble_invitations').document(invitation_id).set(invitation_data)
 
         # Add to receiver's pending invitations
-        db.collection('users').document(target_uid).update({
+        update_document(db.collection('users').document(target_uid), {
             'pending_bubble_invitations': firestore.ArrayUnion([invitation_id])
         })
 
@@ -2722,7 +2700,7 @@ def accept_bubble_invitation(invitation_id):
         })
 
         # Add bubble to user's bubbles
-        db.collection('users').document(uid).update({
+        update_document(db.collection('users').document(uid), {
             'bubbles': firestore.ArrayUnion([bubble_id]),
             'privacy_settings.allow_leaderboard': True  # They consented
         })
@@ -2734,9 +2712,10 @@ def accept_bubble_invitation(invitation_id):
         })
 
         # Remove from pending invitations
-        db.collection('users').document(uid).update({
+        update_document(db.collection('users').document(uid), {
             'pending_bubble_invitations': firestore.ArrayRemove([invitation_id])
         })
+        _refresh_leaderboard_entry(uid)
 
         return jsonify({
             'success': True,
@@ -2772,7 +2751,7 @@ def decline_bubble_invitation(invitation_id):
         })
 
         # Remove from pending invitations
-        db.collection('users').document(uid).update({
+        update_document(db.collection('users').document(uid), {
             'pending_bubble_invitations': firestore.ArrayRemove([invitation_id])
         })
 
@@ -2795,45 +2774,16 @@ def debug_search_people():
         return jsonify({'error': 'Search query must be at least 2 characters'}), 400
 
     try:
-        logger.info("DEBUG: Starting user search query")
-        users_ref = db.collection('users')
-        users = []
-
-        logger.info("DEBUG: Iterating through users collection")
-        for doc in users_ref.stream():
-            try:
-                user_data = doc.to_dict()
-                logger.debug(f"DEBUG: Processing user: {doc.id}")
-
-                # Check privacy settings
-                visibility = user_data.get('profile_visibility', {})
-                if not visibility.get('name', True):
-                    continue
-
-                # Name matching (case-insensitive)
-                name = user_data.get('name', '').lower()
-                if query.lower() not in name:
-                    continue
-
-                logger.debug(f"DEBUG: User {doc.id} matches search")
-
-                # Build profile for search results
-                profile = {
-                    'uid': doc.id,
-                    'name': user_data.get('name'),
-                    'purpose_display': user_data.get('purpose', '').replace('_', ' ').title(),
-                    'academic_summary': '',
-                    'connection_status': 'none'
-                }
-
-                users.append(profile)
-
-            except Exception as user_error:
-                logger.error(f"DEBUG: Error processing user {doc.id}: {str(user_error)}")
-                continue
+        entries, _ = people_search.search(query, limit=5)  # Limit for debug
+        users = [{
+            'uid': entry['uid'],
+            'name': entry.get('name'),
+            'purpose_display': entry.get('purpose_display', ''),
+            'academic_summary': '',
+            'connection_status': 'none'
+        } for entry in entries]
 
         logger.info(f"DEBUG: Found {len(users)} matching users")
-        users = users[:5]  # Limit for debug
 
         return jsonify({
             'results': users,
@@ -2884,64 +2834,28 @@ def academic_leaderboard():
         flash('User data not found', 'error')
         return redirect(url_for('logout'))
 
-    # Get all users for leaderboard
-    users_ref = db.collection('users')
-    leaderboard_data = []
-
-    for doc in users_ref.stream():
-        user_doc = doc.to_dict()
-        user_id = doc.id
-
-        # Calculate academic progress for each user
-        try:
-            progress = calculate_academic_progress(user_doc)
-            overall_score = progress.get('overall', 0)
-
-            leaderboard_data.append({
-                'uid': user_id,
-                'name': user_doc.get('name', 'Anonymous'),
-                'purpose_display': user_doc.get('purpose', '').replace('_', ' ').title(),
-                'overall_score': overall_score,
-                'total_chapters': progress.get('total_chapters', 0),
-                'completed_chapters': progress.get('total_completed', 0),
-                'grade': None,
-                'is_current_user': user_id == uid
-            })
-
-            # Add grade info if available
-            purpose = user_doc.get('purpose')
-            if purpose == 'high_school' and user_doc.get('highschool'):
-                leaderboard_data[-1]['grade'] = user_doc['highschool'].get('grade')
-            elif purpose == 'after_tenth' and user_doc.get('after_tenth'):
-                leaderboard_data[-1]['grade'] = user_doc['after_tenth'].get('grade')
-
-        except Exception as e:
-            # Skip users with calculation errors
-            continue
-
-    # Sort by overall score (highest first)
-    leaderboard_data.sort(key=lambda x: x['overall_score'], reverse=True)
+    # Read the precomputed leaderboard instead of scoring every user
+    leaderboard_data = global_leaderboard.top(50)
+    for entry in leaderboard_data:
+        entry['is_current_user'] = entry.get('uid') == uid
 
-    # Add rankings
-    for i, user in enumerate(leaderboard_data, 1):
-        user['rank'] = i
-
-    # Find current user's rank
-    current_user_rank = None
-    current_user_data = None
-    for user in leaderboard_data:
-        if user['is_current_user']:
-            current_user_rank = user['rank']
-            current_user_data = user
-            break
+    current_user_data = next((e for e in leaderboard_data if e['is_current_user']), None)
+    if current_user_data:
+        current_user_rank = current_user_data['rank']
+    else:
+        entry = global_leaderboard.get_entry(uid) or _refresh_leaderboard_entry(uid, user_data)
+        current_user_rank, current_user_data = global_leaderboard.rank_of(uid, entry)
+        if current_user_data:
+            current_user_data['is_current_user'] = True
+            current_user_data['rank'] = current_user_rank
 
     context = {
         'user': user_data,
         'name': user_data.get('name'),
-        'leaderboard': leaderboard_data[:50],  # Top 50
+        'leaderboard': leaderboard_data,  # Top 50
         'current_user_rank': current_user_rank,
         'current_user_data': current_user_data,
-        'total_participants': len(leaderboard_data)
+        'total_participants': global_leaderboard.total()
     }
 
     return render_template('academic_leaderboard.html', **context)
@@ -2976,50 +2890,17 @@ def bubble_detail(bubble_id):
     creator_data = get_user_data(bubble_data.get('creator_uid'))
     creator_name = creator_data.get('name', 'Unknown User') if creator_data else 'Unknown User'
 
-    # Get bubble members for leaderboard
-    member_uids = bubble_data.get('member_uids', [])
-    leaderboard_data = []
-
-    for member_uid in member_uids:
-        try:
-            member_data = get_user_data(member_uid)
-            if member_data:
-                # Check if user has consented to leaderboard participation
-                privacy_settings = member_data.get('privacy_settings', {})
-                allow_leaderboard = privacy_settings.get('allow_leaderboard', False)
-
-                if allow_leaderboard:
-                    progress = calculate_academic_progress(member_data)
-                    overall_score = progress.get('overall', 0)
-
-                    leaderboard_data.append({
-                        'uid': member_uid,
-                        'name': member_data.get('name', 'Anonymous'),
-                        'purpose_display': member_data.get('purpose', '').replace('_', ' ').title(),
-                        'overall_score': overall_score,
-                        'total_chapters': progress.get('total_chapters', 0),
-                        'completed_chapters': progress.get('total_completed', 0),
-                        'grade': None,
-                        'is_current_user': member_uid == uid
-                    })
-
-                    # Add grade info if available
-                    purpose = member_data.get('purpose')
-                    if purpose == 'high_school' and member_data.get('highschool'):
-                        leaderboard_data[-1]['grade'] = member_data['highschool'].get('grade')
-                    elif purpose == 'after_tenth' and member_data.get('after_tenth'):
-                        leaderboard_data[-1]['grade'] = member_data['after_tenth'].get('grade')
-
-        except Exception as e:
-            # Skip members with calculation errors
-            continue
-
-    # Sort by overall score (highest first)
-    leaderboard_data.sort(key=lambda x: x['overall_score'], reverse=True)
-
-    # Add rankings
-    for i, user in enumerate(leaderboard_data, 1):
-        user['rank'] = i
+    # Ranking comes from the bubble's materialized document (one read); it is rebuilt
+    # from member documents only when missing or older than the staleness bound
+    ranking = bubble_leaderboards.get(bubble_id)
+    if bubble_leaderboards.is_stale(ranking):
+        ranking = _recompute_bubble_leaderboard(bubble_id, bubble_data)
+    member_uids = set(bubble_data.get('member_uids', []))
+    leaderboard_data = rank_entries(
+        e for member_uid, e in (ranking.get('entries') or {}).items() if member_uid in member_uids
+    )
+    for entry in leaderboard_data:
+        entry['is_current_user'] = entry.get('uid') == uid
 
     # Find current user's rank
     current_user_rank = None
@@ -3050,6 +2931,33 @@ def bubble_detail(bubble_id):
 
     return render_template('bubble_detail.html', **context)
 
+@app.route('/api/bubbles/<bubble_id>/leaderboard/recompute', methods=['POST'])
+@require_login
+def recompute_bubble_leaderboard(bubble_id):
+    """Rebuild a bubble's ranking from member documents now (bubble creator only)"""
+    uid = session['uid']
+
+    try:
+        bubble_doc = db.collection('bubbles').document(bubble_id).get()
+        if not bubble_doc.exists:
+            return jsonify({'error': 'Bubble not found'}), 404
+
+        bubble_data = bubble_doc.to_dict()
+        if bubble_data.get('creator_uid') != uid:
+            return jsonify({'error': 'Not authorized to recompute this leaderboard'}), 403
+
+        ranking = _recompute_bubble_leaderboard(bubble_id, bubble_data)
+        logger.info("bubble_leaderboard_recomputed", bubble_id=bubble_id, entries=len(ranking['entries']))
+
+        return jsonify({
+            'success': True,
+            'participants': len(ranking['entries']),
+            'computed_at': ranking['computed_at']
+        })
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to recompute leaderboard: {str(e)}'}), 500
+
 @app.route('/api/connections/send', methods=['POST'])
 @require_login
 def send_connection_request():
@@ -3104,10 +3012,10 @@ def send_connection_request():
         db.collection('connections').document(connection_id).set(connection_data)
 
         # Update user connection lists
-        db.collection('users').document(uid).update({
+        update_document(db.collection('users').document(uid), {
             'connections.pending_sent': firestore.ArrayUnion([target_uid])
         })
-        db.collection('users').document(target_uid).update({
+        update_document(db.collection('users').document(target_uid), {
             'connections.pending_received': firestore.ArrayUnion([uid])
         })
 
@@ -3162,6 +3070,7 @@ def accept_connection_request(connection_id):
         })
 
         batch.commit()
+        invalidate_document(db.collection('users').document(uid), db.collection('users').document(sender_uid))
 
         return jsonify({'success': True, 'message': 'Connection accepted'})
 
@@ -3208,6 +3117,7 @@ def decline_connection_request(connection_id):
         })
 
         batch.commit()
+        invalidate_document(db.collection('users').document(uid), db.collection('users').document(sender_uid))
 
         return jsonify({'success': True, 'message': 'Connection request declined'})
 
@@ -3248,6 +3158,7 @@ def block_connection(connection_id):
         batch.delete(db.collection('connections').document(connection_id))
 
         batch.commit()
+        invalidate_document(db.collection('users').document(uid), db.collection('users').document(other_uid))
 
         return jsonify({'success': True, 'message': 'User blocked'})
 
@@ -3266,60 +3177,7 @@ def get_connections():
         if not user_data:
             return jsonify({'error': 'User data not found'}), 404
 
-        connections = user_data.get('connections', {})
-
-        # Get detailed info for each connection
-        result = {
-            'accepted': [],
-            'pending_sent': [],
-            'pending_received': []
-        }
-
-        # Get accepted connections
-        for conn_uid in connections.get('accepted', []):
-            conn_data = get_user_data(conn_uid)
-            if conn_data:
-                profile = {
-                    'uid': conn_uid,
-                    'name': conn_data.get('name'),
-                    'purpose_display': conn_data.get('purpose', '').replace('_', ' ').title(),
-                    'last_active': conn_data.get('last_login_date')
-                }
-                result['accepted'].append(profile)
-
-        # Get pending sent requests
-        for conn_uid in connections.get('pending_sent', []):
-            conn_data = get_user_data(conn_uid)
-            if conn_data:
-                profile = {
-                    'uid': conn_uid,
-                    'name': conn_data.get('name'),
-                    'purpose_display': conn_data.get('purpose', '').replace('_', ' ').title()
-                }
-                result['pending_sent'].append(profile)
-
-        # Get pending received requests with connection IDs
-        for conn_uid in connections.get('pending_received', []):
-            # Find connection request
-            conn_requests = db.collection('connections').where('sender_uid', '==', conn_uid).where('receiver_uid', '==', uid).where('status', '==', 'pending').stream()
-            conn_request = None
-            for req in conn_requests:
-                conn_request = req
-                break
-
-            if conn_request:
-                conn_data = get_user_data(conn_uid)
-                if conn_data:
-                    profile = {
-                        'uid': conn_uid,
-                        'name': conn_data.get('name'),
-                        'purpose_display': conn_data.get('purpose', '').replace('_', ' ').title(),
-                        'connection_id': conn_request.id,
-                        'message': conn_request.to_dict().get('message', '')
-                    }
-                    result['pending_received'].append(profile)
-
-        return jsonify(result)
+        return jsonify(_build_connections_data(uid, user_data))
 
     except Exception as e:
         logger.error(f"Get connections error: {str(e)}")
@@ -3372,14 +3230,14 @@ def profile_edit():
         action = request.form.get('action')
         if action == 'remove_pfp':
             # Remove profile picture from database
-            db.collection('users').document(uid).update({'profile_picture': None})
+            update_document(db.collection('users').document(uid), {'profile_picture': None})
             flash('Profile picture removed successfully!', 'success')
             return redirect(url_for('profile_edit'))
         
         # Handle banner removal
         if action == 'remove_banner':
             # Remove profile banner from database
-            db.collection('users').document(uid).update({'profile_banner': None})
+            update_document(db.collection('users').document(uid), {'profile_banner': None})
             flash('Profile banner removed successfully!', 'success')
             return redirect(url_for('profile_edit'))
         
@@ -3412,7 +3270,7 @@ def profile_edit():
                     profile_picture_path = f"profile_pictures/{filename}"
                     
                     # Update user data with profile picture path
-                    db.collection('users').document(uid).update({'profile_picture': profile_picture_path})
+                    update_document(db.collection('users').document(uid), {'profile_picture': profile_picture_path})
                     
                     logger.info(f"Profile picture saved successfully: {profile_picture_path}")
                     
@@ -3452,7 +3310,7 @@ def profile_edit():
                         file_path = os.path.join(upload_dir, filename)
                         file.save(file_path)
                         profile_banner_path = f"profile_banners/{filename}"
-                        db.collection('users').document(uid).update({'profile_banner': profile_banner_path})
+                        update_document(db.collection('users').document(uid), {'profile_banner': profile_banner_path})
                         logger.info(f"Profile banner saved without processing: {profile_banner_path}")
                         flash('Profile banner uploaded successfully!', 'success')
                         return redirect(url_for('profile_edit'))
@@ -3507,7 +3365,7 @@ def profile_edit():
                     profile_banner_path = f"profile_banners/{filename}"
                     
                     # Update user data with profile banner path
-                    db.collection('users').document(uid).update({'profile_banner': profile_banner_path})
+                    update_document(db.collection('users').document(uid), {'profile_banner': profile_banner_path})
                     
                     logger.info(f"Profile banner processed and saved successfully: {profile_banner_path}")
                     
@@ -3527,7 +3385,9 @@ def profile_edit():
             'certificates': [c.strip() for c in request.form.get('certificates', '').split(',') if c.strip()],
             'achievements': [a.strip() for a in request.form.get('achievements', '').split(',') if a.strip()]
         }
-        db.collection('users').document(uid).update(updates)
+        update_document(db.collection('users').document(uid), updates)
+        _refresh_leaderboard_entry(uid)
+        _refresh_search_entry(uid)
         flash('Profile updated successfully!', 'success')
         return redirect(url_for('profile_resume'))
     user_data = get_user_data(uid)
@@ -3575,40 +3435,15 @@ def academic_dashboard():
     if not user_data:
         flash('User data not found', 'error')
         return redirect(url_for('logout'))
-    purpose = user_data.get('purpose')
-    syllabus_purpose = {
-        'high_school': 'highschool',
-        'exam_prep': 'exam',
-        'after_tenth': 'after_tenth'
-    }.get(purpose, purpose)
-    syllabus = {}
-    if purpose == 'high_school' and user_data.get('highschool'):
-        hs = user_data['highschool']
-        syllabus = get_syllabus(syllabus_purpose, hs.get('board'), hs.get('grade'))
-    elif purpose == 'exam_prep' and user_data.get('exam'):
-        syllabus = get_syllabus(syllabus_purpose, user_data['exam'].get('type'))
-    elif purpose == 'after_tenth' and user_data.get('after_tenth'):
-        at = user_data['after_tenth']
-        syllabus = get_syllabus(syllabus_purpose, 'CBSE', at.get('grade'), at.get('subjects', []))
+    compiled = SYLLABUS_INDEX.for_user(user_data)
+    syllabus = compiled.syllabus
     progress_data = calculate_academic_progress(user_data)
     chapters_completed = user_data.get('chapters_completed', {})
-    # Merge institution and class exclusions for UI consistency
-    all_exclusions = {}
-    inst_id = user_data.get('institution_id')
-    class_ids = user_data.get('class_ids', [])
-    if inst_id:
-        try:
-            inst_excl = db.collection('institutions').document(inst_id).collection('syllabus_exclusions').document('current').get()
-            if inst_excl.exists: all_exclusions.update(inst_excl.to_dict().get('chapters', {}))
-        except: pass
-    if class_ids:
-        for cid in class_ids:
-            try:
-                class_excl = db.collection('classes').document(cid).collection('excluded_chapters').document('current').get()
-                if class_excl.exists: all_exclusions.update(class_excl.to_dict().get('chapters', {}))
-            except: pass
-    academic_exclusions = user_data.get('academic_exclusions', {})
-    all_exclusions.update(academic_exclusions)
+    # Merge institution and class exclusions for UI consistency (served from the shared resolver cache)
+    all_exclusions = merge_exclusions(
+        exclusion_resolver.resolve_for_user(user_data),
+        user_data.get('academic_exclusions', {})
+    )
     # Build flat chapter list with completion status for left panel
     syllabus_flat = {}
     for subject_name, subject_data in syllabus.items():
@@ -3633,7 +3468,7 @@ def academic_dashboard():
     avg_percentage = 0
     avg_percentage = calculate_average_percentage(results)
     # Subjects for goal dropdown
-    subjects = list(syllabus.keys())
+    subjects = list(compiled.subjects)
     context = {
         'user': user_data,
         'name': user_data.get('name'),
@@ -3664,7 +3499,7 @@ def master_library():
     context = {
         'user': user_data,
         'name': user_data.get('name'),
-        'library_data': ACADEMIC_SYLLABI,
+        'library_json': Markup(SYLLABUS_INDEX.store.skeleton_json()),
         'active_nav': 'library',
         'in_institution': bool(user_data.get('institution_id')),
         'has_class': bool(user_data.get('class_ids'))
@@ -3679,31 +3514,15 @@ def chapter_detail(subject_name, chapter_name):
     if not user_data:
         flash('User data not found', 'error')
         return redirect(url_for('logout'))
-    purpose = user_data.get('purpose')
-    syllabus_purpose = {
-        'high_school': 'highschool',
-        'exam_prep': 'exam',
-        'after_tenth': 'after_tenth'
-    }.get(purpose, purpose)
-    syllabus = {}
-    if purpose == 'high_school' and user_data.get('highschool'):
-        hs = user_data['highschool']
-        syllabus = get_syllabus(syllabus_purpose, hs.get('board'), hs.get('grade'))
-    elif purpose == 'exam_prep' and user_data.get('exam'):
-        syllabus = get_syllabus(syllabus_purpose, user_data['exam'].get('type'))
-    elif purpose == 'after_tenth' and user_data.get('after_tenth'):
-        at = user_data['after_tenth']
-        syllabus = get_syllabus(syllabus_purpose, 'CBSE', at.get('grade'), at.get('subjects', []))
-    subject_data = syllabus.get(subject_name, {})
-    if not subject_data:
+    compiled = SYLLABUS_INDEX.for_user(user_data)
+    if not compiled.subject(subject_name):
         flash('Subject not found', 'error')
         return redirect(url_for('academic_dashboard'))
-    chapters = subject_data.get('chapters', {})
-    chapter_data = chapters.get(chapter_name, {})
+    chapter_data = compiled.chapter(subject_name, chapter_name)
     if not chapter_data:
         flash('Chapter not found', 'error')
         return redirect(url_for('academic_dashboard'))
-    topics = chapter_data.get('topics', [])
+    topics = SYLLABUS_INDEX.topics(compiled, subject_name, chapter_name)
     chapters_completed = user_data.get('chapters_completed', {})
     is_completed = chapters_completed.get(subject_name, {}).get(chapter_name, False)
     context = {
@@ -3733,7 +3552,9 @@ def toggle_chapter_completion():
         chapters_completed[subject_name] = {}
     current_status = chapters_completed[subject_name].get(chapter_name, False)
     chapters_completed[subject_name][chapter_name] = not current_status
-    db.collection('users').document(uid).update({'chapters_completed': chapters_completed})
+    update_document(db.collection('users').document(uid), {'chapters_completed': chapters_completed})
+    user_data['chapters_completed'] = chapters_completed
+    _refresh_leaderboard_entry(uid, user_data)
     # Redirect back to academic dashboard (the chapter list lives there now)
     return redirect(url_for('academic_dashboard'))
 
@@ -3750,7 +3571,7 @@ def toggle_chapter_exclusion():
         return redirect(url_for('academic_dashboard'))
     key = f"{subject_name}::{chapter_name}"
     user_ref = db.collection('users').document(uid)
-    user_doc = user_ref.get()
+    user_doc = get_document(user_ref)
     user_data = user_doc.to_dict() if user_doc.exists else {}
     exclusions = user_data.get('academic_exclusions', {})
     # Toggle exclusion (REVERSIBLE)
@@ -3758,7 +3579,9 @@ def toggle_chapter_exclusion():
         exclusions.pop(key)
     else:
         exclusions[key] = True
-    user_ref.update({'academic_exclusions': exclusions})
+    update_document(user_ref, {'academic_exclusions': exclusions})
+    user_data['academic_exclusions'] = exclusions
+    _refresh_leaderboard_entry(uid, user_data)
     return redirect(url_for('academic_dashboard'))
 
 # ============================================================
@@ -3797,7 +3620,7 @@ def study_time():
     # Get user data for timezone conversion
     user_data = get_user_data(uid)
 
-    db.collection('users').document(uid).set({
+    set_document(db.collection('users').document(uid), {
         'study_mode': {'total_seconds': Increment(seconds)}
     }, merge=True)
 
@@ -3810,17 +3633,20 @@ def study_time():
     if session_break:
         hour_id = f"{hour_id}-{int(now.timestamp())}"
 
-    session_ref = db.collection('users').document(uid).collection('study_sessions').document(hour_id)
     session_data = {
         'start_time': get_current_time_for_user(user_data),  # Use user's timezone
-        'duration_seconds': firestore.Increment(seconds),
         'last_updated': now.isoformat()
     }
     if local_hour is not None:
         session_data['local_hour'] = local_hour
     if local_weekday is not None:
         session_data['local_weekday'] = local_weekday
-    session_ref.set(session_data, merge=True)
+    # Session and daily/weekly rollups are written in one batch; a session is counted in the heatmap once
+    if study_log.record_time(uid, hour_id, session_data, seconds):
+        try:
+            heatmaps.record_session(user_data or {}, local_weekday, local_hour, when=now)
+        except Exception as e:
+            logger.error("heatmap_record_failed", uid=uid, error=str(e))
     return jsonify(ok=True)
 
 @app.route('/study-mode/todo/add', methods=['POST'])
@@ -3877,7 +3703,7 @@ def goals_dashboard():
                     'completed': False,
                     'created_at': datetime.utcnow().isoformat()
                 })
-                db.collection('users').document(uid).update({'goals': goals})
+                update_document(db.collection('users').document(uid), {'goals': goals})
                 flash('Goal added!', 'success')
         elif action == 'toggle':
             goal_id = int(request.form.get('goal_id'))
@@ -3887,12 +3713,12 @@ def goals_dashboard():
                 if g.get('id') == goal_id:
                     g['completed'] = not g.get('completed', False)
                     break
-            db.collection('users').document(uid).update({'goals': goals})
+            update_document(db.collection('users').document(uid), {'goals': goals})
         elif action == 'delete':
             goal_id = int(request.form.get('goal_id'))
             user_data = get_user_data(uid)
             goals = [g for g in user_data.get('goals', []) if g.get('id') != goal_id]
-            db.collection('users').document(uid).update({'goals': goals})
+            update_document(db.collection('users').document(uid), {'goals': goals})
             flash('Goal deleted!', 'success')
         return redirect(url_for('academic_dashboard'))
     # GET fallback — redirect to academic dashboard
@@ -3926,7 +3752,7 @@ def tasks_dashboard():
                         'updated_at': datetime.utcnow().isoformat()
                     }
                     tasks.append(new_task)
-                    db.collection('users').document(uid).update({'tasks': tasks})
+                    update_document(db.collection('users').document(uid), {'tasks': tasks})
                     flash('Task added successfully!', 'success')
                 else:
                     flash('Task title is required', 'error')
@@ -3938,12 +3764,12 @@ def tasks_dashboard():
                         t['completed'] = not t.get('completed', False)
                         t['updated_at'] = datetime.utcnow().isoformat()
                         break
-                db.collection('users').document(uid).update({'tasks': tasks})
+                update_document(db.collection('users').document(uid), {'tasks': tasks})
                 
             elif action == 'delete':
                 task_id = request.form.get('task_id')
                 tasks = [t for t in tasks if str(t.get('id')) != str(task_id)]
-                db.collection('users').document(uid).update({'tasks': tasks})
+                update_document(db.collection('users').document(uid), {'tasks': tasks})
                 flash('Task deleted!', 'success')
         except Exception as e:
             logger.error(f"Task action error: {str(e)}")
@@ -3993,7 +3819,7 @@ def results_dashboard():
                 'exam_date': exam_date,
                 'created_at': datetime.utcnow().isoformat()
             })
-            db.collection('users').document(uid).update({
+            update_document(db.collection('users').document(uid), {
                 'exam_results': results
             })
             flash('Result added!', 'success')
@@ -4004,7 +3830,7 @@ def results_dashboard():
                 r for r in results
                 if str(r.get('id')) != str(result_id)
             ]
-            db.collection('users').document(uid).update({
+            update_document(db.collection('users').document(uid), {
                 'exam_results': results
             })
             flash('Result deleted!', 'success')
@@ -4197,7 +4023,7 @@ def toggle_career_interest(career_id):
     else:
         saved.append(career_id)
     interests['careers'] = saved
-    db.collection('users').document(uid).update({'interests': interests})
+    update_document(db.collection('users').document(uid), {'interests': interests})
     return redirect(url_for('career_detail', career_id=career_id))
 
 @app.route('/course/<course_id>')
@@ -4288,7 +4114,7 @@ def settings():
                     'email_notifications': email_notifications
                 }
             }
-            db.collection('users').document(uid).update(updates)
+            update_document(db.collection('users').document(uid), updates)
             flash('General settings updated successfully!', 'success')
         elif action == 'academic':
             # Handle academic configuration change with WARNING
@@ -4323,13 +4149,17 @@ def settings():
                     'stream': stream,
                     'subjects': []
                 }
-            db.collection('users').document(uid).update(updates)
+            update_document(db.collection('users').document(uid), updates)
+            _refresh_leaderboard_entry(uid, {**user_data, **updates})
+            _refresh_search_entry(uid, {**user_data, **updates})
             flash('Academic configuration updated. All previous progress has been reset.', 'success')
         elif action == 'account':
             # Handle account updates
             name = request.form.get('name')
             if name:
-                db.collection('users').document(uid).update({'name': name})
+                update_document(db.collection('users').document(uid), {'name': name})
+                _refresh_leaderboard_entry(uid, {**user_data, 'name': name})
+                _refresh_search_entry(uid, {**user_data, 'name': name})
                 flash('Profile name updated!', 'success')
         return redirect(url_for('settings'))
     # Get current settings or defaults
@@ -4484,16 +4314,17 @@ def send_nudge():
     if not inst_id:
         return jsonify({'success': False, 'message': 'No institution context found.'}), 400
 
-    # Create notification
-    db.collection('institutions').document(inst_id).collection('notifications').add({
-        'recipient_uid': student_uid,
+    # Create notification and push it to the student's open streams
+    notification = {
         'sender_uid': uid,
         'sender_name': profile.get('name', 'Instructor'),
         'message': message,
         'type': 'nudge',
-        'read': False,
+        'institution_id': inst_id,
         'created_at': datetime.utcnow().isoformat()
-    })
+    }
+    notification['id'] = inbox.send(student_uid, notification)
+    notification_broker.publish(f"user:{student_uid}", {'notification': notification})
     return jsonify({'success': True, 'message': 'Nudge sent!'})
 
 @app.route('/institution/broadcast', methods=['POST'])
@@ -4508,36 +4339,36 @@ def broadcast_message():
     if not message:
         return jsonify({'error': 'Message required'}), 400
     
-    # Get target students
-    student_uids = []
+    # Target students are resolved and notified on the broadcast workers
     if class_id:
-        class_doc = db.collection(CLASSES_COL).document(class_id).get()
-        if class_doc.exists:
-            student_uids = class_doc.to_dict().get('student_uids', [])
+        def recipients():
+            class_doc = get_document(db.collection(CLASSES_COL).document(class_id))
+            return class_doc.to_dict().get('student_uids', []) if class_doc.exists else []
     else:
         # Broadcast to all students in institution
-        users_ref = db.collection('users').where('institution_id', '==', inst_id)
-        student_uids = [u.id for u in users_ref.stream()]
-        
-    if student_uids:
-        batch = db.batch()
-        notif_ref = db.collection('institutions').document(inst_id).collection('notifications')
-        for s_uid in student_uids:
-            batch.set(notif_ref.document(), {
-                'recipient_uid': s_uid,
-                'sender_uid': uid,
-                'sender_name': profile.get('name', 'Instructor'),
-                'message': message,
-                'type': 'broadcast',
-                'read': False,
-                'created_at': datetime.utcnow().isoformat()
-            })
-        batch.commit()
-        
-    flash(f'Message sent to {len(student_uids)} students!', 'success')
+        def recipients():
+            users_ref = db.collection('users').where('institution_id', '==', inst_id)
+            return [u.id for u in users_ref.stream()]
+
+    job_id = broadcasts.start(
+        inst_id, {'uid': uid, 'name': profile.get('name', 'Instructor')}, message, recipients, class_id=class_id
+    )
+    flash(f'Broadcast queued (job {job_id}). Students will receive it shortly.', 'success')
     dest = 'institution_admin_dashboard' if profile.get('account_type') == 'admin' else 'institution_teacher_dashboard'
     return redirect(url_for(dest))
 
+@app.route('/institution/broadcasts/<job_id>')
+@require_institution_role(['teacher', 'admin'])
+def broadcast_status(job_id):
+    """Delivery progress of a broadcast job"""
+    profile = _get_any_profile(session['uid'])
+    job = broadcasts.get(profile.get('institution_id'), job_id) if profile.get('institution_id') else None
+    if not job:
+        return jsonify({'error': 'Broadcast not found'}), 404
+    return jsonify({key: job.get(key) for key in (
+        'id', 'status', 'total', 'delivered', 'failed', 'class_id', 'created_at', 'finished_at'
+    )})
+
 @app.route('/institution/class/<class_id>/syllabus', methods=['GET', 'POST'])
 @require_institution_role(['teacher', 'admin'])
 def manage_class_syllabus(class_id):
@@ -4545,7 +4376,7 @@ def manage_class_syllabus(class_id):
     profile = _get_any_profile(uid)
     inst_id = profile.get('institution_id')
     # Verify class belongs to institution
-    class_doc = db.collection(CLASSES_COL).document(class_id).get()
+    class_doc = get_document(db.collection(CLASSES_COL).document(class_id))
     if not class_doc.exists or class_doc.to_dict().get('institution_id') != inst_id:
         abort(403)
     class_data = class_doc.to_dict()
@@ -4563,23 +4394,15 @@ def manage_class_syllabus(class_id):
         else:
             exclusions.pop(exclusion_key, None)
         exclusions_ref.set({'chapters': exclusions})
+        exclusion_resolver.invalidate_class(class_id)
+        _refresh_leaderboard_entries(class_data.get('student_uids', []))
         flash(f'Chapter {chapter} {"excluded" if action == "exclude" else "included"}!', 'success')
         return redirect(url_for('manage_class_syllabus', class_id=class_id))
     # Get current exclusions
     exclusions_doc = db.collection('classes').document(class_id).collection('excluded_chapters').document('current').get()
     exclusions = exclusions_doc.to_dict().get('chapters', {}) if exclusions_doc.exists else {}
     # Get syllabus based on class metadata
-    purpose = class_data.get('purpose', 'highschool')
-    syllabus_purpose = {
-        'high_school': 'highschool',
-        'exam_prep': 'exam',
-        'after_tenth': 'after_tenth'
-    }.get(purpose, purpose)
-    board = class_data.get('board', 'CBSE')
-    grade = class_data.get('grade', '10')
-    syllabus = get_syllabus(syllabus_purpose, board, grade)
-    if not syllabus:
-        syllabus = {} # Fallback to empty if not found
+    syllabus = SYLLABUS_INDEX.for_class(class_data).syllabus
     context = {
         'profile': profile,
         'class_id': class_id,
@@ -4596,7 +4419,7 @@ def student_detail(student_uid):
     profile = _get_any_profile(uid)
     inst_id = profile.get('institution_id')
     # Get student data
-    student_doc = db.collection('users').document(student_uid).get()
+    student_doc = get_document(db.collection('users').document(student_uid))
     if not student_doc.exists:
         abort(404)
     student_data = student_doc.to_dict()
@@ -4609,8 +4432,7 @@ def student_detail(student_uid):
     results = student_data.get('exam_results', [])
     recent_results = sorted(results, key=lambda x: x.get('date', ''), reverse=True)[:5]
     # Get study sessions (if available)
-    sessions_ref = db.collection('users').document(student_uid).collection('study_sessions').order_by('start_time', direction=firestore.Query.DESCENDING).limit(10)
-    sessions = [s.to_dict() for s in sessions_ref.stream()]
+    sessions = study_log.recent_sessions(student_uid, limit=10)
     context = {
         'profile': profile,
         'student': student_data,
@@ -4630,42 +4452,30 @@ def all_students():
     if not inst_id:
         flash('No institution assigned.', 'error')
         return redirect(url_for('profile_dashboard'))
-    # Get all students in institution
-    students_ref = db.collection('users').where('institution_id', '==', inst_id)
-    students_docs = list(students_ref.stream())
-    students_list = []
-    for s_doc in students_docs:
-        s_data = s_doc.to_dict()
-        s_data['uid'] = s_doc.id
-        # Calculate quick stats
-        progress = calculate_academic_progress(s_data, uid=s_doc.id)
-        s_data['progress_overall'] = progress.get('overall', 0)
-        # Last login
-        last_login = s_data.get('last_login_date', '')
-        if last_login:
-            try:
-                last_date = datetime.fromisoformat(last_login).date() if isinstance(last_login, (str, datetime)) else last_login
-                days_ago = (date.today() - last_date).days
-                s_data['days_inactive'] = days_ago
-            except:
-                s_data['days_inactive'] = 999
-        else:
-            s_data['days_inactive'] = 999
-        # Get class names
-        class_ids = s_data.get('class_ids', [])
-        class_names = []
-        for cid in class_ids:
-            c_doc = db.collection(CLASSES_COL).document(cid).get()
-            if c_doc.exists:
-                class_names.append(c_doc.to_dict().get('name', cid))
-        s_data['class_names'] = ', '.join(class_names) if class_names else 'No class'
-        students_list.append(s_data)
-    # Sort by name
-    students_list.sort(key=lambda x: x.get('name', ''))
+    # Classes and students in two queries, joined in memory
+    roster = Roster.load(db, inst_id, referenced_classes=True)
+    rows = roster.student_rows()
+
+    def attach_progress(page_rows):
+        # Score only the rows that need it in one pass (batched exclusion reads, compiled syllabi)
+        progress_by_uid = calculate_academic_progress_bulk((row['uid'], roster.students[row['uid']]) for row in page_rows)
+        for row in page_rows:
+            row['progress_overall'] = (progress_by_uid.get(row['uid']) or {}).get('overall', 0)
+
+    sort = request.args.get('sort', 'name')
+    if sort == 'progress':
+        attach_progress(rows)
+    students_list, pagination = paginate(
+        rows, sort=sort, order=request.args.get('order', 'asc'),
+        page=request.args.get('page', 1), per_page=request.args.get('per_page', DEFAULT_PAGE_SIZE)
+    )
+    if sort != 'progress':
+        attach_progress(students_list)
     context = {
         'profile': profile,
         'students': students_list,
-        'total_students': len(students_list),
+        'total_students': pagination['total'],
+        'pagination': pagination,
     }
     return render_template('all_students.html', **context)
 
@@ -4679,24 +4489,14 @@ def institution_teacher_settings():
     # Get institution data
     institution = {}
     if inst_id:
-        inst_doc = db.collection('institutions').document(inst_id).get()
+        inst_doc = get_document(db.collection('institutions').document(inst_id))
         if inst_doc.exists:
             institution = inst_doc.to_dict()
 
-    # Get teacher's classes
-    classes_docs = db.collection('classes').where('teacher_id', '==', uid).stream()
-    classes = [{'id': c.id, **c.to_dict()} for c in classes_docs]
-
-    # Get all students in institution
-    students_docs = db.collection('users').where('institution_id', '==', inst_id).stream()
-    students = [{'id': s.id, **s.to_dict()} for s in students_docs]
-
-    logger.info("fetched_students", count=len(students), institution_id=inst_id)
-
-    # Populate students for each class
-    for cls in classes:
-        cls['students'] = [s['id'] for s in students if cls['id'] in s.get('class_ids', [])]
-        logger.info("class_student_count", class_name=cls.get('name', cls['id']), class_id=cls['id'], student_count=len(cls['students']))
+    # Teacher's classes and the institution's students, joined in memory
+    roster = Roster.load(db, inst_id, teacher_id=uid)
+    classes = roster.classes_with_students()
+    logger.info("fetched_students", count=len(roster.students), institution_id=inst_id, classes=len(classes))
 
     context = {
         'profile': profile,
@@ -4718,24 +4518,14 @@ def institution_admin_settings():
     # Get institution data
     institution = {}
     if inst_id:
-        inst_doc = db.collection('institutions').document(inst_id).get()
+        inst_doc = get_document(db.collection('institutions').document(inst_id))
         if inst_doc.exists:
             institution = inst_doc.to_dict()
 
-    # Get all classes in institution
-    classes_docs = db.collection('classes').where('institution_id', '==', inst_id).stream()
-    classes = [{'id': c.id, **c.to_dict()} for c in classes_docs]
-
-    # Get all students in institution
-    students_docs = db.collection('users').where('institution_id', '==', inst_id).stream()
-    students = [{'id': s.id, **s.to_dict()} for s in students_docs]
-
-    logger.info("fetched_students", count=len(students), institution_id=inst_id)
-
-    # Populate students for each class
-    for cls in classes:
-        cls['students'] = [s['id'] for s in students if cls['id'] in s.get('class_ids', [])]
-        logger.info("class_student_count", class_name=cls.get('name', cls['id']), class_id=cls['id'], student_count=len(cls['students']))
+    # Classes and students of the institution, joined in memory
+    roster = Roster.load(db, inst_id)
+    classes = roster.classes_with_students()
+    logger.info("fetched_students", count=len(roster.students), institution_id=inst_id, classes=len(classes))
 
     context = {
         'profile': profile,
@@ -4800,6 +4590,7 @@ def create_sclera_thread(mode):
         # Create thread document
         thread_ref = db.collection('users').document(uid).collection('sclera_threads').document()
         thread_ref.set(thread_data)
+        active_threads.set(uid, mode, thread_ref.id)
 
         return jsonify({
             'success': True,
@@ -4834,6 +4625,7 @@ def delete_sclera_thread(mode, thread_id):
             return jsonify({'success': False, 'error': 'Thread not found'}), 404
 
         thread_ref.delete()
+        active_threads.discard(uid, mode, thread_id)
 
         return jsonify({'success': True})
 
@@ -4931,9 +4723,12 @@ def get_sclera_threads(mode):
             return jsonify({'error': 'Access denied: Institutional mode requires administrator privileges'}), 403
 
     try:
-        # Get all threads for this mode
+        # One page of threads for this mode, most recent first (indexed on mode + last_message_at)
         threads_ref = db.collection('users').document(uid).collection('sclera_threads')
-        thread_docs = list(threads_ref.where('mode', '==', mode).stream())
+        thread_docs, next_cursor = thread_page(
+            threads_ref.where('mode', '==', mode),
+            limit=request.args.get('limit', type=int), cursor=request.args.get('cursor')
+        )
 
         threads = []
         for doc in thread_docs:
@@ -4947,21 +4742,43 @@ def get_sclera_threads(mode):
                 'message_count': thread_data.get('message_count', 0)
             })
 
-        # Sort by last message (most recent first)
-        threads.sort(key=lambda x: x.get('last_message_at', ''), reverse=True)
-
-        # Find active thread (most recent one)
-        active_thread_id = threads[0]['thread_id'] if threads else None
-
         return jsonify({
             'threads': threads,
-            'active_thread_id': active_thread_id
+            'active_thread_id': active_threads.get(uid, mode),
+            'next_cursor': next_cursor
         })
 
     except Exception as e:
         logger.error(f"SCLERA get threads error: {str(e)}")
         return jsonify({'threads': [], 'active_thread_id': None, 'error': str(e)}), 500
 
+@app.route('/api/sclera/threads/<mode>/<thread_id>/switch', methods=['POST'])
+@require_login
+def switch_sclera_thread(mode, thread_id):
+    """Make a SCLERA AI thread the one new messages go to"""
+    uid = session['uid']
+    if mode not in ['academic_planner', 'institutional', 'doubt_solver']:
+        return jsonify({'error': 'Invalid mode'}), 400
+
+    # Check institutional access
+    if mode == 'institutional':
+        profile = _get_any_profile(uid)
+        institutional_roles = ['administrator', 'curriculum_director', 'institution_teacher', 'admin']
+        if not profile or profile.get('account_type') not in institutional_roles:
+            return jsonify({'error': 'Access denied: Institutional mode requires administrator privileges'}), 403
+
+    try:
+        thread_doc = db.collection('users').document(uid).collection('sclera_threads').document(thread_id).get()
+        if not thread_doc.exists or thread_doc.to_dict().get('mode') != mode:
+            return jsonify({'success': False, 'error': 'Thread not found'}), 404
+
+        active_threads.set(uid, mode, thread_id)
+        return jsonify({'success': True})
+
+    except Exception as e:
+        logger.error(f"SCLERA switch thread error: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/test/gemini', methods=['GET'])
 def test_gemini():
     """Test endpoint to list all available Gemini models"""
@@ -5057,66 +4874,103 @@ def sclera_chat(mode):
         return jsonify({'error': 'Message is required'}), 400
 
     try:
-        # Get threads for this mode
+        # The active thread comes from its pointer, not from listing the mode's threads
         threads_ref = db.collection('users').document(uid).collection('sclera_threads')
-        thread_docs = list(threads_ref.where('mode', '==', mode).stream())
-
-        # Determine which thread to use
-        if force_new_thread or not thread_docs:
-            # Create new thread
-            thread_data = {
+        active_thread_id = None if force_new_thread else active_threads.get(uid, mode)
+
+        # Determine which thread to use; every exchange carries the mode, so a thread stays
+        # listed even if the exchange that created it was lost
+        thread_fields = {'mode': mode}
+        pointer = []
+        if not active_thread_id:
+            # New thread: created with the first exchange, in the same batch as its stored pointer
+            thread_fields.update({
                 'title': f'New {mode.replace("_", " ").title()} Conversation',
-                'mode': mode,
-                'created_at': get_current_time_for_user({'uid': uid}),  # Use user's timezone
-                'last_message_at': get_current_time_for_user({'uid': uid}),  # Use user's timezone
-                'message_count': 0
-            }
+                'created_at': get_current_time_for_user({'uid': uid})  # Use user's timezone
+            })
             thread_ref = threads_ref.document()
-            thread_ref.set(thread_data)
+            pointer = [active_threads.pointer(uid, mode, thread_ref.id)]
+            # Sends made before that batch lands find the new thread through the disk cache
+            active_threads.remember(uid, mode, thread_ref.id)
             logger.info(f"Created new thread {thread_ref.id} for {mode}")
         else:
-            # Use most recent thread (sort by last_message_at descending)
-            thread_docs.sort(key=lambda doc: doc.to_dict().get('last_message_at', ''), reverse=True)
-            thread_ref = thread_docs[0].reference
-
-        # Save user message
-        message_data = {
-            'role': 'user',
-            'content': message,
-            'timestamp': get_current_time_for_user({'uid': uid})  # Use user's timezone
-        }
-        thread_ref.collection('messages').add(message_data)
+            thread_ref = threads_ref.document(active_thread_id)
+
+        asked_at = get_current_time_for_user({'uid': uid})  # Use user's timezone
+
+        def save(*reply):
+            # User message, answer and thread metadata go in one batch, after the response is sent
+            messages = chat_messages(('user', message, asked_at), *reply)
+            chat_writer.submit(write_exchange, db, thread_ref, messages, {
+                **thread_fields, 'last_message_at': messages[-1][1]['timestamp']
+            }, pointer)
+
+        def save_response(ai_response):
+            save(('assistant', ai_response, get_current_time_for_user({'uid': uid})))  # Use user's timezone
+            return {
+                'response': ai_response,
+                'thread_id': thread_ref.id  # Return thread ID so frontend knows which thread was used
+            }
 
-        # Update thread metadata
-        thread_ref.update({
-            'last_message_at': get_current_time_for_user({'uid': uid}),  # Use user's timezone
-            'message_count': firestore.Increment(1)
-        })
+        if _wants_stream():
+            # Chunks go out as they are generated; the formatted answer is saved and sent once complete
+            return _sse_response(relay_answer(
+                stream_sclera_response(message, mode, uid),
+                lambda text: save_response(_format_sclera_response(mode, text)), on_abort=save,
+                route='sclera', mode=mode, uid=uid
+            ))
 
         # Generate AI response using the correct AI assistant
-        ai_response = generate_sclera_response(message, mode, uid)
+        return jsonify(save_response(generate_sclera_response(message, mode, uid)))
 
-        # Save AI response
-        ai_message_data = {
-            'role': 'assistant',
-            'content': ai_response,
-            'timestamp': get_current_time_for_user({'uid': uid})  # Use user's timezone
-        }
-        thread_ref.collection('messages').add(ai_message_data)
+    except Exception as e:
+        logger.error(f"SCLERA chat error: {str(e)}")
+        return jsonify({'error': 'Failed to process message', 'details': str(e)}), 500
 
-        # Update thread metadata again
-        thread_ref.update({
-            'last_message_at': get_current_time_for_user({'uid': uid})  # Use user's timezone
-        })
+def _sclera_context(ai_assistant, mode, uid):
+    """Prompt context for a SCLERA mode: the user's name, role and academic context"""
+    # Get user context
+    user_data = get_user_data(uid)
+    profile = _get_any_profile(uid)
 
-        return jsonify({
-            'response': ai_response,
-            'thread_id': thread_ref.id  # Return thread ID so frontend knows which thread was used
-        })
+    # Create context based on mode
+    context = {
+        'user_name': user_data.get('name', 'Student') if user_data else 'Student',
+        'purpose': profile.get('account_type', 'student') if profile else 'student',
+        'mode': mode  # Add mode to context for better model responses
+    }
 
+    # Add academic context if available
+    try:
+        academic_context = ai_assistant.get_academic_context(user_data or {})
+        context.update(academic_context)
     except Exception as e:
-        logger.error(f"SCLERA chat error: {str(e)}")
-        return jsonify({'error': 'Failed to process message', 'details': str(e)}), 500
+        logger.warning(f"Could not load academic context: {str(e)}")
+
+    if mode == 'institutional':
+        context['purpose'] = 'institutional'
+    return context
+
+def _format_sclera_response(mode, response):
+    """Format response based on mode"""
+    if mode == 'institutional' and not any(keyword in response.lower() for keyword in ['analysis', 'assessment', 'recommendations']):
+        response = (
+            f"# Analysis Results\n\n"
+            f"{response}\n\n"
+            "## Strategic Insights\n\n"
+            "Based on your query, the institutional data suggests the following key points:"
+        )
+    return response
+
+def stream_sclera_response(message, mode, uid):
+    """Stream a SCLERA answer chunk by chunk (the full text when the assistant is unavailable)"""
+    ai_assistant = get_ai_assistant()
+    if not ai_assistant.ai_available:
+        # Unavailability is explained in one piece, exactly as in the non-streaming reply
+        yield generate_sclera_response(message, mode, uid)
+        return
+    kind = 'doubt' if mode == 'doubt_solver' else 'planning'
+    yield from ai_assistant.stream_response(kind, message, _sclera_context(ai_assistant, mode, uid))
 
 def generate_sclera_response(message, mode, uid):
     """Generate AI response based on mode and context"""
@@ -5155,46 +5009,16 @@ def generate_sclera_response(message, mode, uid):
             )
 
         try:
-            # Get user context
-            user_data = get_user_data(uid)
-            profile = _get_any_profile(uid)
-
-            # Create context based on mode
-            context = {
-                'user_name': user_data.get('name', 'Student') if user_data else 'Student',
-                'purpose': profile.get('account_type', 'student') if profile else 'student',
-                'mode': mode  # Add mode to context for better model responses
-            }
-
-            # Add academic context if available
-            try:
-                academic_context = ai_assistant.get_academic_context(user_data or {})
-                context.update(academic_context)
-            except Exception as e:
-                logger.warning(f"Could not load academic context: {str(e)}")
+            context = _sclera_context(ai_assistant, mode, uid)
 
             # Generate response based on mode
             try:
-                if mode == 'academic_planner':
-                    response = ai_assistant.generate_planning_response(message, context)
-                elif mode == 'doubt_solver':
+                if mode == 'doubt_solver':
                     response = ai_assistant.generate_doubt_response(message, context)
-                elif mode == 'institutional':
-                    context['purpose'] = 'institutional'
-                    response = ai_assistant.generate_planning_response(message, context)
                 else:
                     response = ai_assistant.generate_planning_response(message, context)
 
-                # Format response based on mode
-                if mode == 'institutional' and not any(keyword in response.lower() for keyword in ['analysis', 'assessment', 'recommendations']):
-                    response = (
-                        f"# Analysis Results\n\n"
-                        f"{response}\n\n"
-                        "## Strategic Insights\n\n"
-                        "Based on your query, the institutional data suggests the following key points:"
-                    )
-
-                return response
+                return _format_sclera_response(mode, response)
                 
             except Exception as e:
                 error_details = f"Error in {mode} response generation: {str(e)}"
@@ -5333,52 +5157,88 @@ def rename_sclera_thread(mode, thread_id):
 @app.route('/api/notifications', methods=['GET'])
 @require_login
 def get_notifications():
-    """API endpoint for students to fetch their notifications"""
+    """
+    API endpoint for students to poll their notifications.
+    Returns the unread count from the inbox counter. With nothing unread
+    'notifications' is an empty list (so the tray clears); otherwise the
+    newest unread notifications are only queried when something arrived
+    after `since` (the latest_at of the previous poll), and 'notifications'
+    is null when nothing did.
+    """
     uid = session['uid']
-    profile = _get_any_profile(uid)
-    if not profile:
-        return jsonify({'notifications': []})
-    inst_id = profile.get('institution_id')
-    if not inst_id:
-        return jsonify({'notifications': []})
-    # Get all unread notifications for this user in their institution
-    # We remove order_by to avoid the need for a composite index
     try:
-        notifs_ref = db.collection('institutions').document(inst_id).collection('notifications').where('recipient_uid', '==', uid).where('read', '==', False)
-        notifications = []
-        # Calling stream() with a simple query (single field filter or multiple equality filters)
-        # usually doesn't require a composite index unless combined with order_by or inequalities.
-        for n in notifs_ref.stream():
-            n_data = n.to_dict()
-            n_data['id'] = n.id
-            notifications.append(n_data)
-        # Sort in memory by created_at descending
-        notifications.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        # Limit to 10 for the response
-        return jsonify({'notifications': notifications[:10]})
+        unread, latest_at = inbox.state(uid)
+        if not unread:
+            notifications = []
+        elif latest_at == request.args.get('since'):
+            notifications = None
+        else:
+            notifications = inbox.latest_unread(uid)
+        return jsonify({'unread': unread, 'latest_at': latest_at, 'notifications': notifications})
     except Exception as e:
-        print(f"Notification error: {e}")
-        return jsonify({'notifications': [], 'error': str(e)})
+        logger.error("notifications_fetch_error", uid=uid, error=str(e))
+        return jsonify({'unread': 0, 'latest_at': None, 'notifications': [], 'error': str(e)})
+
+# Comment lines keep idle streams open through proxies
+_SSE_KEEPALIVE_SECONDS = 15
+
+@app.route('/api/notifications/stream')
+@require_login
+def notifications_stream():
+    """
+    Server-Sent Events stream of new notifications.
+    Each stream closes after SSE_STREAM_SECONDS and the browser reconnects;
+    when the worker is full the client gets 503 and keeps polling instead.
+    """
+    uid = session['uid']
+    if notification_broker.connection_count() >= config[env].SSE_MAX_CONNECTIONS:
+        return jsonify({'error': 'Too many open streams'}), 503
+    inst_id = (get_user_data(uid) or {}).get('institution_id')
+    channels = [f"user:{uid}"] + ([f"institution:{inst_id}"] if inst_id else [])
+    return Response(_notification_events(uid, channels), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def _notification_events(uid, channels):
+    """
+    SSE body for one stream. The subscription is opened when the body starts,
+    so a response that is never iterated (client gone, a failing after_request
+    hook) never holds a connection slot.
+    """
+    subscription = notification_broker.subscribe(channels)
+    logger.info("sse_connected", uid=uid, connections=notification_broker.connection_count())
+    try:
+        yield "retry: 5000\n\n"
+        deadline = time.monotonic() + config[env].SSE_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            message = subscription.get(timeout=_SSE_KEEPALIVE_SECONDS)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            # Broadcast chunks list their recipients; other students on the channel skip them
+            recipients = message.get('recipients')
+            if recipients is not None and uid not in recipients:
+                continue
+            yield f"event: notification\ndata: {json.dumps(message['notification'])}\n\n"
+    finally:
+        subscription.close()
+        logger.info("sse_disconnected", uid=uid, connections=notification_broker.connection_count())
 
 @app.route('/api/notifications/<notif_id>/mark_read', methods=['POST'])
 @require_login
 def mark_notification_read(notif_id):
     """Mark a notification as read"""
-    uid = session['uid']
-    profile = _get_any_profile(uid)
-    inst_id = profile.get('institution_id')
-    if not inst_id:
-        return jsonify({'error': 'No institution'}), 400
-    notif_ref = db.collection('institutions').document(inst_id).collection('notifications').document(notif_id)
-    notif_doc = notif_ref.get()
-    if notif_doc.exists:
-        notif_data = notif_doc.to_dict()
-        # Verify this notification belongs to the user
-        if notif_data.get('recipient_uid') == uid:
-            notif_ref.update({'read': True})
-            return jsonify({'success': True})
+    if inbox.mark_read(session['uid'], notif_id):
+        return jsonify({'success': True})
     return jsonify({'error': 'Not found'}), 404
 
+@app.route('/api/notifications/mark_all_read', methods=['POST'])
+@require_login
+def mark_all_notifications_read():
+    """Mark every unread notification as read"""
+    return jsonify({'success': True, 'marked': inbox.mark_all_read(session['uid'])})
+
 # ============================================================================
 # ERROR HANDLERS
 
@@ -5437,12 +5297,169 @@ def log_request():
 @app.after_request
 def log_response(response):
     """Log all responses"""
+    read_stats = request_read_stats()
     logger.info("request_completed",
                 method=request.method,
                 path=request.path,
                 status_code=response.status_code,
-                ip=request.remote_addr)
+                ip=request.remote_addr,
+                firestore_reads=read_stats['reads'],
+                firestore_reads_saved=read_stats['reads_saved'])
+    response.headers['X-Firestore-Reads-Saved'] = str(read_stats['reads_saved'])
     return response
+
+# ============================================================================
+# MAINTENANCE COMMANDS
+
+# ============================================================================
+@app.cli.command('rebuild-leaderboard')
+def rebuild_leaderboard_command():
+    """Recompute every global leaderboard entry from user documents"""
+    users = [(doc.id, doc.to_dict()) for doc in db.collection('users').stream()]
+    written, skipped, removed = global_leaderboard.rebuild(users, calculate_academic_progress_bulk(users))
+    logger.info("leaderboard_rebuilt", written=written, skipped=skipped, removed=removed)
+    print(f"Leaderboard rebuilt: {written} entries written, {skipped} skipped, {removed} deleted users removed")
+
+@app.cli.command('rebuild-people-search')
+def rebuild_people_search_command():
+    """Rebuild the people-search index from user documents"""
+    users = ((doc.id, doc.to_dict()) for doc in db.collection('users').stream())
+    written, removed = people_search.rebuild(users)
+    logger.info("people_search_rebuilt", written=written, removed=removed)
+    print(f"People search rebuilt: {written} entries written, {removed} hidden, unnamed or deleted users removed")
+
+@app.cli.command('repair-bubble-memberships')
+@click.option('--dry-run', is_flag=True, help='Report differences without writing')
+def repair_bubble_memberships_command(dry_run):
+    """Reconcile users.bubbles with bubbles.member_uids"""
+    users = {doc.id: doc.to_dict() for doc in db.collection('users').stream()}
+    bubbles = {doc.id: doc.to_dict() for doc in db.collection(BUBBLES_COL).stream()}
+    plan = plan_membership_repairs(users, bubbles)
+    counts = {key: sum(len(ids) for ids in changes.values()) for key, changes in plan.items()}
+    written = 0 if dry_run else apply_membership_repairs(db, plan)
+    logger.info("bubble_memberships_repaired", dry_run=dry_run, written=written, **counts)
+    print(f"Bubble memberships: {counts['add_to_user']} missing user entries, "
+          f"{counts['remove_from_user']} stale user entries, {counts['remove_from_bubble']} dangling members; "
+          f"{'dry run, nothing written' if dry_run else f'{written} documents updated'}")
+
+@app.cli.command('rebuild-heatmaps')
+def rebuild_heatmaps_command():
+    """Backfill institution and class heatmap buckets from recent study sessions"""
+    window_start = (datetime.utcnow() - timedelta(days=heatmaps.window_days)).strftime('%Y-%m-%d')
+
+    def sessions():
+        for user_doc in db.collection('users').stream():
+            user_data = user_doc.to_dict()
+            if not user_data.get('institution_id') and not user_data.get('class_ids'):
+                continue
+            docs = user_doc.reference.collection('study_sessions')\
+                .where('last_updated', '>=', window_start).stream()
+            for s in docs:
+                s_data = s.to_dict()
+                # Session ids start with the UTC day they were created on
+                yield user_data, s.id[:10], s_data.get('local_weekday'), s_data.get('local_hour')
+
+    written = heatmaps.rebuild(sessions())
+    logger.info("heatmaps_rebuilt", written=written)
+    print(f"Heatmaps rebuilt: {written} bucket documents written")
+
+@app.cli.command('roll-off-heatmaps')
+def roll_off_heatmaps_command():
+    """Drop heatmap days older than the window (run daily)"""
+    removed = heatmaps.roll_off()
+    logger.info("heatmaps_rolled_off", removed=removed)
+    print(f"Heatmaps: {removed} expired day buckets removed")
+
+@app.cli.command('rebuild-study-rollups')
+@click.option('--skip-legacy', is_flag=True, help='Do not copy sessions from the old top-level collection first')
+def rebuild_study_rollups_command(skip_legacy):
+    """Move legacy study sessions into per-user stores and recompute daily/weekly study rollups"""
+    copied = 0 if skip_legacy else migrate_legacy_sessions(db, db.collection('study_sessions').stream())
+    users_done = sessions_counted = 0
+    for user_doc in db.collection('users').stream():
+        today = get_current_time_for_user(user_doc.to_dict() or {})[:10]
+        sessions_counted += study_log.rebuild(user_doc.id, today)
+        users_done += 1
+    logger.info("study_rollups_rebuilt", legacy_copied=copied, users=users_done, sessions=sessions_counted)
+    print(f"Study rollups: {copied} legacy sessions copied, {users_done} users rebuilt from {sessions_counted} sessions")
+
+@app.cli.command('refresh-analytics')
+@click.option('--institution', 'institution_ids', multiple=True, help='Institution to refresh (default: all)')
+def refresh_analytics_command(institution_ids):
+    """Recompute institution-wide dashboard analytics snapshots"""
+    if not institution_ids:
+        institution_ids = [doc.id for doc in db.collection(INSTITUTIONS_COL).stream()]
+    for institution_id in institution_ids:
+        snapshot = analytics_jobs.run_now(institution_id)
+        status = f"{snapshot['duration_ms']} ms" if snapshot else 'skipped (already running or failed)'
+        print(f"{institution_id}: {status}")
+    # Class-scoped snapshots teachers viewed recently
+    queued = analytics_jobs.refresh_due()
+    logger.info("analytics_refreshed", institutions=len(institution_ids), queued=queued)
+
+@app.cli.command('backfill-class-invites')
+def backfill_class_invites_command():
+    """Copy each class's active invite code onto the class document"""
+    classes = [{**doc.to_dict(), 'id': doc.id} for doc in db.collection(CLASSES_COL).stream()]
+    pending = [c for c in classes if not c.get('invite_code')]
+    _attach_invite_codes(pending)
+    updates = [c for c in pending if c.get('invite_code')]
+    for start in range(0, len(updates), 400):
+        batch = db.batch()
+        for cls in updates[start:start + 400]:
+            batch.update(db.collection(CLASSES_COL).document(cls['id']), {'invite_code': cls['invite_code']})
+        batch.commit()
+    logger.info("class_invites_backfilled", updated=len(updates), without_invite=len(pending) - len(updates))
+    print(f"Class invites: {len(updates)} classes updated, {len(pending) - len(updates)} have no active invite")
+
+@app.cli.command('migrate-notification-inbox')
+def migrate_notification_inbox_command():
+    """Copy unread institution notifications into user inboxes and rebuild the counters"""
+    copied = 0
+    recipients = set()
+    for inst_doc in db.collection(INSTITUTIONS_COL).stream():
+        unread = inst_doc.reference.collection('notifications').where('read', '==', False).stream()
+        batch = db.batch()
+        pending = 0
+        for n in unread:
+            n_data = n.to_dict()
+            recipient = n_data.pop('recipient_uid', None)
+            if not recipient:
+                continue
+            # Same id as the source notification, so the migration can be re-run
+            batch.set(db.collection('users').document(recipient).collection(INBOX_COL).document(n.id), {
+                **n_data, 'recipient_uid': recipient, 'institution_id': inst_doc.id
+            })
+            recipients.add(recipient)
+            copied += 1
+            pending += 1
+            if pending >= 400:
+                batch.commit()
+                batch = db.batch()
+                pending = 0
+        if pending:
+            batch.commit()
+    for recipient in recipients:
+        inbox.recount(recipient)
+    logger.info("notification_inbox_migrated", copied=copied, users=len(recipients))
+    print(f"Notification inbox: {copied} unread notifications copied for {len(recipients)} users")
+
+@app.cli.command('backfill-calendar-times')
+def backfill_calendar_times_command():
+    """Add indexed start_at/end_at timestamps to calendar events stored with string dates only"""
+    updated = backfill_event_times(db)
+    logger.info("calendar_times_backfilled", updated=updated)
+    print(f"Calendar events: {updated} events updated")
+
+@app.cli.command('build-syllabus-store')
+def build_syllabus_store_command():
+    """Compile templates/academic_data.py into the on-disk syllabus store"""
+    from templates.academic_data import ACADEMIC_SYLLABI
+    path = config[env].SYLLABUS_STORE_PATH
+    size = build_syllabus_store(ACADEMIC_SYLLABI, path, syllabus_source_hash())
+    logger.info("syllabus_store_built", path=path, bytes=size)
+    print(f"Syllabus store written to {path} ({size} bytes)")
+
 if __name__ == '__main__':
     env = os.environ.get('FLASK_ENV', 'production')
     debug = env == 'development'
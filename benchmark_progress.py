@@ -0,0 +1,177 @@
+"""
+Academic Progress Benchmark
+Compares per-student progress calculation with the bulk (cohort) engine on synthetic students.
+
+The per-student path is today's calculate_academic_progress called once per
+student: exclusions come from a shared ExclusionResolver (one get_all per
+distinct institution/class combination, cached afterwards) and each student is
+scored with compute_progress_compiled. The bulk path resolves exclusions with
+ExclusionResolver.resolve_bulk (chunked get_all) and scores with
+compute_progress_bulk. Both start with an empty resolver cache. Firestore is
+replaced by an in-memory store that counts round trips; wall time is modeled as
+CPU time plus round trips x --rtt-ms.
+
+Usage: python benchmark_progress.py [--students 10000] [--rtt-ms 10]
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+
+# Add the project root to the path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from templates.academic_data import get_syllabus
+from utils.exclusions import ExclusionResolver, exclusion_key
+from utils.progress import compute_progress_bulk, compute_progress_compiled, syllabus_for_user
+
+
+class _Snapshot:
+    def __init__(self, ref, data):
+        self.reference = ref
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class _Ref:
+    def __init__(self, store, path):
+        self._store = store
+        self.path = path
+
+    def collection(self, name):
+        return _Collection(self._store, f"{self.path}/{name}")
+
+    def get(self):
+        self._store.round_trips += 1
+        return _Snapshot(self, self._store.docs.get(self.path))
+
+
+class _Collection:
+    def __init__(self, store, path):
+        self._store = store
+        self._path = path
+
+    def document(self, doc_id):
+        return _Ref(self._store, f"{self._path}/{doc_id}")
+
+
+class MemoryStore:
+    """In-memory stand-in for the Firestore calls used here, counting round trips"""
+
+    def __init__(self):
+        self.docs = {}
+        self.round_trips = 0
+
+    def collection(self, name):
+        return _Collection(self, name)
+
+    def get_all(self, refs):
+        self.round_trips += 1
+        return [_Snapshot(ref, self.docs.get(ref.path)) for ref in refs]
+
+
+def make_cohort(count, seed=42):
+    """Build synthetic students spread over every syllabus, institution and class"""
+    rng = random.Random(seed)
+    store = MemoryStore()
+    profiles = [
+        {'purpose': 'high_school', 'highschool': {'board': 'CBSE', 'grade': g}} for g in ('9', '10', '11', '12')
+    ] + [
+        {'purpose': 'exam_prep', 'exam': {'type': t}} for t in ('JEE', 'NEET')
+    ]
+    grade_11 = list(get_syllabus('highschool', 'CBSE', '11').keys())
+    profiles.append({'purpose': 'after_tenth', 'after_tenth': {'grade': '11', 'stream': 'Science', 'subjects': grade_11[:3]}})
+
+    # 5 institutions x 20 classes, each with its own exclusion document
+    classes = []
+    for i in range(5):
+        inst_id = f"inst{i}"
+        profile = rng.choice(profiles)
+        keys = [f"{s}::{c}" for s, d in syllabus_for_user(profile).items() for c in d.get('chapters', {})]
+        store.docs[f"institutions/{inst_id}/syllabus_exclusions/current"] = {
+            'chapters': {k: True for k in rng.sample(keys, min(len(keys), 2))}
+        }
+        for c in range(20):
+            class_id = f"{inst_id}-class{c}"
+            store.docs[f"classes/{class_id}/excluded_chapters/current"] = {
+                'chapters': {k: True for k in rng.sample(keys, min(len(keys), rng.randint(0, 4)))}
+            }
+            classes.append((inst_id, class_id, profile))
+
+    students = []
+    for i in range(count):
+        inst_id, class_id, profile = rng.choice(classes)
+        syllabus = syllabus_for_user(profile)
+        completed = {}
+        personal = {}
+        for subject, data in syllabus.items():
+            chapters = list(data.get('chapters', {}))
+            completed[subject] = {c: rng.random() < 0.5 for c in chapters}
+            if chapters and rng.random() < 0.2:
+                personal[f"{subject}::{rng.choice(chapters)}"] = True
+        results = [
+            {'score': rng.randint(30, 100), 'max_score': 100, 'date': f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"}
+            for _ in range(rng.randint(0, 12))
+        ]
+        students.append((f"user{i}", {
+            **profile,
+            'institution_id': inst_id,
+            'class_ids': [class_id],
+            'chapters_completed': completed,
+            'academic_exclusions': personal,
+            'exam_results': results
+        }))
+    return store, students
+
+
+def per_student(store, students):
+    """The current single-student path: cached exclusion resolution and the compiled syllabus, one student at a time"""
+    resolver = ExclusionResolver(store)
+    return {uid: compute_progress_compiled(user_data, resolver.resolve_for_user(user_data))
+            for uid, user_data in students}
+
+
+def bulk(store, students):
+    """The new path: batched exclusion resolution and cohort scoring"""
+    shared = ExclusionResolver(store).resolve_bulk(exclusion_key(u) for _, u in students)
+    return compute_progress_bulk(students, lambda u: shared[exclusion_key(u)])
+
+
+def run(label, fn, store, students, rtt_ms):
+    store.round_trips = 0
+    gc.collect()
+    start = time.perf_counter()
+    results = fn(store, students)
+    cpu = time.perf_counter() - start
+    modeled = cpu + store.round_trips * rtt_ms / 1000
+    print(f"{label:<12} cpu {cpu * 1000:8.1f} ms   round trips {store.round_trips:6d}   modeled {modeled:8.2f} s")
+    return results, cpu, modeled
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--rtt-ms', type=float, default=10.0, help='Firestore round-trip latency to model')
+    args = parser.parse_args()
+
+    store, students = make_cohort(args.students)
+    print(f"Students: {args.students}   modeled round trip: {args.rtt_ms} ms")
+    # Warm up imports and compiled syllabi so neither path pays one-off costs
+    per_student(store, students[:100])
+    bulk(store, students[:100])
+    scalar_results, scalar_cpu, scalar_time = run('per-student', per_student, store, students, args.rtt_ms)
+    bulk_results, bulk_cpu, bulk_time = run('bulk', bulk, store, students, args.rtt_ms)
+
+    mismatches = [uid for uid in scalar_results if scalar_results[uid] != bulk_results.get(uid)]
+    print(f"Speedup over the per-student path: cpu {scalar_cpu / bulk_cpu:.2f}x   "
+          f"modeled {scalar_time / bulk_time:.1f}x   mismatches: {len(mismatches)}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
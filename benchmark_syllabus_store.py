@@ -0,0 +1,82 @@
+"""
+Syllabus Store Benchmark
+Measures cold start and resident memory of loading the syllabus as the in-process dict vs the mmap-backed store.
+
+Each mode runs in a fresh interpreter. Shared dependencies (config, the utils
+package) are imported first, then the syllabus load is timed and the VmRSS
+growth it causes is recorded (Linux /proc). Bytecode caches are warmed before
+timing, as they would be on a deployed worker.
+
+  dict   import templates.academic_data and freeze ACADEMIC_SYLLABI (the old path)
+  store  load_store() and freeze the decoded skeleton (the new path)
+
+Compiling the SyllabusIndex from the frozen data is the same in both and is not timed.
+
+Usage: python benchmark_syllabus_store.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_CHILD = r'''
+import json, sys, time
+sys.path.insert(0, {root!r})
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+from types import MappingProxyType
+
+def freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({{k: freeze(v) for k, v in value.items()}})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+import config, utils
+from utils.syllabus_store import load_store
+before = rss_kb()
+start = time.perf_counter()
+if {mode!r} == 'dict':
+    from templates.academic_data import ACADEMIC_SYLLABI
+    data = freeze(ACADEMIC_SYLLABI)
+else:
+    store = load_store()
+    data = freeze(store.skeleton())
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1000, 'rss_kb': rss_kb() - before}}))
+'''
+
+
+def measure(mode):
+    code = _CHILD.format(root=ROOT, mode=mode)
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=ROOT)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    # Warm bytecode caches and build the store file once
+    measure('dict')
+    measure('store')
+    for mode in ('dict', 'store'):
+        samples = [measure(mode) for _ in range(args.runs)]
+        ms = statistics.median(s['ms'] for s in samples)
+        rss = statistics.median(s['rss_kb'] for s in samples)
+        print(f"{mode:<6} cold start {ms:7.1f} ms   RSS growth {rss:7.0f} KiB")
+
+
+if __name__ == '__main__':
+    main()
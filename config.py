@@ -40,6 +40,25 @@ class Config:
     CACHE_TYPE = os.environ.get('CACHE_TYPE', 'disk')
     CACHE_DIR = os.environ.get('CACHE_DIR', './cache')
     CACHE_DEFAULT_TIMEOUT = 300  # 5 minutes
+    EXCLUSION_CACHE_TTL = int(os.environ.get('EXCLUSION_CACHE_TTL', 300))  # seconds
+    EXCLUSION_CACHE_SIZE = int(os.environ.get('EXCLUSION_CACHE_SIZE', 2048))
+    FANOUT_WORKERS = int(os.environ.get('FANOUT_WORKERS', 8))  # threads for concurrent reads
+    RISK_CACHE_TTL = int(os.environ.get('RISK_CACHE_TTL', 60))  # seconds an at-risk report is reused
+    ANALYTICS_WORKERS = int(os.environ.get('ANALYTICS_WORKERS', 2))  # threads for background analytics jobs
+    ANALYTICS_SNAPSHOT_MAX_AGE = int(os.environ.get('ANALYTICS_SNAPSHOT_MAX_AGE', 300))  # seconds before a snapshot is refreshed
+    ANALYTICS_REFRESH_INTERVAL = int(os.environ.get('ANALYTICS_REFRESH_INTERVAL', 300))  # seconds between scheduled refreshes
+    BROADCAST_PARALLELISM = int(os.environ.get('BROADCAST_PARALLELISM', 4))  # chunks committed at once per broadcast
+    BROADCAST_CHUNK_SIZE = int(os.environ.get('BROADCAST_CHUNK_SIZE', 200))  # recipients per batch write (max 200)
+    PUBSUB_BACKEND = os.environ.get('PUBSUB_BACKEND', 'diskcache')  # 'diskcache' (all workers on a host) or 'local' (one process)
+    WEB_THREADS = int(os.environ.get('WEB_THREADS', 32))  # gunicorn gthread threads per worker (render.yaml passes the same variable)
+    # Each open stream holds a worker thread; the rest must stay free for ordinary requests
+    SSE_MAX_CONNECTIONS = int(os.environ.get('SSE_MAX_CONNECTIONS', max(1, WEB_THREADS // 4)))  # notification streams per worker process
+    SSE_STREAM_SECONDS = int(os.environ.get('SSE_STREAM_SECONDS', 300))  # seconds before a stream closes and the client reconnects
+    BUBBLE_LEADERBOARD_MAX_AGE = int(os.environ.get('BUBBLE_LEADERBOARD_MAX_AGE', 3600))  # seconds before a full recompute
+    SYLLABUS_STORE_PATH = os.environ.get(
+        'SYLLABUS_STORE_PATH',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'academic_data.store')
+    )
     
     # Logging
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
@@ -59,6 +78,15 @@ class Config:
     if not GEMINI_API_KEY:
         raise ValueError("GEMINI_API_KEY environment variable must be set for AI features")
     
+    AI_PROBE_INTERVAL = int(os.environ.get('AI_PROBE_INTERVAL', 600))  # seconds between background model probes
+    AI_MODEL_COOLDOWN = int(os.environ.get('AI_MODEL_COOLDOWN', 60))  # seconds a failing model is tried last
+    AI_ANSWER_CACHE_TTL = int(os.environ.get('AI_ANSWER_CACHE_TTL', 86400))  # seconds a cached doubt answer is reused
+    AI_ANSWER_CACHE_SIZE = int(os.environ.get('AI_ANSWER_CACHE_SIZE', 2048))  # doubt answers cached per worker process
+    AI_ANSWER_CACHE_THRESHOLD = float(os.environ.get('AI_ANSWER_CACHE_THRESHOLD', 0.95))  # similarity for reusing an answer (above 1 = exact matches only)
+    AI_ANSWER_CACHE_MODES = os.environ.get('AI_ANSWER_CACHE_MODES', 'doubt,doubt_solver')  # chat modes using the cache (empty to disable)
+    CHAT_WRITE_QUEUE_SIZE = int(os.environ.get('CHAT_WRITE_QUEUE_SIZE', 1000))  # chat exchanges waiting to be saved per worker
+    SCLERA_ACTIVE_THREAD_TTL = int(os.environ.get('SCLERA_ACTIVE_THREAD_TTL', 3600))  # seconds an active-thread pointer stays in the disk cache
+    
     # Environment
     ENV = os.environ.get('FLASK_ENV', 'production')
     DEBUG = ENV == 'development'
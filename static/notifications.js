@@ -3,11 +3,15 @@
 
 (function () {
     let notificationCheckInterval = null;
+    // Newest notification seen so far; polls only return notifications when it changes
+    let since = null;
 
     function checkNotifications() {
-        fetch('/api/notifications')
+        const url = since ? `/api/notifications?since=${encodeURIComponent(since)}` : '/api/notifications';
+        fetch(url)
             .then(res => res.json())
             .then(data => {
+                since = data.latest_at;
                 if (data.notifications && data.notifications.length > 0) {
                     data.notifications.forEach(notif => {
                         showNotification(notif);
@@ -42,9 +46,29 @@
         }, 8000);
     }
 
+    function startPolling() {
+        if (!notificationCheckInterval) notificationCheckInterval = setInterval(checkNotifications, 30000);
+    }
+
     // Check immediately on load
     setTimeout(checkNotifications, 2000);
 
-    // Then check every 30 seconds
-    notificationCheckInterval = setInterval(checkNotifications, 30000);
+    // Then receive pushed notifications, or check every 30 seconds without a stream
+    if (window.EventSource) {
+        const source = new EventSource('/api/notifications/stream');
+        source.addEventListener('open', () => {
+            clearInterval(notificationCheckInterval);
+            notificationCheckInterval = null;
+        });
+        source.addEventListener('notification', e => {
+            const notif = JSON.parse(e.data);
+            since = notif.created_at;
+            showNotification(notif);
+        });
+        source.addEventListener('error', () => {
+            if (source.readyState === EventSource.CLOSED) startPolling();
+        });
+    } else {
+        startPolling();
+    }
 })();
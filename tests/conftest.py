@@ -0,0 +1,380 @@
+"""
+Shared test fixtures for StudyOS
+FakeFirestore is the one in-memory Firestore stand-in the utils tests run against
+"""
+import copy
+import threading
+import uuid
+
+import pytest
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, NotFound
+
+_NAME = '__name__'
+
+_OPS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    'in': lambda a, b: a in b,
+    'not-in': lambda a, b: a not in b,
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+    'array_contains_any': lambda a, b: isinstance(a, list) and any(v in a for v in b),
+}
+
+_MISSING = object()
+
+
+def split_field_path(field_path: str):
+    """Split a dotted field path, honouring `backtick` quoted segments"""
+    parts, current, quoted = [], '', False
+    for char in field_path:
+        if char == '`':
+            quoted = not quoted
+        elif char == '.' and not quoted:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    parts.append(current)
+    return parts
+
+
+def _lookup(data, parts):
+    for part in parts:
+        if not isinstance(data, dict) or part not in data:
+            return _MISSING
+        data = data[part]
+    return data
+
+
+def _transformed(current, value):
+    """Value a field takes after a write, resolving Firestore transforms"""
+    if isinstance(value, firestore.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if isinstance(value, firestore.ArrayUnion):
+        existing = list(current) if isinstance(current, list) else []
+        return existing + [v for v in value.values if v not in existing]
+    if isinstance(value, firestore.ArrayRemove):
+        return [v for v in current if v not in value.values] if isinstance(current, list) else []
+    return copy.deepcopy(value)
+
+
+def _merge_into(doc, data):
+    """Merge data into doc the way set(merge=True) does: nested maps merge, DELETE_FIELD removes"""
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            doc.pop(key, None)
+        elif isinstance(value, dict):
+            target = doc.get(key)
+            if not isinstance(target, dict):
+                target = doc[key] = {}
+            _merge_into(target, value)
+        else:
+            doc[key] = _transformed(doc.get(key), value)
+
+
+def _update_into(doc, data):
+    """Apply an update(): keys are field paths and map values replace the whole field"""
+    for field_path, value in data.items():
+        *parents, leaf = split_field_path(field_path)
+        target = doc
+        for part in parents:
+            if not isinstance(target.get(part), dict):
+                if value is firestore.DELETE_FIELD:
+                    target = None
+                    break
+                target[part] = {}
+            target = target[part]
+        if target is None:
+            continue
+        if value is firestore.DELETE_FIELD:
+            target.pop(leaf, None)
+        elif isinstance(value, dict):
+            target[leaf] = {}
+            _merge_into(target[leaf], value)
+        else:
+            target[leaf] = _transformed(target.get(leaf), value)
+
+
+class FakeSnapshot:
+    """DocumentSnapshot stand-in (to_dict returns a fresh copy)"""
+
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        value = _lookup(self._data or {}, split_field_path(field_path))
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class FakeDocument:
+    """DocumentReference stand-in"""
+
+    def __init__(self, store, path):
+        self._store = store
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocument) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def collection(self, name):
+        return FakeCollection(self._store, f"{self.path}/{name}")
+
+    def get(self, transaction=None):
+        self._store.reads += 1
+        return FakeSnapshot(self, copy.deepcopy(self._store.docs.get(self.path)))
+
+    def set(self, data, merge=False):
+        self._store._apply([('set', self, data, merge)])
+
+    def create(self, data):
+        self._store._apply([('create', self, data, False)])
+
+    def update(self, data):
+        self._store._apply([('update', self, data, False)])
+
+    def delete(self):
+        self._store._apply([('delete', self, None, False)])
+
+
+class _Aggregate:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class _CountQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self):
+        self._query._store.reads += 1
+        return [[_Aggregate(self._alias, len(self._query._matching()))]]
+
+
+class FakeQuery:
+    """Query stand-in: filters, orderings (ties broken by document id), cursors, limits and field masks"""
+
+    def __init__(self, store, path, filters=(), orders=(), after=None, count=None, fields=None):
+        self._store = store
+        self._path = path
+        self._filters = filters
+        self._orders = orders
+        self._after = after
+        self._count = count
+        self._fields = fields
+
+    def _with(self, **changes):
+        state = {'filters': self._filters, 'orders': self._orders, 'after': self._after,
+                 'count': self._count, 'fields': self._fields, **changes}
+        return FakeQuery(self._store, self._path, **state)
+
+    def where(self, field, op, value):
+        if op in ('in', 'not-in', 'array_contains_any') and len(value) > 30:
+            raise ValueError(f"'{op}' filters accept at most 30 values")
+        return self._with(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction=firestore.Query.ASCENDING):
+        return self._with(orders=self._orders + ((field, direction),))
+
+    def start_after(self, values):
+        if isinstance(values, FakeSnapshot):
+            values = {**(values.to_dict() or {}), _NAME: values.id}
+        return self._with(after=dict(values))
+
+    def limit(self, count):
+        return self._with(count=count)
+
+    def select(self, field_paths):
+        return self._with(fields=list(field_paths))
+
+    def count(self, alias=None):
+        return _CountQuery(self, alias)
+
+    def _value(self, path, data, field):
+        if field == _NAME:
+            return path.rsplit('/', 1)[-1]
+        return _lookup(data, split_field_path(field))
+
+    def _keys(self):
+        orders = list(self._orders)
+        if all(field != _NAME for field, _ in orders):
+            orders.append((_NAME, orders[-1][1] if orders else firestore.Query.ASCENDING))
+        return orders
+
+    def _is_after(self, path, data, keys):
+        for field, direction in keys:
+            if field not in self._after:
+                break
+            cursor = self._after[field]
+            cursor = cursor.id if isinstance(cursor, FakeDocument) else cursor
+            value = self._value(path, data, field)
+            if value == cursor:
+                continue
+            return (value < cursor) if direction == firestore.Query.DESCENDING else (value > cursor)
+        return False
+
+    def _matches(self, path, data):
+        for field, op, value in self._filters:
+            current = self._value(path, data, field)
+            if current is _MISSING:
+                return False
+            try:
+                if not _OPS[op](current, value):
+                    return False
+            except TypeError:
+                return False
+        return all(self._value(path, data, field) is not _MISSING for field, _ in self._orders)
+
+    def _matching(self):
+        prefix = self._path + '/'
+        with self._store._lock:
+            docs = list(self._store.docs.items())
+        rows = [(path, data) for path, data in docs
+                if path.startswith(prefix) and '/' not in path[len(prefix):] and self._matches(path, data)]
+        keys = self._keys()
+        for field, direction in reversed(keys):
+            rows.sort(key=lambda row: self._value(row[0], row[1], field),
+                      reverse=direction == firestore.Query.DESCENDING)
+        if self._after is not None:
+            rows = [row for row in rows if self._is_after(row[0], row[1], keys)]
+        return rows[:self._count] if self._count is not None else rows
+
+    def stream(self, transaction=None):
+        rows = self._matching()
+        self._store.reads += len(rows) or 1
+        snapshots = []
+        for path, data in rows:
+            data = copy.deepcopy(data)
+            if self._fields is not None:
+                data = {field: data[field] for field in self._fields if field in data}
+            snapshots.append(FakeSnapshot(FakeDocument(self._store, path), data))
+        return iter(snapshots)
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+
+class FakeCollection(FakeQuery):
+    """CollectionReference stand-in"""
+
+    def __init__(self, store, path):
+        super().__init__(store, path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, doc_id=None):
+        return FakeDocument(self._store, f"{self._path}/{doc_id or uuid.uuid4().hex[:20]}")
+
+
+class FakeBatch:
+    """WriteBatch stand-in; commit applies every write or none"""
+
+    def __init__(self, store):
+        self._store = store
+        self.ops = []
+
+    def set(self, ref, data, merge=False):
+        self.ops.append(('set', ref, data, merge))
+
+    def create(self, ref, data):
+        self.ops.append(('create', ref, data, False))
+
+    def update(self, ref, data):
+        self.ops.append(('update', ref, data, False))
+
+    def delete(self, ref):
+        self.ops.append(('delete', ref, None, False))
+
+    def commit(self):
+        if self._store.failures:
+            self._store.failures -= 1
+            raise RuntimeError('unavailable')
+        self._store._apply(self.ops)
+        self._store.commits += 1
+        if self._store.lost_acks:
+            # Applied, but the client never hears back
+            self._store.lost_acks -= 1
+            raise RuntimeError('deadline exceeded')
+
+
+class FakeFirestore:
+    """
+    In-memory Firestore client. Documents live in docs keyed by path;
+    reads counts documents read (a query returning nothing costs one),
+    commits counts applied batches. failures makes the next commits fail
+    before writing; lost_acks makes them write and still raise.
+    """
+
+    def __init__(self, docs=None, failures=0, lost_acks=0):
+        self.docs = dict(docs or {})
+        self.failures = failures
+        self.lost_acks = lost_acks
+        self.reads = 0
+        self.commits = 0
+        self._lock = threading.RLock()
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def document(self, path):
+        return FakeDocument(self, path)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, refs):
+        refs = list(refs)
+        self.reads += len(refs)
+        return [FakeSnapshot(ref, copy.deepcopy(self.docs.get(ref.path))) for ref in refs]
+
+    def _apply(self, ops):
+        """Apply writes atomically: all are checked against the staged state before any lands"""
+        with self._lock:
+            self._apply_staged(ops)
+
+    def _apply_staged(self, ops):
+        staged = {}
+
+        def current(path):
+            return staged[path] if path in staged else self.docs.get(path)
+
+        for op, ref, data, merge in ops:
+            existing = current(ref.path)
+            if op == 'delete':
+                staged[ref.path] = None
+                continue
+            if op == 'create' and existing is not None:
+                raise AlreadyExists(f"Document already exists: {ref.path}")
+            if op == 'update' and existing is None:
+                raise NotFound(f"No document to update: {ref.path}")
+            doc = copy.deepcopy(existing) if (merge or op == 'update') and existing is not None else {}
+            (_update_into if op == 'update' else _merge_into)(doc, data)
+            staged[ref.path] = doc
+        for path, doc in staged.items():
+            if doc is None:
+                self.docs.pop(path, None)
+            else:
+                self.docs[path] = doc
+
+
+@pytest.fixture
+def fake_db():
+    """Empty in-memory Firestore"""
+    return FakeFirestore()
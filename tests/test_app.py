@@ -17,7 +17,32 @@ from utils.validators import (
     validate_schema, validate_email
 )
 from utils.cache import CacheManager, cached
+from utils.leaderboard import BubbleLeaderboard, GlobalLeaderboard, build_leaderboard_entry, rank_entries
+from utils.request_cache import get_document, update_document, request_read_stats
+from utils.exclusions import ExclusionResolver, exclusion_key, merge_exclusions
+from utils.progress import compute_progress, compute_progress_bulk, compute_progress_compiled, syllabus_for_user
+from utils.syllabus import SYLLABUS_INDEX, SyllabusIndex
+from utils.syllabus_store import SyllabusStore, build_store, load_store, source_hash
+from utils.people_search import PeopleSearchIndex, build_search_entry, name_prefixes
+from utils import fanout
+from utils.bubbles import plan_membership_repairs
+from utils.heatmap import HeatmapAggregator, scopes_for_user
+from utils.risk import RiskScorer, score_student, student_classes
+from utils.analytics_jobs import AnalyticsJobs, job_key
+from utils.roster import Roster, paginate, days_inactive, NEVER_ACTIVE
+from utils.broadcast import BroadcastSender, chunked, job_status
+from utils.inbox import NotificationInbox, WRITES_PER_NOTIFICATION
+from utils.pubsub import LocalBroker, DiskCacheBroker
+from utils.calendar_events import event_times, events_in_window, parse_event_time, to_client
+from utils.study_log import StudyLog, expired_keys, summarize, week_key
+from utils.model_selector import ModelSelector, LAST_GOOD_KEY
+from utils.chat_stream import relay_answer
+from utils.answer_cache import AnswerCache, TermWeights, question_terms
+from utils.chat_threads import ActiveThreads, thread_page
+from utils.chat_writer import ChatWriter, chat_messages, write_exchange
+from ai_assistant import AIAssistant
 from config import config
+from tests.conftest import FakeFirestore
 
 
 # ============================================================================
@@ -322,6 +347,11 @@ class TestConfiguration:
         assert test_config.TESTING is True
         assert test_config.DEBUG is True
 
+    def test_streams_leave_threads_for_requests(self):
+        """Test notification streams can never take every gunicorn thread of a worker"""
+        prod_config = config['production']
+        assert prod_config.SSE_MAX_CONNECTIONS <= prod_config.WEB_THREADS // 4
+
 
 # ============================================================================
 # INTEGRATION TESTS (Flask App)
@@ -426,6 +456,1368 @@ class TestCacheManager:
         assert key1 != key3
 
 
+# ============================================================================
+# LEADERBOARD TESTS
+# ============================================================================
+
+class TestLeaderboardEntry:
+    """Test suite for leaderboard entry building"""
+
+    def test_entry_from_progress(self):
+        """Test entry fields come from user data and progress"""
+        user_data = {
+            'name': 'Asha',
+            'purpose': 'high_school',
+            'highschool': {'board': 'CBSE', 'grade': '10'}
+        }
+        progress = {'overall': 62.5, 'total_chapters': 40, 'total_completed': 25}
+        entry = build_leaderboard_entry('u1', user_data, progress)
+
+        assert entry['uid'] == 'u1'
+        assert entry['name'] == 'Asha'
+        assert entry['purpose_display'] == 'High School'
+        assert entry['grade'] == '10'
+        assert entry['overall_score'] == 62.5
+        assert entry['total_chapters'] == 40
+        assert entry['completed_chapters'] == 25
+
+    def test_entry_defaults(self):
+        """Test entry for a user without setup data"""
+        entry = build_leaderboard_entry('u2', {'purpose': 'exam_prep'}, {})
+
+        assert entry['name'] == 'Anonymous'
+        assert entry['grade'] is None
+        assert entry['overall_score'] == 0
+
+
+class TestBubbleLeaderboard:
+    """Test suite for materialized bubble rankings"""
+
+    def test_rank_entries(self):
+        """Test entries are ordered by score and numbered without mutating the stored ones"""
+        stored = [{'uid': 'a', 'overall_score': 40}, {'uid': 'b', 'overall_score': 90}]
+        ranked = rank_entries(stored)
+        assert [(e['uid'], e['rank']) for e in ranked] == [('b', 1), ('a', 2)]
+        assert 'rank' not in stored[0]
+
+    def test_staleness_bound(self):
+        """Test missing, unparseable and old rankings are recomputed"""
+        board = BubbleLeaderboard(db=None, max_age=60)
+        fresh = datetime.utcnow().isoformat()
+        old = (datetime.utcnow() - timedelta(seconds=120)).isoformat()
+        assert board.is_stale(None)
+        assert board.is_stale({'entries': {}})
+        assert board.is_stale({'computed_at': 'yesterday'})
+        assert board.is_stale({'computed_at': old})
+        assert not board.is_stale({'computed_at': fresh})
+
+
+class TestGlobalLeaderboard:
+    """Test suite for bulk leaderboard writes and rebuilds"""
+
+    def test_rebuild_drops_deleted_users(self):
+        """Test entries of users that no longer exist are removed by a rebuild"""
+        store = FakeFirestore()
+        store.docs['leaderboard_scores/gone'] = {'uid': 'gone', 'overall_score': 99}
+        board = GlobalLeaderboard(store)
+        users = [('a', {'name': 'A'}), ('b', {'name': 'B'})]
+        written, skipped, removed = board.rebuild(users, {'a': {'overall': 50}})
+        assert (written, skipped, removed) == (1, 1, 1)
+        assert set(store.docs) == {'leaderboard_scores/a'}
+
+    def test_upsert_many_is_chunked(self):
+        """Test a class-sized refresh is written in a few batches, not one write per student"""
+        store = FakeFirestore()
+        users = [(f"u{i}", {'name': f"S{i}"}) for i in range(450)]
+        entries = GlobalLeaderboard(store).upsert_many(users, {uid: {'overall': 10} for uid, _ in users})
+        assert len(entries) == 450 and store.commits == 2
+
+    def test_set_members_one_write_per_bubble(self):
+        """Test member entries are grouped per bubble and None drops a member"""
+        store = FakeFirestore()
+        store.docs['bubble_leaderboards/b1'] = {'entries': {'old': {'uid': 'old'}}}
+        BubbleLeaderboard(store).set_members({'b1': {'a': {'uid': 'a'}, 'old': None}, 'b2': {'a': {'uid': 'a'}}})
+        assert store.commits == 1
+        assert store.docs['bubble_leaderboards/b2']['entries'] == {'a': {'uid': 'a'}}
+        assert store.docs['bubble_leaderboards/b1']['entries']['a'] == {'uid': 'a'}
+        assert 'old' not in store.docs['bubble_leaderboards/b1']['entries']
+
+
+# ============================================================================
+# REQUEST CACHE TESTS
+# ============================================================================
+
+class _CountingRef:
+    """Minimal document reference that counts reads"""
+
+    def __init__(self, path):
+        self.path = path
+        self.reads = 0
+
+    def get(self):
+        self.reads += 1
+        return {'path': self.path, 'read': self.reads}
+
+    def update(self, data):
+        return None
+
+
+class TestRequestCache:
+    """Test suite for the request-scoped document cache"""
+
+    def setup_method(self):
+        from flask import Flask
+        self.app = Flask(__name__)
+
+    def test_repeated_reads_hit_cache(self):
+        """Test a document is fetched once per request"""
+        ref = _CountingRef('users/u1')
+        with self.app.test_request_context():
+            first = get_document(ref)
+            second = get_document(ref)
+            assert first is second
+            assert ref.reads == 1
+            assert request_read_stats() == {'reads': 1, 'reads_saved': 1}
+
+    def test_write_invalidates(self):
+        """Test a write forces the next read to hit Firestore"""
+        ref = _CountingRef('users/u1')
+        with self.app.test_request_context():
+            get_document(ref)
+            update_document(ref, {'name': 'New'})
+            get_document(ref)
+            assert ref.reads == 2
+
+    def test_cache_is_per_request(self):
+        """Test cached documents do not leak across requests"""
+        ref = _CountingRef('users/u1')
+        with self.app.test_request_context():
+            get_document(ref)
+        with self.app.test_request_context():
+            get_document(ref)
+        assert ref.reads == 2
+
+
+# ============================================================================
+# EXCLUSION TESTS
+# ============================================================================
+
+class TestExclusions:
+    """Test suite for syllabus exclusion resolution"""
+
+    def test_exclusion_key_ignores_class_order(self):
+        """Test users in the same classes share a cache key"""
+        a = exclusion_key({'institution_id': 'i1', 'class_ids': ['c1', 'c2']})
+        b = exclusion_key({'institution_id': 'i1', 'class_ids': ['c2', 'c1']})
+        assert a == b
+        assert exclusion_key({}) == (None, frozenset())
+
+    def test_personal_exclusions_applied_last(self):
+        """Test personal exclusions are merged over shared ones"""
+        shared = {'Maths::Algebra': True}
+        merged = merge_exclusions(shared, {'Physics::Optics': True})
+        assert merged == {'Maths::Algebra': True, 'Physics::Optics': True}
+        assert shared == {'Maths::Algebra': True}
+
+    def test_no_institution_needs_no_reads(self):
+        """Test students outside institutions resolve without touching Firestore"""
+        resolver = ExclusionResolver(db=None)
+        assert resolver.resolve(None, []) == {}
+        assert resolver.resolve_bulk([(None, []), ('', None)]) == {(None, frozenset()): {}}
+
+    def test_class_invalidation_reaches_every_worker(self, tmp_path):
+        """Test a class edited through one worker is re-read by another worker's memoized results"""
+        import diskcache
+        path = 'classes/c1/excluded_chapters/current'
+        db = FakeFirestore({path: {'chapters': {'Maths::Algebra': True}}})
+        with diskcache.Cache(str(tmp_path)) as shared:
+            editor, other = ExclusionResolver(db, store=shared), ExclusionResolver(db, store=shared)
+            assert other.resolve('i1', ['c1']) == {'Maths::Algebra': True}
+            reads = db.reads
+            assert other.resolve('i1', ['c1']) == {'Maths::Algebra': True}
+            assert db.reads == reads
+            db.docs[path] = {'chapters': {'Physics::Optics': True}}
+            editor.invalidate_class('c1')
+            assert other.resolve('i1', ['c1']) == {'Physics::Optics': True}
+            assert other.resolve('i1', ['c2']) == {}
+
+
+# ============================================================================
+# SYLLABUS INDEX TESTS
+# ============================================================================
+
+class TestSyllabusIndex:
+    """Test suite for the compiled syllabus index"""
+
+    def test_matches_get_syllabus(self):
+        """Test index lookups return the same syllabi as get_syllabus"""
+        from templates.academic_data import get_syllabus
+        grade_11 = list(get_syllabus('highschool', 'CBSE', '11'))
+        cases = [
+            ('highschool', 'CBSE', '10'),
+            ('highschool', 'Unknown Board', 10),
+            ('exam', 'JEE'),
+            ('exam', 'Unknown Exam'),
+            ('after_tenth', 'CBSE', '11', grade_11[:2] + ['Not A Subject']),
+        ]
+        for args in cases:
+            expected = get_syllabus(*args)
+            compiled = SYLLABUS_INDEX.get(*args)
+            assert list(compiled.subjects) == list(expected), args
+            assert compiled.total_chapters == sum(len(d.get('chapters', {})) for d in expected.values())
+
+    def test_chapter_lookup(self):
+        """Test O(1) chapter lookups, lazy topic bodies and read-only data"""
+        topic = {'name': 'Sets', 'overview': 'Basics', 'key_points': ['A set is a collection']}
+        index = SyllabusIndex({'exams': {'T': {'Maths': {'chapters': {'Algebra': {'topics': [topic]}}}}}})
+        compiled = index.get('exam', 'T')
+        assert dict(compiled.chapter('Maths', 'Algebra')['topics'][0]) == {'name': 'Sets', 'overview': 'Basics'}
+        assert index.topics(compiled, 'Maths', 'Algebra') == [topic]
+        assert index.topics(compiled, 'Maths', 'Missing') == []
+        assert not compiled.chapter('Maths', 'Missing')
+        assert compiled.chapter_id('Maths::Algebra') == 0
+        with pytest.raises(TypeError):
+            compiled.syllabus['Maths'] = {}
+
+    def test_for_user_without_setup(self):
+        """Test users without an academic setup get an empty syllabus"""
+        assert not SYLLABUS_INDEX.for_user({'purpose': 'high_school'})
+        assert not SYLLABUS_INDEX.for_user({})
+
+
+class TestSyllabusStore:
+    """Test suite for the on-disk syllabus store"""
+
+    def test_round_trip(self, tmp_path):
+        """Test the built file serves the skeleton and full topics"""
+        from templates.academic_data import ACADEMIC_SYLLABI
+        path = str(tmp_path / 'syllabus.store')
+        build_store(ACADEMIC_SYLLABI, path, 'digest')
+        store = SyllabusStore.open(path)
+        try:
+            assert store.source_hash == 'digest'
+            chapters = ACADEMIC_SYLLABI['highschool']['CBSE']['9']['Mathematics']['chapters']
+            chapter_name = next(iter(chapters))
+            skeleton_topics = store.skeleton()['highschool']['CBSE']['9']['Mathematics']['chapters'][chapter_name]['topics']
+            assert all(set(t) <= {'name', 'overview'} for t in skeleton_topics)
+            assert store.topics('highschool', 'CBSE', '9', 'Mathematics', chapter_name) == chapters[chapter_name]['topics']
+            assert store.topics('highschool', 'CBSE', '9', 'Mathematics', 'Missing') == []
+        finally:
+            store.close()
+
+    def test_stale_store_is_rebuilt(self, tmp_path):
+        """Test a store built from other source data is replaced on load"""
+        path = str(tmp_path / 'syllabus.store')
+        build_store({'exams': {}}, path, 'old-digest')
+        store = load_store(path)
+        try:
+            assert store.source_hash == source_hash()
+            assert store.skeleton()['highschool']
+        finally:
+            store.close()
+
+
+# ============================================================================
+# PROGRESS TESTS
+# ============================================================================
+
+class TestBulkProgress:
+    """Test suite for the bulk progress engine"""
+
+    def _students(self):
+        hs = {'purpose': 'high_school', 'highschool': {'board': 'CBSE', 'grade': '10'}}
+        syllabus = syllabus_for_user(hs)
+        subject = next(iter(syllabus))
+        chapters = list(syllabus[subject]['chapters'])
+        return subject, chapters, [
+            ('fresh', dict(hs)),
+            ('done', {**hs, 'chapters_completed': {subject: {chapters[0]: True, chapters[1]: False, 'Unknown': True}}}),
+            ('personal', {**hs, 'academic_exclusions': {f"{subject}::{chapters[0]}": True},
+                          'chapters_completed': {subject: {chapters[0]: True}}}),
+            ('override', {**hs, 'academic_exclusions': {f"{subject}::{chapters[1]}": False}}),
+            ('exam', {'purpose': 'exam_prep', 'exam': {'type': 'JEE'},
+                      'exam_results': [{'score': 40, 'date': '2024-01-01'}, {'score': 70, 'date': '2024-02-01'}]}),
+            ('no_setup', {'purpose': 'high_school'}),
+        ]
+
+    def test_bulk_matches_scalar(self):
+        """Test bulk results equal per-student results, including exclusion overrides"""
+        subject, chapters, students = self._students()
+        shared = {f"{subject}::{chapters[1]}": True}
+        bulk = compute_progress_bulk(students, lambda u: shared)
+        for uid, user_data in students:
+            expected = compute_progress(user_data, syllabus_for_user(user_data),
+                                        merge_exclusions(shared, user_data.get('academic_exclusions', {})))
+            assert bulk[uid] == expected, uid
+            assert compute_progress_compiled(user_data, shared) == expected, uid
+
+    def test_bulk_skips_unscorable_students(self):
+        """Test malformed documents are left out instead of failing the cohort"""
+        subject, _, students = self._students()
+        broken = ('broken', {**students[0][1], 'chapters_completed': {subject: ['not', 'a', 'dict']}})
+        bulk = compute_progress_bulk(students + [broken], lambda u: {})
+        assert 'broken' not in bulk
+        assert len(bulk) == len(students)
+
+
+class TestFanout:
+    """Test suite for the concurrent read pool"""
+
+    def test_results_and_errors_propagate(self):
+        """Test background reads return results and re-raise failures"""
+        assert fanout.submit(sum, [1, 2, 3]).result() == 6
+        with pytest.raises(ZeroDivisionError):
+            fanout.submit(lambda: 1 / 0).result()
+
+    def test_connections_joined_from_one_read_and_one_query(self, app, monkeypatch):
+        """Test profiles come from one get_all, requests are matched by sender and missing users are skipped"""
+        import app as flask_app
+        store = FakeFirestore({
+            'users/a': {'name': 'Ann', 'purpose': 'high_school', 'last_login_date': '2026-04-01'},
+            'users/s': {'name': 'Sam', 'purpose': 'exam_prep'},
+            'users/r': {'name': 'Raj', 'purpose': 'after_tenth'},
+            'connections/c1': {'sender_uid': 'r', 'receiver_uid': 'me', 'status': 'pending', 'message': 'Hi'},
+            'connections/c2': {'sender_uid': 'x', 'receiver_uid': 'me', 'status': 'pending'},
+            'connections/c3': {'sender_uid': 'r', 'receiver_uid': 'other', 'status': 'pending'},
+        })
+        monkeypatch.setattr(flask_app, 'db', store)
+        connections = {'accepted': ['a', 'gone'], 'pending_sent': ['s'], 'pending_received': ['r', 'x']}
+        data = flask_app._build_connections_data('me', {'connections': connections})
+        assert data['accepted'] == [{'uid': 'a', 'name': 'Ann', 'purpose_display': 'High School', 'last_active': '2026-04-01'}]
+        assert data['pending_sent'] == [{'uid': 's', 'name': 'Sam', 'purpose_display': 'Exam Prep'}]
+        assert data['pending_received'] == [{'uid': 'r', 'name': 'Raj', 'purpose_display': 'After Tenth',
+                                             'connection_id': 'c1', 'message': 'Hi'}]
+        # Five profiles in one get_all, two pending requests from one query
+        assert store.reads == 7
+
+
+# ============================================================================
+# PEOPLE SEARCH TESTS
+# ============================================================================
+
+class TestPeopleSearch:
+    """Test suite for the people-search index"""
+
+    def _index(self, users):
+        entries = {uid: build_search_entry(uid, data) for uid, data in users.items()}
+        return PeopleSearchIndex(FakeFirestore({f"people_search/{uid}": e for uid, e in entries.items() if e}))
+
+    def test_name_prefixes(self):
+        """Test word and whole-name prefixes are indexed"""
+        prefixes = name_prefixes('John  Smith')
+        assert {'jo', 'john', 'john sm', 'sm', 'smith'} <= set(prefixes)
+        assert 'j' not in prefixes
+
+    def test_privacy_respected(self):
+        """Test hidden names are not indexed and hidden fields cannot be filtered on"""
+        hs = {'purpose': 'high_school', 'highschool': {'board': 'CBSE', 'grade': '10'}, 'institution_id': 'i1'}
+        assert build_search_entry('u1', {'name': 'Ann', 'profile_visibility': {'name': False}}) is None
+        entry = build_search_entry('u2', {**hs, 'name': 'Ann', 'profile_visibility': {'grade': False, 'school': False}})
+        assert entry['grade'] is None and entry['institution_id'] is None
+        assert build_search_entry('u3', {**hs, 'name': 'Ann'})['grade'] == '10'
+
+    def test_search_filters_and_pages(self):
+        """Test filtered search pages through all matches without repeats"""
+        hs = {'purpose': 'high_school', 'highschool': {'board': 'CBSE', 'grade': '10'}}
+        users = {f"u{i}": {**hs, 'name': f"Sam {i:02d}", 'institution_id': 'i1' if i % 2 else 'i2'} for i in range(7)}
+        users['me'] = {**hs, 'name': 'Sam Me', 'institution_id': 'i1'}
+        users['other'] = {'name': 'Alex Sample', 'purpose': 'exam_prep', 'exam': {'type': 'JEE'}}
+        index = self._index(users)
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = index.search('sam', grade='10', school='i1', limit=2, cursor=cursor, exclude_uid='me')
+            seen.extend(e['uid'] for e in page)
+            if not cursor:
+                break
+        assert seen == ['u1', 'u3', 'u5']
+
+        page, _ = index.search('sa', subject='physics')
+        assert 'other' in [e['uid'] for e in page]
+        assert [e['uid'] for e in index.search('sample')[0]] == ['other']
+        assert index.search('s')[0] == []
+
+    def test_rebuild_drops_hidden_and_deleted_users(self):
+        """Test a rebuild removes entries of hidden users and of users that no longer exist"""
+        store = FakeFirestore()
+        store.docs['people_search/gone'] = {'uid': 'gone', 'name': 'Gone'}
+        index = PeopleSearchIndex(store)
+        users = iter([('a', {'name': 'Ann'}), ('h', {'name': 'Hid', 'profile_visibility': {'name': False}})])
+        assert index.rebuild(users) == (1, 2)
+        assert set(store.docs) == {'people_search/a'}
+
+
+# ============================================================================
+# BUBBLE MEMBERSHIP TESTS
+# ============================================================================
+
+class TestBubbleMemberships:
+    """Test suite for the bubble membership repair planner"""
+
+    def test_plan_reconciles_both_sides(self):
+        """Test missing, stale and dangling memberships are all reported"""
+        users = {
+            'u1': {'bubbles': ['b1']},
+            'u2': {'bubbles': ['b1', 'gone']},
+            'u3': {},
+        }
+        bubbles = {
+            'b1': {'member_uids': ['u1', 'u3', 'deleted_user']},
+            'b2': {'member_uids': ['u1']},
+        }
+        plan = plan_membership_repairs(users, bubbles)
+        assert plan['add_to_user'] == {'u3': ['b1'], 'u1': ['b2']}
+        assert plan['remove_from_user'] == {'u2': ['b1', 'gone']}
+        assert plan['remove_from_bubble'] == {'b1': ['deleted_user']}
+
+    def test_consistent_data_needs_no_writes(self):
+        """Test an already consistent dataset plans nothing"""
+        plan = plan_membership_repairs({'u1': {'bubbles': ['b1']}}, {'b1': {'member_uids': ['u1']}})
+        assert plan == {'add_to_user': {}, 'remove_from_user': {}, 'remove_from_bubble': {}}
+
+
+# ============================================================================
+# HEATMAP TESTS
+# ============================================================================
+
+class TestHeatmapBuckets:
+    """Test suite for pre-aggregated study heatmaps"""
+
+    now = datetime(2026, 3, 31, 12)
+
+    def test_scopes_for_user(self):
+        """Test a student's sessions count towards their institution and each class"""
+        assert scopes_for_user({'institution_id': 'i1', 'class_ids': ['c1', 'c2']}) == \
+            ['institution_i1', 'class_c1', 'class_c2']
+        assert scopes_for_user({}) == []
+
+    def test_rebuild_and_read_window(self):
+        """Test buckets sum sessions inside the window and roll off older days"""
+        store = FakeFirestore()
+        heatmaps = HeatmapAggregator(store, window_days=30)
+        student = {'institution_id': 'i1', 'class_ids': ['c1']}
+        other = {'institution_id': 'i1', 'class_ids': ['c2']}
+        sessions = [
+            (student, '2026-03-31', 1, 9),
+            (student, '2026-03-02', 1, 9),
+            (other, '2026-03-15', 1, 9),
+            (other, '2026-03-15', 4, 20),
+            (student, '2026-02-20', 2, 10),  # before the window
+            (student, '2026-03-20', None, 10),  # no local time recorded
+        ]
+        assert heatmaps.rebuild(sessions, now=self.now) == 3
+        assert heatmaps.read(['institution_i1'], now=self.now) == {'1-9': 3, '4-20': 1}
+        assert heatmaps.read(['class_c1', 'class_c2'], now=self.now) == {'1-9': 3, '4-20': 1}
+
+        # A day later 2026-03-02 falls out of the window and is deleted
+        later = self.now + timedelta(days=1)
+        assert heatmaps.read(['class_c1'], now=later) == {'1-9': 1}
+        assert store.docs['heatmap_buckets/class_c1']['days'] == {'2026-03-31': {'1-9': 1}}
+
+    def test_sessions_spread_over_shards_and_rebuild_resets_them(self):
+        """Test simultaneous sessions land on several counter documents, all summed on read and replaced by a rebuild"""
+        store = FakeFirestore()
+        heatmaps = HeatmapAggregator(store)
+        student = {'institution_id': 'i1'}
+        for _ in range(40):
+            heatmaps.record_session(student, 1, 9, when=self.now)
+        shards = [path for path in store.docs if path.startswith('heatmap_buckets/institution_i1')]
+        assert len(shards) > 1
+        assert heatmaps.read(['institution_i1'], now=self.now) == {'1-9': 40}
+        heatmaps.rebuild([(student, '2026-03-31', 2, 10)], now=self.now)
+        assert heatmaps.read(['institution_i1'], now=self.now) == {'2-10': 1}
+
+    def test_contended_increment_is_retried(self):
+        """Test a commit that fails transiently still counts the session once, and a persistent failure raises"""
+        store = FakeFirestore(failures=2)
+        heatmaps = HeatmapAggregator(store, backoff=0)
+        heatmaps.record_session({'class_ids': ['c1']}, 1, 9, when=self.now)
+        assert heatmaps.read(['class_c1'], now=self.now) == {'1-9': 1}
+        store.failures = 3
+        with pytest.raises(RuntimeError):
+            heatmaps.record_session({'class_ids': ['c1']}, 1, 9, when=self.now)
+        assert heatmaps.read(['class_c1'], now=self.now) == {'1-9': 1}
+
+
+# ============================================================================
+# RISK SCORING TESTS
+# ============================================================================
+
+class TestRiskScoring:
+    """Test suite for at-risk student scoring"""
+
+    now = datetime(2026, 3, 31, 12)
+
+    def _results(self, *percentages):
+        return [{'date': f"2026-03-{day:02d}", 'percentage': p} for day, p in enumerate(percentages, 1)]
+
+    def test_statuses(self):
+        """Test stagnation, decline and their combination"""
+        recent = (self.now - timedelta(days=2)).isoformat()
+        old = (self.now - timedelta(days=10)).isoformat()
+        assert score_student({'last_login_date': recent}, self.now) == ('healthy', 0)
+        assert score_student({}, self.now) == ('stagnating', 0)
+        assert score_student({'last_login_date': recent, 'exam_results': self._results(80, 70)}, self.now) == ('declining', -10)
+        assert score_student({'last_login_date': old, 'exam_results': self._results(80, 70)}, self.now) == ('critical', -10)
+
+    def test_momentum_uses_latest_results(self):
+        """Test momentum spans the three most recent results regardless of stored order"""
+        results = self._results(20, 90, 80, 95)[::-1]
+        assert score_student({'last_login_date': self.now.isoformat(), 'exam_results': results}, self.now) == ('healthy', 5)
+
+    def test_score_roster_uses_first_class(self):
+        """Test students are labelled with the first class listing them"""
+        class_of = student_classes({
+            'c1': {'name': 'Class A', 'student_uids': ['s1', 's2']},
+            'c2': {'name': 'Class B', 'student_uids': ['s2', 's3']}
+        })
+        assert class_of == {'s1': 'Class A', 's2': 'Class A', 's3': 'Class B'}
+        roster = {'s3': {'name': 'Sam'}, 's1': {'name': 'Ann', 'last_login_date': self.now.isoformat()}}
+        assert RiskScorer.score_roster(roster, class_of, self.now) == [
+            {'uid': 's3', 'name': 'Sam', 'class': 'Class B', 'status': 'stagnating', 'momentum': 0}
+        ]
+
+
+# ============================================================================
+# ANALYTICS JOB TESTS
+# ============================================================================
+
+class TestAnalyticsJobs:
+    """Test suite for background analytics snapshots"""
+
+    def setup_method(self):
+        import tempfile
+        import diskcache
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = diskcache.Cache(self.tmpdir.name)
+        self.calls = []
+
+    def teardown_method(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def _compute(self, institution_id, class_ids):
+        self.calls.append((institution_id, class_ids))
+        return {'heatmap': {'1-9': 2}, 'at_risk': []}
+
+    def test_job_key(self):
+        """Test scopes ignore class order and duplicates"""
+        assert job_key('i1') == 'i1:all'
+        assert job_key('i1', ['c2', 'c1', 'c2']) == job_key('i1', ['c1', 'c2']) == 'i1:c1,c2'
+
+    def test_snapshot_is_computed_in_background(self):
+        """Test the first view queues a job and later views serve its snapshot"""
+        jobs = AnalyticsJobs(self._compute, store=self.store, interval=3600)
+        assert jobs.snapshot('i1', ['c1']) is None
+        jobs._pool.shutdown(wait=True)
+        snapshot = self.store.get('analytics:snapshot:i1:c1')
+        assert snapshot['heatmap'] == {'1-9': 2}
+        assert jobs.job('i1', ['c1'])['status'] == 'done'
+        assert self.calls == [('i1', ['c1'])]
+
+    def test_jobs_are_deduplicated(self):
+        """Test a scope with a job in flight is not queued again"""
+        jobs = AnalyticsJobs(self._compute, store=self.store, interval=3600)
+        self.store.add('analytics:lock:i1:all', 0)
+        assert not jobs.submit('i1')
+        assert jobs.run_now('i1') is None
+        self.store.delete('analytics:lock:i1:all')
+        assert jobs.run_now('i1')['at_risk'] == []
+        assert not jobs.is_stale(self.store.get('analytics:snapshot:i1:all'))
+
+
+# ============================================================================
+# ROSTER TESTS
+# ============================================================================
+
+class TestRoster:
+    """Test suite for the institution roster join"""
+
+    def _roster(self):
+        classes = {'c1': {'name': 'Physics'}, 'c2': {'name': 'Chemistry'}}
+        students = {
+            's1': {'name': 'bea', 'class_ids': ['c1', 'c2'], 'last_login_date': '2026-03-30'},
+            's2': {'name': 'Al', 'class_ids': ['c2', 'gone']},
+            's3': {'name': 'Cy'}
+        }
+        return Roster(classes, students)
+
+    def test_join_both_directions(self):
+        """Test class -> students and student -> classes are built together"""
+        roster = self._roster()
+        assert {c['id']: c['students'] for c in roster.classes_with_students()} == {'c1': ['s1'], 'c2': ['s1', 's2']}
+        assert roster.class_names('s1') == ['Physics', 'Chemistry']
+        assert roster.class_names('s3') == []
+
+    def test_student_rows(self):
+        """Test rows carry class names and inactivity"""
+        rows = {r['uid']: r for r in self._roster().student_rows(today=datetime(2026, 3, 31).date())}
+        assert rows['s1']['class_names'] == 'Physics, Chemistry'
+        assert rows['s1']['days_inactive'] == 1
+        assert rows['s3']['class_names'] == 'No class'
+        assert rows['s3']['days_inactive'] == NEVER_ACTIVE
+        assert days_inactive('not a date') == NEVER_ACTIVE
+
+    def test_paginate_sorts_and_clamps(self):
+        """Test server-side sorting and page bounds"""
+        rows = self._roster().student_rows()
+        page, meta = paginate(rows, sort='name', per_page=2)
+        assert [r['uid'] for r in page] == ['s2', 's1']
+        assert meta == {'sort': 'name', 'order': 'asc', 'page': 1, 'pages': 2, 'per_page': 2, 'total': 3}
+        page, meta = paginate(rows, sort='bogus', order='desc', page=9, per_page=2)
+        assert [r['uid'] for r in page] == ['s2']
+        assert (meta['sort'], meta['page']) == ('name', 2)
+
+
+# ============================================================================
+# CLASS INVITE TESTS
+# ============================================================================
+
+class TestClassInvites:
+    """Test suite for resolving and backfilling class invite codes"""
+
+    def _store(self, monkeypatch, docs):
+        """Install a fake db on the app, counting invite queries"""
+        import app as flask_app
+        store = FakeFirestore(docs)
+        store.invite_queries = 0
+        collection = store.collection
+
+        def counting(name):
+            if name == flask_app.CLASS_INVITES_COL:
+                store.invite_queries += 1
+            return collection(name)
+
+        store.collection = counting
+        monkeypatch.setattr(flask_app, 'db', store)
+        return flask_app, store
+
+    def test_missing_codes_resolved_thirty_classes_per_query(self, app, monkeypatch):
+        """Test 65 classes need three 'in' queries and a class without an active invite is left as is"""
+        docs = {f"class_invites/CODE{i}": {'code': f"CODE{i}", 'class_id': f"c{i}", 'active': i != 64} for i in range(65)}
+        flask_app, store = self._store(monkeypatch, docs)
+        classes = flask_app._attach_invite_codes([{'id': f"c{i}"} for i in range(65)])
+        assert store.invite_queries == 3
+        assert [c.get('invite_code') for c in classes[:3]] == ['CODE0', 'CODE1', 'CODE2']
+        assert classes[64] == {'id': 'c64'}
+
+    def test_denormalized_codes_issue_no_query(self, app, monkeypatch):
+        """Test classes that already carry their code are returned without reading invites"""
+        flask_app, store = self._store(monkeypatch, {'class_invites/NEW': {'code': 'NEW', 'class_id': 'c1', 'active': True}})
+        classes = flask_app._attach_invite_codes([{'id': 'c1', 'invite_code': 'OLD'}])
+        assert classes == [{'id': 'c1', 'invite_code': 'OLD'}]
+        assert store.invite_queries == 0
+
+    def test_backfill_updates_only_resolved_classes(self, app, monkeypatch):
+        """Test the backfill writes codes it found and leaves classes without an invite or with a code alone"""
+        flask_app, store = self._store(monkeypatch, {
+            'classes/c1': {'name': 'A'},
+            'classes/c2': {'name': 'B'},
+            'classes/c3': {'name': 'C', 'invite_code': 'OLD'},
+            'class_invites/ABC': {'code': 'ABC', 'class_id': 'c1', 'active': True},
+            'class_invites/NEW': {'code': 'NEW', 'class_id': 'c3', 'active': True},
+        })
+        result = app.test_cli_runner().invoke(args=['backfill-class-invites'])
+        assert '1 classes updated, 1 have no active invite' in result.output
+        assert store.docs['classes/c1'] == {'name': 'A', 'invite_code': 'ABC'}
+        assert store.docs['classes/c2'] == {'name': 'B'}
+        assert store.docs['classes/c3']['invite_code'] == 'OLD'
+
+
+# ============================================================================
+# BROADCAST TESTS
+# ============================================================================
+
+class TestBroadcast:
+    """Test suite for chunked broadcast delivery"""
+
+    sender = {'uid': 't1', 'name': 'Teacher'}
+    job_path = 'institutions/i1/broadcast_jobs/job1'
+
+    def _store(self, **kwargs):
+        return FakeFirestore({self.job_path: {'status': 'queued'}}, **kwargs)
+
+    @staticmethod
+    def _inbox_items(store):
+        return {path: doc for path, doc in store.docs.items() if '/inbox/' in path}
+
+    def test_chunking_and_status(self):
+        """Test recipients split into batch-sized chunks and statuses summarize failures"""
+        assert [len(c) for c in chunked(list(range(1001)), 400)] == [400, 400, 201]
+        assert BroadcastSender(None).chunk_size * WRITES_PER_NOTIFICATION <= 400
+        assert job_status(10, 0) == 'done'
+        assert job_status(5, 5) == 'partial'
+        assert job_status(0, 5) == 'failed'
+
+    def test_delivers_past_batch_limit_with_retries(self):
+        """Test a large broadcast is written once per recipient even when commits fail transiently"""
+        store = self._store(failures=2)
+        sender = BroadcastSender(store, parallelism=3, backoff=0)
+        uids = [f"s{i}" for i in range(1200)] + ['s0']
+        sender._run('i1', 'job1', self.sender, 'Exam tomorrow', lambda: uids)
+        items = self._inbox_items(store)
+        assert len(items) == 1200
+        assert items['users/s7/inbox/broadcast_job1']['recipient_uid'] == 's7'
+        job = store.docs[self.job_path]
+        assert (job['total'], job['delivered'], job['status']) == (1200, 1200, 'done')
+
+    def test_retry_after_lost_ack_counts_once(self):
+        """Test a chunk whose commit went through but reported an error is not delivered or counted twice"""
+        store = self._store(lost_acks=1)
+        sender = BroadcastSender(store, parallelism=1, chunk_size=2, backoff=0)
+        sender._run('i1', 'job1', self.sender, 'Hi', lambda: ['a', 'b', 'c'])
+        assert len(self._inbox_items(store)) == 3
+        assert {store.docs[f"users/{uid}/inbox_state/counter"]['unread'] for uid in 'abc'} == {1}
+        assert store.docs[self.job_path]['status'] == 'done'
+
+    def test_exhausted_retries_mark_job_partial(self):
+        """Test a chunk that keeps failing is counted as failed"""
+        store = self._store(failures=3)
+        sender = BroadcastSender(store, parallelism=1, chunk_size=2, backoff=0)
+        sender._run('i1', 'job1', self.sender, 'Hi', lambda: ['a', 'b', 'c'])
+        assert len(self._inbox_items(store)) == 1
+        assert store.docs[self.job_path]['status'] == 'partial'
+
+
+class TestNotificationInbox:
+    """Test suite for per-user notification inboxes"""
+
+    def test_delivery_updates_counter_in_same_batch(self):
+        """Test each notification bumps the recipient's unread counter alongside the item"""
+        store = FakeFirestore()
+        inbox = NotificationInbox(store)
+        batch = store.batch()
+        notif_id = inbox.add_to_batch(batch, 'u1', {'message': 'Hi', 'created_at': '2026-03-31T12:00:00'}, 'n1')
+        assert notif_id == 'n1'
+        assert [ref.path for _, ref, _, _ in batch.ops] == ['users/u1/inbox/n1', 'users/u1/inbox_state/counter']
+        batch.commit()
+        assert store.docs['users/u1/inbox/n1']['read'] is False
+        assert store.docs['users/u1/inbox_state/counter'] == {'unread': 1, 'latest_at': '2026-03-31T12:00:00'}
+
+
+class _InboxStub:
+    """Stand-in for the app's NotificationInbox recording calls"""
+
+    def __init__(self, unread=0, latest_at=None, items=()):
+        self.unread = unread
+        self.latest_at = latest_at
+        self.items = list(items)
+        self.queried = 0
+
+    def state(self, uid):
+        return self.unread, self.latest_at
+
+    def latest_unread(self, uid):
+        self.queried += 1
+        return self.items
+
+    def mark_read(self, uid, notif_id):
+        return any(item['id'] == notif_id for item in self.items)
+
+    def mark_all_read(self, uid):
+        return len(self.items)
+
+
+class TestNotificationRoutes:
+    """Test suite for the notification polling and read-state endpoints"""
+
+    def _login(self, client, monkeypatch, stub):
+        import app as flask_app
+        monkeypatch.setattr(flask_app, 'inbox', stub)
+        with client.session_transaction() as sess:
+            sess['uid'] = 'u1'
+
+    def test_nothing_unread_clears_the_tray(self, client, monkeypatch):
+        """Test an empty inbox returns an empty list (not null) even when latest_at is unchanged"""
+        stub = _InboxStub(unread=0, latest_at='2026-03-31T12:00:00')
+        self._login(client, monkeypatch, stub)
+        data = client.get('/api/notifications?since=2026-03-31T12:00:00').get_json()
+        assert data['unread'] == 0 and data['notifications'] == []
+        assert stub.queried == 0
+
+    def test_unchanged_poll_returns_null_and_new_ones_are_listed(self, client, monkeypatch):
+        """Test notifications are only queried when something arrived after since"""
+        stub = _InboxStub(unread=1, latest_at='2026-03-31T12:00:00', items=[{'id': 'n1', 'message': 'Hi'}])
+        self._login(client, monkeypatch, stub)
+        assert client.get('/api/notifications?since=2026-03-31T12:00:00').get_json()['notifications'] is None
+        assert stub.queried == 0
+        data = client.get('/api/notifications?since=2026-03-30T08:00:00').get_json()
+        assert data['notifications'] == [{'id': 'n1', 'message': 'Hi'}] and stub.queried == 1
+
+    def test_mark_read_and_mark_all_read(self, client, monkeypatch):
+        """Test marking one (or an unknown) notification and marking all"""
+        self._login(client, monkeypatch, _InboxStub(unread=2, items=[{'id': 'n1'}, {'id': 'n2'}]))
+        assert client.post('/api/notifications/n1/mark_read').get_json() == {'success': True}
+        assert client.post('/api/notifications/missing/mark_read').status_code == 404
+        assert client.post('/api/notifications/mark_all_read').get_json() == {'success': True, 'marked': 2}
+
+
+class TestInboxReadState:
+    """Test suite for marking inbox notifications read"""
+
+    def test_mark_all_read_in_batches(self):
+        """Test every unread item is marked in batch-sized commits and the counter drops to zero"""
+        store = FakeFirestore({f"users/u1/inbox/n{i}": {'read': False} for i in range(450)})
+        store.docs['users/u1/inbox_state/counter'] = {'unread': 450}
+        assert NotificationInbox(store).mark_all_read('u1') == 450
+        assert store.commits == 2
+        assert store.docs['users/u1/inbox_state/counter']['unread'] == 0
+        assert not any(not doc['read'] for path, doc in store.docs.items() if '/inbox/' in path)
+
+
+# ============================================================================
+# PUB/SUB TESTS
+# ============================================================================
+
+class TestPubSub:
+    """Test suite for the notification push channel"""
+
+    def test_local_fan_out_and_connection_count(self):
+        """Test messages reach every subscriber of a channel and closing updates the count"""
+        broker = LocalBroker()
+        first = broker.subscribe(['user:u1', 'institution:i1'])
+        second = broker.subscribe(['user:u2', 'institution:i1'])
+        assert broker.connection_count() == 2
+        assert broker.publish('institution:i1', {'n': 1}) == 2
+        assert broker.publish('user:u1', {'n': 2}) == 1
+        assert first.get(timeout=0) == {'n': 1}
+        assert first.get(timeout=0) == {'n': 2}
+        assert second.get(timeout=0) == {'n': 1}
+        assert second.get(timeout=0) is None
+        first.close()
+        first.close()
+        assert broker.connection_count() == 1
+        assert broker.publish('user:u1', {'n': 3}) == 0
+
+    def test_unstarted_stream_holds_no_connection(self, app, monkeypatch):
+        """Test a notification stream response that is never iterated registers no connection"""
+        import app as flask_app
+        broker = LocalBroker()
+        monkeypatch.setattr(flask_app, 'notification_broker', broker)
+        flask_app.Response(flask_app._notification_events('u1', ['user:u1'])).close()
+        assert broker.connection_count() == 0
+        events = flask_app._notification_events('u1', ['user:u1'])
+        assert next(events) == "retry: 5000\n\n"
+        assert broker.connection_count() == 1
+        events.close()
+        assert broker.connection_count() == 0
+
+    def test_disk_cache_relay_between_processes(self):
+        """Test a message published by one worker reaches subscribers of another exactly once"""
+        import tempfile
+        import diskcache
+        with tempfile.TemporaryDirectory() as tmpdir, diskcache.Cache(tmpdir) as store:
+            publisher = DiskCacheBroker(store, poll_interval=0)
+            receiver = DiskCacheBroker(store, poll_interval=0)
+            own = publisher.subscribe(['user:u1'])
+            remote = receiver.subscribe(['user:u1'])
+            last = store.get('pubsub:seq', 0)
+            publisher.publish('user:u1', {'n': 1})
+            assert receiver.relay_pending(last) == last + 1
+            assert remote.get(timeout=0) == {'n': 1}
+            # The publisher delivered locally already and must not relay its own message
+            assert publisher.relay_pending(last) == last + 1
+            assert own.get(timeout=0) == {'n': 1}
+            assert own.get(timeout=0) is None
+
+
+# ============================================================================
+# CALENDAR TESTS
+# ============================================================================
+
+class TestCalendarEvents:
+    """Test suite for calendar event timestamps"""
+
+    def test_parse_event_time_formats(self):
+        """Test ISO strings with 'Z', offsets and bare dates normalize to UTC"""
+        from datetime import timezone
+        assert parse_event_time('2026-05-01T10:00:00Z') == datetime(2026, 5, 1, 10, tzinfo=timezone.utc)
+        assert parse_event_time('2026-05-01T10:00:00+05:30') == datetime(2026, 5, 1, 4, 30, tzinfo=timezone.utc)
+        assert parse_event_time('2026-05-01') == datetime(2026, 5, 1, tzinfo=timezone.utc)
+        assert parse_event_time('next tuesday') is None
+        assert parse_event_time('') is None
+
+    def test_event_times_defaults_and_clamps_end(self):
+        """Test a missing end takes the start and an end before the start is clamped"""
+        times = event_times('2026-05-01T10:00:00Z', None)
+        assert times['end_at'] == times['start_at']
+        times = event_times('2026-05-02', '2026-05-01')
+        assert times['end_at'] == times['start_at']
+        assert event_times(None, None) == {'start_at': None, 'end_at': None, 'long_span': False}
+
+    def test_to_client_hides_internal_timestamps(self):
+        """Test events are sent with ISO start/end and a display date only"""
+        event = {'title': 'Exam', 'start_date': '2026-05-01T10:00:00Z', 'end_date': None,
+                 **event_times('2026-05-01T10:00:00Z', None)}
+        client = to_client('e1', event)
+        assert client['id'] == 'e1'
+        assert client['start'] == '2026-05-01T10:00:00Z'
+        assert client['display_date'] == '2026-05-01'
+        assert 'start_at' not in client and 'end_at' not in client and 'end' not in client
+
+    def test_window_includes_events_longer_than_the_start_range(self):
+        """Test an event spanning months shows in every window it overlaps, read through the long_span query"""
+        events = {
+            'term': {'uid': 'u1', 'start_date': '2026-01-05', 'end_date': '2026-06-30'},
+            'exam': {'uid': 'u1', 'start_date': '2026-05-10', 'end_date': None},
+            'old': {'uid': 'u1', 'start_date': '2026-01-10', 'end_date': '2026-01-12'},
+            'later': {'uid': 'u1', 'start_date': '2026-07-02', 'end_date': None},
+        }
+        for event in events.values():
+            event.update(event_times(event['start_date'], event['end_date']))
+        assert events['term']['long_span'] and not events['exam']['long_span']
+        db = FakeFirestore({f"calendar_events/{event_id}": event for event_id, event in events.items()})
+        found = events_in_window(db, 'u1', '2026-05-01', '2026-06-01')
+        assert sorted(event['id'] for event in found) == ['exam', 'term']
+        assert 'long_span' not in found[0]
+
+
+# ============================================================================
+# STUDY LOG TESTS
+# ============================================================================
+
+class TestStudyLog:
+    """Test suite for study sessions and their daily/weekly rollups"""
+
+    def test_summary_series_and_expiry(self):
+        """Test the daily and weekly series end today and old keys are reported for pruning"""
+        rollup = {
+            'day_seconds': {'2026-04-14': 3600, '2026-04-08': 600, '2026-01-01': 60},
+            'week_seconds': {week_key('2026-04-14'): 3600, week_key('2026-04-08'): 600, '2025-W40': 60}
+        }
+        result = summarize(rollup, '2026-04-14')
+        assert [d['date'] for d in result['daily']] == [f"2026-04-{day:02d}" for day in range(8, 15)]
+        assert result['daily'][-1]['minutes'] == 60 and result['daily'][0]['minutes'] == 10
+        assert result['total_week_hours'] == 1.2
+        assert [w['minutes'] for w in result['weekly']][-2:] == [10, 60]
+        assert expired_keys(rollup, '2026-04-14') == (['2026-01-01'], ['2025-W40'])
+        assert week_key('2027-01-01') == '2026-W53'
+
+    def test_timer_session_created_once_and_rolled_up(self):
+        """Test repeated timer reports extend one session and add every second to the rollups"""
+        store = FakeFirestore()
+        log = StudyLog(store)
+        data = {'start_time': '2026-04-14T09:15:00+05:30', 'last_updated': '2026-04-14T03:45:00'}
+        assert log.record_time('u1', '2026-04-14-03', data, 60) is True
+        assert log.record_time('u1', '2026-04-14-03', data, 30) is False
+        session = store.docs['users/u1/study_sessions/2026-04-14-03']
+        assert session['duration_seconds'] == 90
+        rollup = store.docs['users/u1/study_rollups/totals']
+        assert rollup['day_seconds'] == {'2026-04-14': 90}
+        assert rollup['week_seconds'] == {week_key('2026-04-14'): 90}
+
+    def test_writes_prune_old_keys_and_summary_only_reads(self):
+        """Test reading the summary writes nothing and the next session write drops keys that left the history"""
+        path = 'users/u1/study_rollups/totals'
+        rollup = {
+            'day_seconds': {'2026-03-01': 60, '2026-03-20': 120},
+            'week_seconds': {'2026-W01': 60, week_key('2026-03-20'): 120}
+        }
+        store = FakeFirestore({path: rollup})
+        log = StudyLog(store)
+        assert log.summary('u1', '2026-04-14')['total_week_hours'] == 0
+        assert store.docs[path] == rollup
+        log.log_session('u1', 'Physics', 1, '2026-04-14')
+        assert store.docs[path]['day_seconds'] == {'2026-03-20': 120, '2026-04-14': 60}
+        assert set(store.docs[path]['week_seconds']) == {week_key('2026-03-20'), week_key('2026-04-14')}
+
+    def test_manual_session_counted(self):
+        """Test hand-logged sessions land in the user's store and rollups"""
+        store = FakeFirestore()
+        session = StudyLog(store).log_session('u1', 'Physics', 45, '2026-04-13')
+        assert session['duration_minutes'] == 45 and session['session_date'] == '2026-04-13'
+        assert store.docs['users/u1/study_rollups/totals']['day_seconds'] == {'2026-04-13': 2700}
+
+
+# ============================================================================
+# AI MODEL SELECTION TESTS
+# ============================================================================
+
+class _StubGenAI:
+    """Stand-in for google.generativeai; models listed in down raise on every call"""
+
+    class _Response:
+        text = 'Answer'
+
+    def __init__(self, down=()):
+        self.down = set(down)
+        self.calls = []
+        self.configured = None
+
+    def configure(self, api_key):
+        self.configured = api_key
+
+    def GenerativeModel(self, model_name):
+        stub = self
+
+        class _Model:
+            def generate_content(self, prompt, stream=False, **kwargs):
+                stub.calls.append(model_name)
+                if stream:
+                    return stub._stream(model_name)
+                if model_name in stub.down:
+                    raise RuntimeError(f"{model_name} unavailable")
+                return _StubGenAI._Response()
+
+        return _Model()
+
+    def _stream(self, model_name):
+        # Like the real client, a failing model only raises once iterated
+        if model_name in self.down:
+            raise RuntimeError(f"{model_name} unavailable")
+        for text in ('Ans', 'wer'):
+            chunk = _StubGenAI._Response()
+            chunk.text = text
+            yield chunk
+
+
+class TestModelSelection:
+    """Test suite for background model probing and request-path fallback"""
+
+    def test_request_falls_through_and_remembers_model(self, tmp_path):
+        """Test a failing model is skipped, the next one answers and is tried first afterwards"""
+        import diskcache
+        with diskcache.Cache(str(tmp_path)) as store:
+            genai = _StubGenAI(down={'a'})
+            selector = ModelSelector(genai, candidates=['a', 'b', 'c'], store=store)
+            assert selector.generate('Hi').text == 'Answer'
+            assert genai.calls == ['a', 'b']
+            assert store.get(LAST_GOOD_KEY) == 'b'
+            assert selector.order() == ['b', 'c', 'a']
+            # Another worker starts with the persisted model
+            assert ModelSelector(genai, candidates=['a', 'b', 'c'], store=store).order()[0] == 'b'
+
+    def test_probe_moves_back_to_preferred_model(self, tmp_path):
+        """Test the probe only tries models preferred over the current one"""
+        import diskcache
+        with diskcache.Cache(str(tmp_path)) as store:
+            store.set(LAST_GOOD_KEY, 'b')
+            genai = _StubGenAI(down={'a'})
+            selector = ModelSelector(genai, candidates=['a', 'b', 'c'], store=store)
+            assert selector.probe() == 'b'
+            assert genai.calls == ['a']
+            genai.down.clear()
+            assert selector.probe() == 'a'
+            assert store.get(LAST_GOOD_KEY) == 'a'
+
+    def test_assistant_ready_without_network(self, tmp_path, monkeypatch):
+        """Test constructing the assistant makes no model calls and requests fall back"""
+        import diskcache
+        monkeypatch.setenv('GEMINI_API_KEY', 'test-key')
+        monkeypatch.setattr(ModelSelector, 'start_probe', lambda self: None)
+        with diskcache.Cache(str(tmp_path)) as store:
+            genai = _StubGenAI(down={'models/gemini-2.5-flash'})
+            assistant = AIAssistant(genai=genai, store=store)
+            assert assistant.ai_available and genai.configured == 'test-key'
+            assert genai.calls == []
+            assert assistant.generate_doubt_response('What is 2+2?', {}) == 'Answer'
+            assert assistant.model_name == 'models/gemini-2.5-pro'
+
+
+# ============================================================================
+# CHAT STREAMING TESTS
+# ============================================================================
+
+def _parse_sse(message):
+    import json
+    lines = dict(line.split(': ', 1) for line in message.strip().split('\n'))
+    return lines['event'], json.loads(lines['data'])
+
+
+class TestChatStreaming:
+    """Test suite for streamed AI answers"""
+
+    def test_first_token_arrives_before_generation_ends(self):
+        """Test chunks are relayed as a slow model yields them and the full answer is saved after"""
+        import time
+        saved = []
+
+        def slow_model():
+            for text in ('Photo', 'synthesis ', 'uses ', 'light.'):
+                time.sleep(0.05)
+                yield text
+
+        started = time.perf_counter()
+        events = relay_answer(slow_model(), lambda text: saved.append(text) or {'response': text})
+        first = _parse_sse(next(events))
+        time_to_first_token = time.perf_counter() - started
+        rest = [_parse_sse(message) for message in events]
+        total = time.perf_counter() - started
+        assert first == ('chunk', {'text': 'Photo'})
+        assert time_to_first_token < 0.15 <= total
+        assert rest[-1] == ('done', {'response': 'Photosynthesis uses light.'})
+        assert saved == ['Photosynthesis uses light.']
+
+    @staticmethod
+    def _model(closed):
+        try:
+            yield 'Part one'
+            yield 'Part two'
+        finally:
+            closed.append(True)
+
+    def test_disconnect_closes_model_without_completing(self):
+        """Test closing the stream (client gone) closes the model stream and never calls on_complete"""
+        closed = []
+        completed = []
+        events = relay_answer(self._model(closed), completed.append)
+        assert _parse_sse(next(events))[0] == 'chunk'
+        events.close()
+        assert closed == [True] and completed == []
+
+    def test_disconnect_saves_only_the_question_through_on_abort(self):
+        """Test a disconnect with the route's on_abort keeps the user's question and no partial answer"""
+        closed = []
+        saved = []
+
+        def save(*reply):
+            saved.append([data['content'] for _, data in chat_messages(('user', 'Why?', '10:00'), *reply)])
+
+        events = relay_answer(self._model(closed), lambda text: save(('assistant', text, '10:01')), on_abort=save)
+        assert _parse_sse(next(events))[0] == 'chunk'
+        events.close()
+        assert closed == [True] and saved == [['Why?']]
+
+    def test_stream_falls_back_before_first_chunk(self, tmp_path):
+        """Test a model failing at the start of its stream is replaced by the next one"""
+        import diskcache
+        with diskcache.Cache(str(tmp_path)) as store:
+            genai = _StubGenAI(down={'a'})
+            selector = ModelSelector(genai, candidates=['a', 'b'], store=store)
+            assert list(selector.stream('Explain')) == ['Ans', 'wer']
+            assert genai.calls == ['a', 'b']
+            assert store.get(LAST_GOOD_KEY) == 'b'
+
+
+# ============================================================================
+# ANSWER CACHE TESTS
+# ============================================================================
+
+class TestAnswerCache:
+    """Test suite for the doubt answer cache"""
+
+    context = {'purpose': 'high_school', 'grade': '10', 'board': 'CBSE'}
+
+    def _cache(self, **kwargs):
+        weights = TermWeights([
+            "Euclid's Division Algorithm Understanding Euclid's division lemma",
+            'Real Numbers rational and irrational numbers',
+            'Polynomials zeroes of a polynomial and division algorithm'
+        ])
+        return AnswerCache(weights, **kwargs)
+
+    def test_exact_and_similar_tiers(self):
+        """Test rephrasings hit, other topics and words outside the syllabus miss, and hits are counted"""
+        cache = self._cache(threshold=0.9)
+        cache.put("Explain Euclid's division lemma", self.context, 'Lemma answer')
+        assert question_terms('What is Euclids division lemma?') == ('euclid', 'division', 'lemma')
+        assert cache.get('What is Euclids division lemma?', self.context) == 'Lemma answer'
+        assert cache.get('euclid division lemma algorithm', self.context) == 'Lemma answer'
+        assert cache.get('euclid division lemma proof', self.context) is None
+        assert cache.get('polynomial division algorithm', self.context) is None
+        assert cache.get('hi', self.context) is None
+        stats = cache.stats()
+        assert (stats['exact_hits'], stats['similar_hits'], stats['misses']) == (1, 1, 2)
+        assert stats['hit_rate'] == 0.5
+
+    def test_different_questions_never_share_an_answer(self):
+        """Test questions differing in a number, an ordinal or a swapped word miss with the real syllabus weights"""
+        from utils.answer_cache import syllabus_documents
+        weights = TermWeights(syllabus_documents(SYLLABUS_INDEX.store.skeleton()))
+        for cached, asked in [
+            ('Is 7 a prime number?', 'Is 9 a prime number?'),
+            ('atomic number of carbon', 'atomic mass of carbon'),
+            ('State Newton first law of motion', 'State Newton third law of motion'),
+            ('Newton law of motion', 'Newton third law of motion'),
+        ]:
+            cache = AnswerCache(weights)
+            cache.put(cached, self.context, 'Cached answer')
+            assert cache.get(asked, self.context) is None, asked
+
+    def test_context_ttl_and_lru(self):
+        """Test answers are scoped to (purpose, grade, board, subjects), expire and are evicted least recently used"""
+        cache = self._cache(ttl=60, maxsize=2)
+        cache.put('euclid division lemma', self.context, 'Grade 10')
+        assert cache.get('euclid division lemma', {**self.context, 'grade': '9'}) is None
+        after_tenth = {'purpose': 'after_tenth', 'grade': '11', 'subjects': ['Physics', 'Chemistry']}
+        other = self._cache()
+        other.put('newton law', after_tenth, 'Science')
+        assert other.get('newton law', {**after_tenth, 'subjects': ['Economics', 'History']}) is None
+        assert other.get('newton law', after_tenth) == 'Science'
+        cache.put('real numbers', self.context, 'Numbers')
+        cache.get('euclid division lemma', self.context)
+        cache.put('polynomial zeroes', self.context, 'Zeroes')
+        assert cache.get('real numbers', self.context) is None
+        assert cache.get('euclid division lemma', self.context) == 'Grade 10'
+        cache.ttl = -1
+        assert cache.get('euclid division lemma', self.context) is None
+
+    def test_assistant_reuses_answer_and_honours_opt_out(self, tmp_path, monkeypatch):
+        """Test a repeated doubt skips the model, while modes outside the cache always call it"""
+        import diskcache
+        monkeypatch.setenv('GEMINI_API_KEY', 'test-key')
+        monkeypatch.setattr(ModelSelector, 'start_probe', lambda self: None)
+        with diskcache.Cache(str(tmp_path)) as store:
+            genai = _StubGenAI()
+            assistant = AIAssistant(genai=genai, store=store)
+            assistant.answers = self._cache(modes=['doubt'])
+            assert assistant.generate_doubt_response("Explain Euclid's division lemma", dict(self.context)) == 'Answer'
+            assert assistant.generate_doubt_response('euclid division lemma?', dict(self.context)) == 'Answer'
+            assert len(genai.calls) == 1
+            assistant.generate_doubt_response('euclid division lemma?', {**self.context, 'mode': 'doubt_solver'})
+            assert len(genai.calls) == 2
+
+
+# ============================================================================
+# CHAT PERSISTENCE TESTS
+# ============================================================================
+
+class TestChatWriter:
+    """Test suite for write-behind chat persistence"""
+
+    def test_exchange_is_one_batch(self):
+        """Test both messages and the thread metadata are committed together"""
+        store = FakeFirestore()
+        thread_ref = store.collection('users').document('u1').collection('sclera_threads').document('t1')
+        messages = chat_messages(('user', 'Q', '10:00'), ('assistant', 'A', '10:01'))
+        write_exchange(store, thread_ref, messages, {'last_message_at': '10:01', 'mode': 'doubt_solver'})
+        assert store.commits == 1
+        thread = store.docs['users/u1/sclera_threads/t1']
+        assert thread['message_count'] == 2 and thread['last_message_at'] == '10:01'
+        saved = [store.docs[f"users/u1/sclera_threads/t1/messages/{mid}"]['content'] for mid, _ in messages]
+        assert saved == ['Q', 'A']
+
+    def test_repeated_exchange_is_counted_once(self):
+        """Test retrying an exchange that was already committed leaves messages and message_count unchanged"""
+        store = FakeFirestore()
+        thread_ref = store.collection('users').document('u1').collection('sclera_threads').document('t1')
+        messages = chat_messages(('user', 'Q', '10:00'), ('assistant', 'A', '10:01'))
+        write_exchange(store, thread_ref, messages, {'last_message_at': '10:01'})
+        write_exchange(store, thread_ref, messages, {'last_message_at': '10:01'})
+        assert store.docs['users/u1/sclera_threads/t1']['message_count'] == 2
+
+    def test_new_thread_pointer_commits_with_first_exchange(self, tmp_path):
+        """Test a new thread's active pointer is stored only by the batch that creates the thread"""
+        import diskcache
+        with diskcache.Cache(str(tmp_path)) as cache_store:
+            store = FakeFirestore(failures=1)
+            threads = ActiveThreads(store, store=cache_store)
+            thread_ref = store.collection('users').document('u1').collection('sclera_threads').document('t1')
+            messages = chat_messages(('user', 'Q', '10:00'))
+            fields = {'mode': 'doubt_solver', 'title': 'Q', 'last_message_at': '10:00'}
+            with pytest.raises(RuntimeError):
+                write_exchange(store, thread_ref, messages, fields, also=[threads.pointer('u1', 'doubt_solver', 't1')])
+            assert store.docs == {}
+            write_exchange(store, thread_ref, messages, fields, also=[threads.pointer('u1', 'doubt_solver', 't1')])
+            assert store.docs['users/u1/sclera_active/doubt_solver'] == {'thread_id': 't1'}
+            assert store.docs['users/u1/sclera_threads/t1']['mode'] == 'doubt_solver'
+
+    def test_retries_in_background_and_flushes(self):
+        """Test failed writes are retried off the caller's thread and flush waits for them"""
+        import threading
+        attempts = []
+        written = []
+
+        def flaky(value):
+            attempts.append(threading.current_thread().name)
+            if len(attempts) < 3:
+                raise RuntimeError('unavailable')
+            written.append(value)
+
+        writer = ChatWriter(backoff=0)
+        assert writer.submit(flaky, 'pair') is True
+        assert writer.flush(timeout=5)
+        assert written == ['pair'] and set(attempts) == {'chat-writer'}
+        assert writer.pending() == 0
+
+    def test_full_queue_writes_inline(self):
+        """Test a full queue falls back to writing in the caller rather than dropping"""
+        import threading
+        started, release = threading.Event(), threading.Event()
+        written = []
+        writer = ChatWriter(maxsize=1, backoff=0)
+        writer.submit(lambda: started.set() or release.wait(5))
+        assert started.wait(5)
+        writer.submit(written.append, 'queued')
+        assert writer.submit(written.append, 'inline') is False
+        assert written == ['inline']
+        release.set()
+        assert writer.flush(timeout=5) and written == ['inline', 'queued']
+
+
+# ============================================================================
+# CHAT THREAD TESTS
+# ============================================================================
+
+def _thread_store(threads=0):
+    """Threads t0..t{n-1} of one mode (newest last) plus one thread of another mode"""
+    docs = {f"users/u1/sclera_threads/t{n}": {'mode': 'doubt_solver', 'last_message_at': f"2026-01-01T10:{n:04d}"}
+            for n in range(threads)}
+    docs['users/u1/sclera_threads/other'] = {'mode': 'academic_planner', 'last_message_at': '2026-02-01T00:00'}
+    return FakeFirestore(docs)
+
+
+class TestChatThreads:
+    """Test suite for paginated thread listing and the active-thread pointer"""
+
+    def test_pages_follow_cursor(self):
+        """Test threads come newest first in pages and only the mode's threads are listed"""
+        store = _thread_store(threads=5)
+        query = store.collection('users').document('u1').collection('sclera_threads').where('mode', '==', 'doubt_solver')
+        first, cursor = thread_page(query, limit=2)
+        assert [doc.id for doc in first] == ['t4', 't3'] and cursor == '2026-01-01T10:0003|t3'
+        second, cursor = thread_page(query, limit=2, cursor=cursor)
+        third, cursor = thread_page(query, limit=2, cursor=cursor)
+        assert [doc.id for doc in second + third] == ['t2', 't1', 't0'] and cursor is None
+        # A cursor issued before the id tiebreaker still pages on the timestamp
+        assert [doc.id for doc in thread_page(query, limit=2, cursor='2026-01-01T10:0003')[0]] == ['t2', 't1']
+
+    def test_threads_sharing_a_timestamp_are_not_skipped(self):
+        """Test threads touched in the same second all appear once across page boundaries"""
+        store = _thread_store()
+        for n in range(5):
+            store.docs[f"users/u1/sclera_threads/s{n}"] = {'mode': 'doubt_solver', 'last_message_at': '2026-03-01T09:00:00'}
+        query = store.collection('users').document('u1').collection('sclera_threads').where('mode', '==', 'doubt_solver')
+        seen, cursor = [], None
+        while True:
+            page, cursor = thread_page(query, limit=2, cursor=cursor)
+            seen.extend(doc.id for doc in page)
+            if not cursor:
+                break
+        assert seen == ['s4', 's3', 's2', 's1', 's0']
+
+    def test_active_thread_reads_do_not_grow_with_history(self, tmp_path):
+        """Test locating the active thread costs the same reads for 3 or 300 threads, and none once cached"""
+        import diskcache
+        for count in (3, 300):
+            with diskcache.Cache(str(tmp_path / str(count))) as cache_store:
+                store = _thread_store(threads=count)
+                threads = ActiveThreads(store, store=cache_store)
+                assert threads.get('u1', 'doubt_solver') == f"t{count - 1}"
+                assert store.reads == 2
+                assert threads.get('u1', 'doubt_solver') == f"t{count - 1}"
+                assert store.reads == 2
+
+    def test_switch_and_delete(self, tmp_path):
+        """Test a switched-to thread stays active across workers until it is deleted"""
+        import diskcache
+        with diskcache.Cache(str(tmp_path)) as cache_store:
+            store = _thread_store(threads=3)
+            threads = ActiveThreads(store, store=cache_store)
+            threads.set('u1', 'doubt_solver', 't0')
+            assert threads.get('u1', 'doubt_solver') == 't0'
+            assert store.docs['users/u1/sclera_active/doubt_solver'] == {'thread_id': 't0'}
+            # A worker on another host (its own disk cache) reads the stored pointer
+            with diskcache.Cache(str(tmp_path / 'other')) as other_store:
+                assert ActiveThreads(store, store=other_store).get('u1', 'doubt_solver') == 't0'
+            threads.discard('u1', 'doubt_solver', 't1')
+            assert threads.get('u1', 'doubt_solver') == 't0'
+            del store.docs['users/u1/sclera_threads/t0']
+            threads.discard('u1', 'doubt_solver', 't0')
+            assert 'users/u1/sclera_active/doubt_solver' not in store.docs
+            assert threads.get('u1', 'doubt_solver') == 't2'
+
+
 # ============================================================================
 # RUN TESTS
 # ============================================================================
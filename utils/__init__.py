@@ -10,6 +10,11 @@ from .validators import (
 )
 from .cache import CacheManager, cached, invalidate_cache
 from .logger import AppLogger, logger, setup_logging
+from .leaderboard import (
+    GlobalLeaderboard, BubbleLeaderboard, build_leaderboard_entry, rank_entries,
+    LEADERBOARD_COL, BUBBLE_LEADERBOARD_COL
+)
+from .exclusions import ExclusionResolver, exclusion_key, merge_exclusions
 
 __all__ = [
     'PasswordManager',
@@ -32,5 +37,14 @@ __all__ = [
     'invalidate_cache',
     'AppLogger',
     'logger',
-    'setup_logging'
+    'setup_logging',
+    'GlobalLeaderboard',
+    'BubbleLeaderboard',
+    'build_leaderboard_entry',
+    'rank_entries',
+    'LEADERBOARD_COL',
+    'BUBBLE_LEADERBOARD_COL',
+    'ExclusionResolver',
+    'exclusion_key',
+    'merge_exclusions'
 ]
@@ -0,0 +1,181 @@
+"""
+Background analytics jobs for StudyOS
+Recomputes institution dashboard analytics off the request path and keeps the latest snapshot in the disk cache
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from .cache import cache
+from .logger import logger
+
+SNAPSHOT_PREFIX = 'analytics:snapshot:'
+JOB_PREFIX = 'analytics:job:'
+LOCK_PREFIX = 'analytics:lock:'
+# Scopes (institution + classes) dashboards asked for, refreshed by the scheduler
+SCOPES_KEY = 'analytics:scopes'
+
+# Seconds a finished job record is kept
+_JOB_RECORD_TTL = 86400
+
+
+def job_key(institution_id: str, class_ids: Iterable[str] = None) -> str:
+    """Key identifying one analytics scope (a whole institution or a set of its classes)"""
+    class_ids = sorted(set(class_ids or []))
+    return f"{institution_id}:{','.join(class_ids) if class_ids else 'all'}"
+
+
+class AnalyticsJobs:
+    """
+    Runs analytics computations on a small thread pool.
+    Snapshots, job records and per-scope locks live in the shared disk cache,
+    so every worker process serves the same snapshot and a scope is never
+    computed twice at the same time. Stale snapshots are still served while
+    a refresh runs; a scheduler thread refreshes recently viewed scopes.
+    """
+
+    def __init__(self, compute: Callable[[str, Optional[list]], Dict[str, Any]], store=cache,
+                 workers: int = 2, max_age: int = 300, interval: int = 300,
+                 lock_timeout: int = 600, scope_ttl: int = 86400):
+        self.compute = compute
+        self.store = store
+        self.max_age = max_age
+        self.interval = interval
+        self.lock_timeout = lock_timeout
+        self.scope_ttl = scope_ttl
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analytics')
+        self._scheduler = None
+        self._scheduler_lock = threading.Lock()
+
+    @staticmethod
+    def _age(snapshot: Dict[str, Any]) -> float:
+        try:
+            return (datetime.utcnow() - datetime.fromisoformat(snapshot['computed_at'])).total_seconds()
+        except (KeyError, TypeError, ValueError):
+            return float('inf')
+
+    def is_stale(self, snapshot: Optional[Dict[str, Any]]) -> bool:
+        """Whether a snapshot is missing or older than max_age"""
+        return snapshot is None or self._age(snapshot) > self.max_age
+
+    def _remember(self, key: str, institution_id: str, class_ids: Optional[list]):
+        with self.store.transact():
+            scopes = self.store.get(SCOPES_KEY) or {}
+            scopes[key] = {'institution_id': institution_id, 'class_ids': class_ids, 'requested_at': time.time()}
+            self.store.set(SCOPES_KEY, scopes)
+
+    def _record(self, key: str, **fields):
+        record = self.store.get(JOB_PREFIX + key) or {}
+        record.update(fields)
+        self.store.set(JOB_PREFIX + key, record, expire=_JOB_RECORD_TTL)
+
+    def snapshot(self, institution_id: str, class_ids: Iterable[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get the latest analytics snapshot, queueing a refresh if it is missing or stale
+        Args:
+            institution_id: Institution identifier
+            class_ids: Only these classes (the whole institution when empty)
+        Returns:
+            Snapshot dictionary ('heatmap', 'at_risk', 'computed_at'), or None until the first job finishes
+        """
+        class_ids = sorted(set(class_ids or [])) or None
+        key = job_key(institution_id, class_ids)
+        self._remember(key, institution_id, class_ids)
+        self.start_scheduler()
+        snapshot = self.store.get(SNAPSHOT_PREFIX + key)
+        if self.is_stale(snapshot):
+            self.submit(institution_id, class_ids)
+        return snapshot
+
+    def job(self, institution_id: str, class_ids: Iterable[str] = None) -> Optional[Dict[str, Any]]:
+        """Get the record of the latest job for a scope (status, timestamps, error)"""
+        return self.store.get(JOB_PREFIX + job_key(institution_id, class_ids))
+
+    def _acquire(self, key: str) -> bool:
+        # add() only succeeds if the key is absent, across processes
+        return self.store.add(LOCK_PREFIX + key, time.time(), expire=self.lock_timeout)
+
+    def submit(self, institution_id: str, class_ids: Iterable[str] = None) -> bool:
+        """
+        Queue a recomputation unless one is already queued or running for the scope
+        Returns:
+            True if a job was queued
+        """
+        class_ids = sorted(set(class_ids or [])) or None
+        key = job_key(institution_id, class_ids)
+        if not self._acquire(key):
+            return False
+        self._record(key, status='queued', queued_at=datetime.utcnow().isoformat(), error=None)
+        self._pool.submit(self._run, key, institution_id, class_ids)
+        return True
+
+    def run_now(self, institution_id: str, class_ids: Iterable[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Recompute a scope in the calling thread (maintenance commands)
+        Returns:
+            The new snapshot, or None if a job for the scope is already running or failed
+        """
+        class_ids = sorted(set(class_ids or [])) or None
+        key = job_key(institution_id, class_ids)
+        if not self._acquire(key):
+            return None
+        return self._run(key, institution_id, class_ids)
+
+    def _run(self, key: str, institution_id: str, class_ids: Optional[list]) -> Optional[Dict[str, Any]]:
+        started = time.perf_counter()
+        self._record(key, status='running', started_at=datetime.utcnow().isoformat())
+        try:
+            analytics = self.compute(institution_id, class_ids)
+            snapshot = {
+                'heatmap': analytics['heatmap'],
+                'at_risk': analytics['at_risk'],
+                'computed_at': datetime.utcnow().isoformat(),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 2)
+            }
+            self.store.set(SNAPSHOT_PREFIX + key, snapshot, expire=None)
+            self._record(key, status='done', finished_at=snapshot['computed_at'])
+            logger.info("analytics_snapshot_computed", scope=key, duration_ms=snapshot['duration_ms'])
+            return snapshot
+        except Exception as e:
+            self._record(key, status='failed', finished_at=datetime.utcnow().isoformat(), error=str(e))
+            logger.error("analytics_job_failed", scope=key, error=str(e))
+            return None
+        finally:
+            self.store.delete(LOCK_PREFIX + key)
+
+    def refresh_due(self) -> int:
+        """
+        Queue refreshes for recently viewed scopes whose snapshot is stale
+        Returns:
+            Number of jobs queued
+        """
+        cutoff = time.time() - self.scope_ttl
+        with self.store.transact():
+            scopes = self.store.get(SCOPES_KEY) or {}
+            active = {k: v for k, v in scopes.items() if v['requested_at'] >= cutoff}
+            if len(active) != len(scopes):
+                self.store.set(SCOPES_KEY, active)
+        queued = 0
+        for key, scope in active.items():
+            if self.is_stale(self.store.get(SNAPSHOT_PREFIX + key)):
+                queued += self.submit(scope['institution_id'], scope['class_ids'])
+        return queued
+
+    def _schedule(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.refresh_due()
+            except Exception as e:
+                logger.error("analytics_scheduler_error", error=str(e))
+
+    def start_scheduler(self):
+        """Start the periodic refresh thread (once per process)"""
+        if self._scheduler is not None:
+            return
+        with self._scheduler_lock:
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(target=self._schedule, name='analytics-scheduler', daemon=True)
+                self._scheduler.start()
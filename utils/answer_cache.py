@@ -0,0 +1,212 @@
+"""
+AI answer cache for StudyOS
+Reuses doubt-solver answers for repeated questions from students with the same academic context
+"""
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Container, Dict, Iterable, Mapping, Optional, Tuple
+
+from .logger import logger
+
+# Words that carry no meaning for matching questions
+STOP_WORDS = frozenset("""
+a an and are as at be but by can could define definition describe do does explain explanation for from give
+hello help hi how i in is it me meaning my of on or please show tell than that the this to understand was
+we what whats when where which who why will with would you your
+""".split())
+
+# Words that pick one item out of a series; like numbers they change the question whatever their weight
+ORDINALS = frozenset("""
+first second third fourth fifth sixth seventh eighth ninth tenth last
+""".split())
+
+# Cosine similarity at or above which a cached answer is reused
+DEFAULT_THRESHOLD = 0.95
+
+ContextKey = Tuple[str, str, str, str]
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase a question, keeping only words and numbers separated by single spaces"""
+    return ' '.join(_WORD.findall(question.lower().replace("'s", '')))
+
+
+def question_terms(question: str) -> Tuple[str, ...]:
+    """Distinct meaningful words of a question (stop words dropped, plural 's' trimmed)"""
+    terms = []
+    for word in normalize_question(question).split():
+        if word in STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.append(word)
+    return tuple(dict.fromkeys(terms))
+
+
+def context_key(context: Mapping[str, Any]) -> ContextKey:
+    """The parts of the academic context the doubt prompt depends on (purpose, grade, board or exam, subjects)"""
+    board = context.get('board') or context.get('exam_type')
+    subjects = ', '.join(context.get('subjects') or [])
+    return tuple(str(value or '').lower() for value in (context.get('purpose'), context.get('grade'), board, subjects))
+
+
+def syllabus_documents(skeleton: Mapping[str, Any]) -> Iterable[str]:
+    """Chapter names and topic names/overviews of every syllabus in a store skeleton"""
+    def walk(subjects):
+        for subject in subjects.values():
+            for chapter_name, chapter in (subject.get('chapters') or {}).items():
+                yield chapter_name
+                for topic in chapter.get('topics') or []:
+                    yield f"{topic.get('name', '')} {topic.get('overview', '')}"
+
+    for grades in (skeleton.get('highschool') or {}).values():
+        for subjects in grades.values():
+            yield from walk(subjects)
+    for subjects in (skeleton.get('exams') or {}).values():
+        yield from walk(subjects)
+
+
+class TermWeights:
+    """
+    Inverse document frequency of words across the syllabus, so subject
+    terms ("lemma", "photosynthesis") decide similarity and words common
+    to many topics count less. Words outside the syllabus weigh 1.
+    """
+
+    def __init__(self, documents: Iterable[str]):
+        frequency: Dict[str, int] = {}
+        count = 0
+        for document in documents:
+            count += 1
+            for term in question_terms(document):
+                frequency[term] = frequency.get(term, 0) + 1
+        self.weights = {term: math.log((count + 1) / (df + 1)) + 1 for term, df in frequency.items()}
+
+    def vector(self, terms: Iterable[str]) -> Tuple[Dict[str, float], float]:
+        """Weighted term vector and its norm"""
+        vector = {term: self.weights.get(term, 1.0) for term in terms}
+        return vector, math.sqrt(sum(w * w for w in vector.values()))
+
+
+def interchangeable(a: Iterable[str], b: Iterable[str], vocabulary: Container[str]) -> bool:
+    """
+    Whether questions with these terms may share an answer
+    One must only add words to the other (no word swapped for another, as in
+    "atomic mass" / "atomic number"), and no added word may be a number, an
+    ordinal or a word outside the syllabus vocabulary.
+    """
+    a, b = set(a), set(b)
+    if a - b and b - a:
+        return False
+    return all(term in vocabulary and term not in ORDINALS and not any(c.isdigit() for c in term)
+               for term in a ^ b)
+
+
+def cosine(a: Tuple[Dict[str, float], float], b: Tuple[Dict[str, float], float]) -> float:
+    (va, na), (vb, nb) = a, b
+    if not na or not nb:
+        return 0.0
+    if len(va) > len(vb):
+        va, vb = vb, va
+    return sum(w * vb[term] for term, w in va.items() if term in vb) / (na * nb)
+
+
+class AnswerCache:
+    """
+    Two-tier cache of doubt answers, partitioned by (purpose, grade, board,
+    subjects). The exact tier matches the question's meaningful words; the
+    similarity tier compares syllabus-weighted term vectors of the questions
+    cached for the same context, and only between questions that are
+    interchangeable (one adds syllabus words to the other, never numbers or
+    ordinals). Entries expire after ttl seconds and the least recently used
+    go first once maxsize is reached. Thread-safe, per process.
+    """
+
+    def __init__(self, weights: TermWeights, ttl: int = 86400, maxsize: int = 2048,
+                 threshold: float = DEFAULT_THRESHOLD, modes: Iterable[str] = ('doubt', 'doubt_solver')):
+        """
+        Args:
+            weights: Term weights for the similarity tier
+            ttl: Seconds an answer is reused
+            maxsize: Answers kept
+            threshold: Minimum cosine similarity for a similarity hit (above 1 disables the tier)
+            modes: Chat modes allowed to use the cache
+        """
+        self.weights = weights
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.modes = frozenset(modes)
+        # (context, question terms) -> (stored at, answer, term vector)
+        self._entries: 'OrderedDict[Tuple[ContextKey, str], Tuple[float, str, Tuple[Dict[str, float], float]]]' = OrderedDict()
+        self._stats = {'exact_hits': 0, 'similar_hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+
+    def enabled(self, mode: str) -> bool:
+        return mode in self.modes
+
+    def _expired(self, stored_at: float) -> bool:
+        return time.monotonic() - stored_at > self.ttl
+
+    def get(self, question: str, context: Mapping[str, Any]) -> Optional[str]:
+        """Cached answer for a question asked in a context, or None"""
+        terms = question_terms(question)
+        if not terms:
+            return None
+        scope = context_key(context)
+        key = (scope, ' '.join(terms))
+        with self._lock:
+            result, answer = 'miss', None
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry[0]):
+                result, answer = 'exact', entry[1]
+                self._entries.move_to_end(key)
+            elif self.threshold <= 1:
+                vector = self.weights.vector(terms)
+                best, best_key = self.threshold, None
+                for key, (stored_at, _, cached_vector) in self._entries.items():
+                    if key[0] != scope or self._expired(stored_at):
+                        continue
+                    if not interchangeable(terms, key[1].split(), self.weights.weights):
+                        continue
+                    similarity = cosine(vector, cached_vector)
+                    if similarity >= best:
+                        best, best_key = similarity, key
+                if best_key is not None:
+                    result, answer = 'similar', self._entries[best_key][1]
+                    self._entries.move_to_end(best_key)
+            self._stats['exact_hits' if result == 'exact' else 'similar_hits' if result == 'similar' else 'misses'] += 1
+            hit_rate = self._hit_rate()
+        logger.info("ai_answer_cache", result=result, hit_rate=hit_rate)
+        return answer
+
+    def put(self, question: str, context: Mapping[str, Any], answer: str):
+        """Cache a model answer (questions without meaningful words are not cached)"""
+        terms = question_terms(question)
+        if not terms:
+            return
+        key = (context_key(context), ' '.join(terms))
+        vector = self.weights.vector(terms)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), answer, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _hit_rate(self) -> float:
+        lookups = sum(self._stats.values())
+        return round((self._stats['exact_hits'] + self._stats['similar_hits']) / lookups, 3) if lookups else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Lookup counters, hit rate and size since the process started"""
+        with self._lock:
+            return {**self._stats, 'hit_rate': self._hit_rate(), 'size': len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,167 @@
+"""
+Broadcast delivery utilities for StudyOS
+Delivers one inbox notification per recipient in batch-sized chunks on background threads, tracking progress on a job document
+"""
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+
+from .inbox import NotificationInbox, WRITES_PER_NOTIFICATION
+from .logger import logger
+
+BROADCAST_JOBS_COL = 'broadcast_jobs'
+
+# Recipients per batch (Firestore rejects batches with more than 500 writes)
+MAX_CHUNK_SIZE = 400 // WRITES_PER_NOTIFICATION
+
+
+def chunked(items: List[Any], size: int) -> Iterable[List[Any]]:
+    """Split a list into consecutive chunks of at most size items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def job_status(delivered: int, failed: int) -> str:
+    """Final status of a job: done, partial (some chunks failed) or failed"""
+    if failed == 0:
+        return 'done'
+    return 'partial' if delivered else 'failed'
+
+
+class BroadcastSender:
+    """
+    Deliver broadcasts to any number of recipients.
+    A job is recorded under institutions/{id}/broadcast_jobs and runs on a
+    small pool; each job commits its chunks with bounded parallelism and
+    retries. Each recipient's notification id is derived from the job and
+    the items are created, not overwritten: a retry of a chunk whose commit
+    went through (but reported an error) fails with AlreadyExists and is
+    counted as delivered, so no notification or unread count is doubled.
+    """
+
+    def __init__(self, db, jobs: int = 2, parallelism: int = 4, chunk_size: int = MAX_CHUNK_SIZE,
+                 max_attempts: int = 3, backoff: float = 0.5, broker=None):
+        self.db = db
+        self.inbox = NotificationInbox(db)
+        # Optional pub/sub broker; delivered chunks are pushed to connected recipients
+        self.broker = broker
+        self.parallelism = parallelism
+        self.chunk_size = max(1, min(chunk_size, MAX_CHUNK_SIZE))
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._pool = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='broadcast')
+
+    def _institution(self, inst_id: str):
+        return self.db.collection('institutions').document(inst_id)
+
+    def job_ref(self, inst_id: str, job_id: str):
+        return self._institution(inst_id).collection(BROADCAST_JOBS_COL).document(job_id)
+
+    def start(self, inst_id: str, sender: Dict[str, Any], message: str,
+              recipients: Callable[[], List[str]], class_id: str = None) -> str:
+        """
+        Record a broadcast job and deliver it in the background
+        Args:
+            inst_id: Institution identifier
+            sender: Dictionary with 'uid' and 'name'
+            message: Message text
+            recipients: Callable returning recipient uids (resolved on the worker, not in the request)
+            class_id: Target class, or None for the whole institution
+        Returns:
+            Job identifier
+        """
+        job_id = uuid.uuid4().hex
+        now = datetime.utcnow().isoformat()
+        self.job_ref(inst_id, job_id).set({
+            'sender_uid': sender['uid'],
+            'sender_name': sender['name'],
+            'class_id': class_id,
+            'message': message,
+            'status': 'queued',
+            'total': None,
+            'delivered': 0,
+            'failed': 0,
+            'created_at': now,
+            'updated_at': now
+        })
+        self._pool.submit(self._run, inst_id, job_id, sender, message, recipients)
+        return job_id
+
+    def get(self, inst_id: str, job_id: str) -> Dict[str, Any]:
+        """Get a job document (None if it does not exist)"""
+        doc = self.job_ref(inst_id, job_id).get()
+        return {'id': job_id, **doc.to_dict()} if doc.exists else None
+
+    def _commit_chunk(self, job_id: str, uids: List[str], payload: Dict[str, Any]):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                batch = self.db.batch()
+                for uid in uids:
+                    self.inbox.add_to_batch(batch, uid, payload, notif_id=f"broadcast_{job_id}")
+                batch.commit()
+                return
+            except AlreadyExists:
+                # Batches are all-or-nothing: an earlier attempt delivered the whole chunk
+                logger.info("broadcast_chunk_already_delivered", job_id=job_id, recipients=len(uids), attempt=attempt)
+                return
+            except Exception:
+                if attempt == self.max_attempts:
+                    raise
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def _push(self, inst_id: str, uids: List[str], notification: Dict[str, Any]):
+        if self.broker is None:
+            return
+        try:
+            self.broker.publish(f"institution:{inst_id}", {'recipients': uids, 'notification': notification})
+        except Exception as e:
+            logger.error("broadcast_push_failed", institution_id=inst_id, error=str(e))
+
+    def _run(self, inst_id: str, job_id: str, sender: Dict[str, Any], message: str,
+             recipients: Callable[[], List[str]]):
+        job_ref = self.job_ref(inst_id, job_id)
+        started = time.perf_counter()
+        delivered = failed = 0
+        try:
+            uids = list(dict.fromkeys(recipients()))
+            job_ref.update({'status': 'running', 'total': len(uids), 'updated_at': datetime.utcnow().isoformat()})
+            payload = {
+                'sender_uid': sender['uid'],
+                'sender_name': sender['name'],
+                'message': message,
+                'type': 'broadcast',
+                'broadcast_id': job_id,
+                'institution_id': inst_id,
+                'created_at': datetime.utcnow().isoformat()
+            }
+            with ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix='broadcast-chunk') as chunks:
+                futures = {
+                    chunks.submit(self._commit_chunk, job_id, chunk, payload): chunk
+                    for chunk in chunked(uids, self.chunk_size)
+                }
+                for future in as_completed(futures):
+                    size = len(futures[future])
+                    try:
+                        future.result()
+                        delivered += size
+                        job_ref.update({'delivered': firestore.Increment(size), 'updated_at': datetime.utcnow().isoformat()})
+                        self._push(inst_id, futures[future], {**payload, 'id': f"broadcast_{job_id}"})
+                    except Exception as e:
+                        failed += size
+                        logger.error("broadcast_chunk_failed", job_id=job_id, recipients=size, error=str(e))
+                        job_ref.update({'failed': firestore.Increment(size), 'last_error': str(e),
+                                        'updated_at': datetime.utcnow().isoformat()})
+            status = job_status(delivered, failed)
+        except Exception as e:
+            logger.error("broadcast_job_failed", job_id=job_id, error=str(e))
+            status = 'failed'
+            job_ref.update({'last_error': str(e)})
+        now = datetime.utcnow().isoformat()
+        job_ref.update({'status': status, 'finished_at': now, 'updated_at': now})
+        logger.info("broadcast_delivered", job_id=job_id, institution_id=inst_id, status=status,
+                    delivered=delivered, failed=failed, duration_ms=round((time.perf_counter() - started) * 1000, 2))
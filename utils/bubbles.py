@@ -0,0 +1,69 @@
+"""
+Bubble membership utilities for StudyOS
+Reconciles users.bubbles with bubbles.member_uids (the bubble document is authoritative)
+"""
+from typing import Any, Dict, List
+
+from firebase_admin import firestore
+
+BUBBLES_COL = 'bubbles'
+
+# Firestore rejects batches with more than 500 writes
+_WRITE_BATCH_SIZE = 400
+
+
+def plan_membership_repairs(users: Dict[str, Dict[str, Any]],
+                            bubbles: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Work out the writes that make users.bubbles match bubbles.member_uids
+    Args:
+        users: uid -> user document
+        bubbles: bubble id -> bubble document
+    Returns:
+        Dictionary with
+          'add_to_user': uid -> bubble ids the user is a member of but does not list
+          'remove_from_user': uid -> listed bubble ids that are deleted or do not list the user
+          'remove_from_bubble': bubble id -> member uids whose user document no longer exists
+    """
+    plan = {'add_to_user': {}, 'remove_from_user': {}, 'remove_from_bubble': {}}
+    listed = {uid: set(data.get('bubbles') or []) for uid, data in users.items()}
+    members = {bubble_id: set(data.get('member_uids') or []) for bubble_id, data in bubbles.items()}
+
+    for bubble_id, member_uids in members.items():
+        for member_uid in sorted(member_uids):
+            if member_uid not in listed:
+                plan['remove_from_bubble'].setdefault(bubble_id, []).append(member_uid)
+            elif bubble_id not in listed[member_uid]:
+                plan['add_to_user'].setdefault(member_uid, []).append(bubble_id)
+
+    for uid, bubble_ids in listed.items():
+        for bubble_id in sorted(bubble_ids):
+            if uid not in members.get(bubble_id, ()):
+                plan['remove_from_user'].setdefault(uid, []).append(bubble_id)
+    return plan
+
+
+def apply_membership_repairs(db, plan: Dict[str, Dict[str, List[str]]]) -> int:
+    """
+    Write a repair plan in batches
+    Args:
+        db: Firestore client
+        plan: Result of plan_membership_repairs
+    Returns:
+        Number of document updates written
+    """
+    updates = []
+    for uid, bubble_ids in plan['add_to_user'].items():
+        updates.append((db.collection('users').document(uid), {'bubbles': firestore.ArrayUnion(bubble_ids)}))
+    # ArrayUnion and ArrayRemove on one field cannot share an update
+    for uid, bubble_ids in plan['remove_from_user'].items():
+        updates.append((db.collection('users').document(uid), {'bubbles': firestore.ArrayRemove(bubble_ids)}))
+    for bubble_id, member_uids in plan['remove_from_bubble'].items():
+        updates.append((db.collection(BUBBLES_COL).document(bubble_id), {'member_uids': firestore.ArrayRemove(member_uids)}))
+
+    for start in range(0, len(updates), _WRITE_BATCH_SIZE):
+        batch = db.batch()
+        for ref, data in updates[start:start + _WRITE_BATCH_SIZE]:
+            batch.update(ref, data)
+        batch.commit()
+    return len(updates)
@@ -0,0 +1,126 @@
+"""
+Calendar event utilities for StudyOS
+Normalized event timestamps and indexed range queries, so the calendar only reads events in the visible window
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+CALENDAR_EVENTS_COL = 'calendar_events'
+
+# Events are found by start time; ones starting this long before a window can still overlap it.
+# Longer events are flagged long_span and found by their end time instead.
+MAX_EVENT_SPAN = timedelta(days=31)
+
+# Firestore rejects batches with more than 500 writes
+_WRITE_BATCH_SIZE = 400
+
+
+def parse_event_time(value: Any) -> Optional[datetime]:
+    """
+    Normalize an event date to an aware UTC datetime
+    Accepts ISO strings (date-only, naive, 'Z' or offset) and datetimes;
+    naive values are taken as UTC. Returns None for empty or unreadable values.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        when = value
+    else:
+        try:
+            when = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if when.tzinfo is None:
+        return when.replace(tzinfo=timezone.utc)
+    return when.astimezone(timezone.utc)
+
+
+def event_times(start_date: Any, end_date: Any) -> Dict[str, Any]:
+    """
+    Indexed fields for an event's start_date/end_date (end defaults to start):
+    start_at, end_at, and long_span for events longer than MAX_EVENT_SPAN
+    """
+    start_at = parse_event_time(start_date)
+    end_at = parse_event_time(end_date) or start_at
+    if start_at and end_at and end_at < start_at:
+        end_at = start_at
+    long_span = bool(start_at and end_at and end_at - start_at > MAX_EVENT_SPAN)
+    return {'start_at': start_at, 'end_at': end_at, 'long_span': long_span}
+
+
+def to_client(event_id: str, event: Dict[str, Any]) -> Dict[str, Any]:
+    """Event document as sent to the browser (ISO start/end, no internal timestamps)"""
+    event = {**event, 'id': event_id}
+    start_at = event.pop('start_at', None)
+    event.pop('end_at', None)
+    event.pop('long_span', None)
+    for field, key in (('start_date', 'start'), ('end_date', 'end')):
+        value = event.get(field)
+        if value:
+            event[key] = value.isoformat() if hasattr(value, 'isoformat') else value
+    if start_at:
+        event['display_date'] = start_at.strftime('%Y-%m-%d')
+    return event
+
+
+def events_in_window(db, uid: str, window_start: Any, window_end: Any) -> List[Dict[str, Any]]:
+    """
+    Events of a user overlapping [window_start, window_end)
+    Uses the (uid, start_at) index, plus the (uid, long_span, end_at) index for
+    events longer than MAX_EVENT_SPAN; without a window every event is returned.
+    """
+    start = parse_event_time(window_start)
+    end = parse_event_time(window_end)
+    events_ref = db.collection(CALENDAR_EVENTS_COL)
+    query = events_ref.where('uid', '==', uid)
+    if start:
+        query = query.where('start_at', '>=', start - MAX_EVENT_SPAN)
+    if end:
+        query = query.where('start_at', '<', end)
+    if start or end:
+        query = query.order_by('start_at')
+    docs = list(query.stream())
+    if start:
+        # Long events that started before the start_at range but are still running
+        long_events = events_ref.where('uid', '==', uid).where('long_span', '==', True)\
+            .where('end_at', '>=', start).order_by('end_at')
+        seen = {doc.id for doc in docs}
+        docs.extend(doc for doc in long_events.stream() if doc.id not in seen)
+    events = []
+    for doc in docs:
+        event = doc.to_dict()
+        if start and event.get('end_at') and event['end_at'] < start:
+            continue
+        if end and event.get('start_at') and event['start_at'] >= end:
+            continue
+        events.append(to_client(doc.id, event))
+    return events
+
+
+def upcoming_events(db, uid: str, days: int = 7, limit: int = 10, now: datetime = None) -> List[Dict[str, Any]]:
+    """A user's next events starting between today (UTC) and days later, soonest first"""
+    today = (now or datetime.now(timezone.utc)).replace(hour=0, minute=0, second=0, microsecond=0)
+    query = db.collection(CALENDAR_EVENTS_COL).where('uid', '==', uid)\
+        .where('start_at', '>=', today).where('start_at', '<=', today + timedelta(days=days))\
+        .order_by('start_at').limit(limit)
+    return [to_client(doc.id, doc.to_dict()) for doc in query.stream()]
+
+
+def backfill_event_times(db) -> int:
+    """
+    Add start_at/end_at/long_span to events stored before they existed (or with stale values)
+    Returns:
+        Number of events updated
+    """
+    updates = []
+    for doc in db.collection(CALENDAR_EVENTS_COL).stream():
+        data = doc.to_dict()
+        times = event_times(data.get('start_date'), data.get('end_date'))
+        if any(data.get(field) != value for field, value in times.items()):
+            updates.append((doc.reference, times))
+    for start in range(0, len(updates), _WRITE_BATCH_SIZE):
+        batch = db.batch()
+        for ref, times in updates[start:start + _WRITE_BATCH_SIZE]:
+            batch.update(ref, times)
+        batch.commit()
+    return len(updates)
@@ -0,0 +1,59 @@
+"""
+Chat streaming utilities for StudyOS
+Relays AI answers to the browser as Server-Sent Events while they are generated, and saves them once complete
+"""
+import json
+import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from .logger import logger
+
+STREAM_ERROR_MESSAGE = (
+    "I encountered an unexpected error while processing your request. "
+    "Please try again later or contact support if the problem persists."
+)
+
+
+def sse(event: str, data: Any) -> str:
+    """One Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def relay_answer(chunks: Iterator[str], on_complete: Callable[[str], Dict[str, Any]],
+                 on_abort: Optional[Callable[[], None]] = None, **log_fields) -> Iterator[str]:
+    """
+    SSE events for a streamed answer
+    Sends a 'chunk' event per text chunk, then calls on_complete with the
+    whole answer (which persists it) and sends its result as the 'done'
+    event. If the client disconnects, the server closes this generator:
+    the model stream is closed with it and no answer is persisted.
+    Args:
+        chunks: Text chunks as the model produces them
+        on_complete: Persists the full answer; returns the 'done' payload
+        on_abort: Called instead when the stream fails or is cancelled (e.g. to keep the question)
+        log_fields: Extra fields for the log lines (route, uid, ...)
+    """
+    started = time.perf_counter()
+    first_token_ms = None
+    parts = []
+    status = 'cancelled'
+    try:
+        for text in chunks:
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - started) * 1000, 2)
+            parts.append(text)
+            yield sse('chunk', {'text': text})
+        status = 'completed'
+        yield sse('done', on_complete(''.join(parts)))
+    except Exception as e:
+        status = 'failed'
+        logger.error("ai_stream_failed", error=str(e), **log_fields)
+        yield sse('error', {'error': STREAM_ERROR_MESSAGE})
+    finally:
+        close = getattr(chunks, 'close', None)
+        if callable(close):
+            close()
+        if status != 'completed' and on_abort is not None:
+            on_abort()
+        logger.info("ai_stream_finished", status=status, first_token_ms=first_token_ms, chunks=len(parts),
+                    duration_ms=round((time.perf_counter() - started) * 1000, 2), **log_fields)
@@ -0,0 +1,117 @@
+"""
+Chat thread utilities for StudyOS
+Lists conversation threads newest first one indexed page at a time, and keeps a cached pointer to each user's active SCLERA thread
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+from .cache import cache
+
+SCLERA_THREADS_COL = 'sclera_threads'
+SCLERA_ACTIVE_COL = 'sclera_active'
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+# Joins last_message_at and the document id in a page cursor (neither contains it)
+_CURSOR_SEPARATOR = '|'
+
+
+def thread_page(query, limit: int = DEFAULT_PAGE_SIZE, cursor: str = None) -> Tuple[List[Any], Optional[str]]:
+    """
+    One page of threads, most recent first
+    Threads touched in the same second share last_message_at, so the
+    document id breaks ties and is part of the cursor.
+    Args:
+        query: Threads of one mode/chatbot type (an equality filter, indexed with last_message_at, __name__)
+        limit: Page size (capped at MAX_PAGE_SIZE)
+        cursor: next_cursor from the previous page
+    Returns:
+        Tuple of (thread snapshots, next_cursor or None when there are no more threads)
+    """
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    query = query.order_by('last_message_at', direction=firestore.Query.DESCENDING)\
+        .order_by('__name__', direction=firestore.Query.DESCENDING)
+    if cursor:
+        last_message_at, _, doc_id = cursor.partition(_CURSOR_SEPARATOR)
+        # Cursors from before the tiebreaker carry only the timestamp
+        query = query.start_after({'last_message_at': last_message_at, '__name__': doc_id} if doc_id
+                                  else {'last_message_at': last_message_at})
+    # One extra document tells whether another page exists
+    docs = list(query.limit(limit + 1).stream())
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, f"{docs[-1].to_dict().get('last_message_at')}{_CURSOR_SEPARATOR}{docs[-1].id}"
+
+
+class ActiveThreads:
+    """
+    The SCLERA thread a user is chatting in, per mode. The pointer lives in
+    users/{uid}/sclera_active/{mode} and in the disk cache shared by the
+    workers, so a chat send finds its thread without listing the user's
+    threads. Without a pointer the most recent thread is used (one indexed
+    read) and remembered.
+    """
+
+    def __init__(self, db, store=cache, ttl: int = 3600):
+        """
+        Args:
+            db: Firestore client
+            store: diskcache.Cache shared by the worker processes
+            ttl: Seconds a pointer stays in the disk cache
+        """
+        self.db = db
+        self.store = store
+        self.ttl = ttl
+
+    def _threads(self, uid: str):
+        return self.db.collection('users').document(uid).collection(SCLERA_THREADS_COL)
+
+    def _ref(self, uid: str, mode: str):
+        return self.db.collection('users').document(uid).collection(SCLERA_ACTIVE_COL).document(mode)
+
+    @staticmethod
+    def _key(uid: str, mode: str) -> str:
+        return f"sclera_active:{uid}:{mode}"
+
+    def _stored(self, uid: str, mode: str) -> Optional[str]:
+        thread_id = self.store.get(self._key(uid, mode))
+        if thread_id is None:
+            snapshot = self._ref(uid, mode).get()
+            thread_id = (snapshot.to_dict() or {}).get('thread_id') if snapshot.exists else None
+        return thread_id
+
+    def get(self, uid: str, mode: str) -> Optional[str]:
+        """Active thread id for a mode, or None when the user has no thread in it"""
+        thread_id = self._stored(uid, mode)
+        if thread_id is None:
+            query = self._threads(uid).where('mode', '==', mode)
+            docs = list(query.order_by('last_message_at', direction=firestore.Query.DESCENDING).limit(1).stream())
+            if not docs:
+                return None
+            thread_id = docs[0].id
+            self._ref(uid, mode).set({'thread_id': thread_id})
+        self.remember(uid, mode, thread_id)
+        return thread_id
+
+    def remember(self, uid: str, mode: str, thread_id: str):
+        """Point the disk cache at a thread (visible to every worker at once)"""
+        self.store.set(self._key(uid, mode), thread_id, expire=self.ttl)
+
+    def pointer(self, uid: str, mode: str, thread_id: str) -> Tuple[Any, Dict[str, Any]]:
+        """The stored pointer as a (ref, data) write, for committing alongside other writes"""
+        return self._ref(uid, mode), {'thread_id': thread_id}
+
+    def set(self, uid: str, mode: str, thread_id: str):
+        """Make a thread the active one for a mode"""
+        ref, data = self.pointer(uid, mode, thread_id)
+        ref.set(data)
+        self.remember(uid, mode, thread_id)
+
+    def discard(self, uid: str, mode: str, thread_id: str):
+        """Drop the pointer if it names a thread being deleted (the next send falls back to the latest thread)"""
+        if self._stored(uid, mode) == thread_id:
+            self._ref(uid, mode).delete()
+            self.store.delete(self._key(uid, mode))
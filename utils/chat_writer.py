@@ -0,0 +1,128 @@
+"""
+Chat persistence utilities for StudyOS
+Saves chat exchanges after the response is sent: one batch per exchange, written by a background thread
+"""
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+
+from .logger import logger
+
+ChatMessage = Tuple[str, Dict[str, Any]]
+
+
+def chat_messages(*messages: Tuple[str, str, str]) -> List[ChatMessage]:
+    """
+    Message documents for (role, content, timestamp) triples
+    Ids are chosen up front, so a retried write is recognised instead of duplicating.
+    """
+    return [(uuid.uuid4().hex, {'role': role, 'content': content, 'timestamp': timestamp})
+            for role, content, timestamp in messages]
+
+
+def write_exchange(db, thread_ref, messages: List[ChatMessage], thread_fields: Dict[str, Any],
+                   also: Iterable[Tuple[Any, Dict[str, Any]]] = ()):
+    """
+    Commit messages and the thread's metadata in one batch
+    Messages are created, not overwritten: if an earlier attempt committed
+    (but reported an error), the retry fails with AlreadyExists and nothing,
+    message_count included, is applied twice.
+    Args:
+        db: Firestore client
+        thread_ref: Thread document (created if missing)
+        messages: Messages from chat_messages
+        thread_fields: Thread fields to merge (last_message_at, and the whole thread when new)
+        also: (ref, data) pairs to set in the same batch (e.g. a new thread's active pointer)
+    """
+    batch = db.batch()
+    for message_id, data in messages:
+        batch.create(thread_ref.collection('messages').document(message_id), data)
+    batch.set(thread_ref, {**thread_fields, 'message_count': firestore.Increment(len(messages))}, merge=True)
+    for ref, data in also:
+        batch.set(ref, data)
+    try:
+        batch.commit()
+    except AlreadyExists:
+        # Batches are all-or-nothing: an earlier attempt saved the whole exchange
+        logger.info("chat_exchange_already_saved", thread_id=thread_ref.id, messages=len(messages))
+
+
+class ChatWriter:
+    """
+    Write-behind queue for chat persistence.
+    Writes are callables that commit one batch; a daemon thread runs them
+    in order and retries failures with exponential backoff. The queue is
+    bounded: when it is full the write runs in the caller instead of being
+    dropped. flush() waits for pending writes (registered at exit).
+    """
+
+    def __init__(self, maxsize: int = 1000, max_attempts: int = 3, backoff: float = 0.5):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._queue: 'queue.Queue[Tuple[Callable, tuple]]' = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, write: Callable, *args) -> bool:
+        """
+        Queue a write
+        Returns:
+            True if queued, False if the queue was full and the write ran here
+        """
+        self._start()
+        try:
+            self._queue.put_nowait((write, args))
+            return True
+        except queue.Full:
+            logger.warning("chat_write_queue_full", pending=self._queue.qsize())
+            self._attempt(write, args)
+            return False
+
+    def pending(self) -> int:
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout: float = 10) -> bool:
+        """
+        Wait until every queued write has finished
+        Returns:
+            False if writes were still pending at the timeout
+        """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                logger.warning("chat_write_flush_timeout", pending=self._queue.unfinished_tasks)
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            write, args = self._queue.get()
+            try:
+                self._attempt(write, args)
+            finally:
+                self._queue.task_done()
+
+    def _attempt(self, write: Callable, args: tuple):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                write(*args)
+                return
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    logger.error("chat_write_failed", attempts=attempt, error=str(e))
+                    return
+                time.sleep(self.backoff * 2 ** (attempt - 1))
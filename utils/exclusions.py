@@ -0,0 +1,187 @@
+"""
+Syllabus exclusion utilities for StudyOS
+Resolves institution (tier 1) and class (tier 2) chapter exclusions with batched reads and a shared cache
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from .cache import cache
+from .logger import logger
+
+# Keys are (institution_id, frozenset(class_ids))
+ExclusionKey = Tuple[Optional[str], FrozenSet[str]]
+
+# Documents per get_all round trip in bulk resolution
+_GET_ALL_CHUNK = 300
+
+# Shared-cache key holding a class's exclusion version
+_VERSION_KEY = 'exclusions_version:{}'
+
+
+def exclusion_key(user_data: Dict[str, Any]) -> ExclusionKey:
+    """Build the cache key for a user's shared (non-personal) exclusions"""
+    return user_data.get('institution_id') or None, frozenset(user_data.get('class_ids') or [])
+
+
+def merge_exclusions(shared: Dict[str, Any], personal: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge shared exclusions with a student's personal ones (personal applied last)"""
+    merged = dict(shared)
+    merged.update(personal or {})
+    return merged
+
+
+class ExclusionResolver:
+    """
+    Resolve merged tier-1/tier-2 exclusions for (institution, classes) pairs.
+    All documents for a pair are fetched in a single get_all; merged results
+    are memoized in a thread-safe TTL/LRU cache shared across requests.
+    Each class has a version counter in the disk cache shared by the workers;
+    a memoized result is only served while its classes' versions are unchanged,
+    so invalidating a class on one worker reaches every worker.
+    """
+
+    def __init__(self, db, ttl: int = 300, maxsize: int = 2048, store=cache):
+        """
+        Args:
+            db: Firestore client
+            ttl: Seconds a merged result is memoized
+            maxsize: Memoized (institution, classes) pairs per worker
+            store: diskcache.Cache shared by the worker processes (holds class versions)
+        """
+        self.db = db
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.store = store
+        self._entries: 'OrderedDict[ExclusionKey, Tuple[float, Tuple[int, ...], Dict[str, Any]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _institution_ref(self, inst_id: str):
+        return self.db.collection('institutions').document(inst_id).collection('syllabus_exclusions').document('current')
+
+    def _class_ref(self, class_id: str):
+        return self.db.collection('classes').document(class_id).collection('excluded_chapters').document('current')
+
+    def _refs_for(self, key: ExclusionKey) -> List[Any]:
+        inst_id, class_ids = key
+        refs = [self._institution_ref(inst_id)] if inst_id else []
+        refs.extend(self._class_ref(cid) for cid in sorted(class_ids))
+        return refs
+
+    def _versions(self, key: ExclusionKey, known: Dict[str, int]) -> Tuple[int, ...]:
+        """Current shared versions of a key's classes (looked up once per class per call)"""
+        for class_id in key[1]:
+            if class_id not in known:
+                known[class_id] = self.store.get(_VERSION_KEY.format(class_id), 0)
+        return tuple(known[class_id] for class_id in sorted(key[1]))
+
+    def _cached(self, key: ExclusionKey, versions: Tuple[int, ...]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, stored_versions, merged = entry
+            if time.monotonic() - stored_at > self.ttl or stored_versions != versions:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return merged
+
+    def _store(self, key: ExclusionKey, versions: Tuple[int, ...], merged: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), versions, merged)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _merge(self, key: ExclusionKey, chapters_by_path: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        merged = {}
+        for ref in self._refs_for(key):
+            merged.update(chapters_by_path.get(ref.path, {}))
+        return merged
+
+    def _fetch(self, refs: List[Any]) -> Dict[str, Dict[str, Any]]:
+        """Fetch exclusion documents in get_all chunks, keyed by document path"""
+        chapters_by_path = {}
+        for start in range(0, len(refs), _GET_ALL_CHUNK):
+            for snapshot in self.db.get_all(refs[start:start + _GET_ALL_CHUNK]):
+                if snapshot.exists:
+                    chapters_by_path[snapshot.reference.path] = (snapshot.to_dict() or {}).get('chapters', {})
+        return chapters_by_path
+
+    def resolve(self, inst_id: Optional[str], class_ids: Iterable[str]) -> Dict[str, Any]:
+        """
+        Get merged institution and class exclusions
+        Args:
+            inst_id: Institution identifier (may be None)
+            class_ids: Class identifiers the student belongs to
+        Returns:
+            Dictionary of 'subject::chapter' keys (a copy safe to mutate)
+        """
+        return self.resolve_bulk([(inst_id, class_ids)])[(inst_id or None, frozenset(class_ids or []))]
+
+    def resolve_for_user(self, user_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Get merged institution and class exclusions for a user document"""
+        inst_id, class_ids = exclusion_key(user_data)
+        return self.resolve(inst_id, class_ids)
+
+    def resolve_bulk(self, pairs: Iterable[Tuple[Optional[str], Iterable[str]]]) -> Dict[ExclusionKey, Dict[str, Any]]:
+        """
+        Resolve exclusions for many (institution, classes) pairs at once.
+        Every document not already cached is fetched once, in chunked get_all calls.
+        Args:
+            pairs: Iterable of (institution_id, class_ids)
+        Returns:
+            Dictionary mapping (institution_id, frozenset(class_ids)) to merged exclusions
+        """
+        resolved = {}
+        missing = []
+        known_versions = {}
+        versions = {}
+        for inst_id, class_ids in pairs:
+            key = (inst_id or None, frozenset(class_ids or []))
+            if key in resolved:
+                continue
+            if not key[0] and not key[1]:
+                resolved[key] = {}
+                continue
+            # Read before fetching, so an invalidation during the fetch leaves the result stale
+            versions[key] = self._versions(key, known_versions)
+            cached = self._cached(key, versions[key])
+            if cached is None:
+                missing.append(key)
+                resolved[key] = None
+            else:
+                resolved[key] = dict(cached)
+
+        if missing:
+            refs = {}
+            for key in missing:
+                for ref in self._refs_for(key):
+                    refs.setdefault(ref.path, ref)
+            try:
+                chapters_by_path = self._fetch(list(refs.values()))
+            except Exception as e:
+                # Match previous behaviour: unreadable exclusions count as none, but don't cache them
+                logger.error("exclusion_resolve_error", error=str(e), keys=len(missing))
+                for key in missing:
+                    resolved[key] = {}
+                return resolved
+            for key in missing:
+                merged = self._merge(key, chapters_by_path)
+                self._store(key, versions[key], merged)
+                resolved[key] = dict(merged)
+        return resolved
+
+    def invalidate_class(self, class_id: str):
+        """Drop cached results that include a class on every worker (call after its exclusions change)"""
+        self.store.incr(_VERSION_KEY.format(class_id), default=0)
+        with self._lock:
+            for key in [k for k in self._entries if class_id in k[1]]:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop all cached results"""
+        with self._lock:
+            self._entries.clear()
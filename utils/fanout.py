@@ -0,0 +1,24 @@
+"""
+Concurrent read utilities for StudyOS
+Runs independent Firestore reads on a bounded thread pool shared by all requests
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from config import Config
+
+# Shared across requests so concurrency per process stays bounded
+_pool = ThreadPoolExecutor(max_workers=Config.FANOUT_WORKERS, thread_name_prefix='fanout')
+
+
+def submit(fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """
+    Start a read in the background
+    The callable runs outside the request context, so it should talk to
+    Firestore directly rather than through the request cache.
+    Args:
+        fn: Callable performing the read
+    Returns:
+        Future whose result() returns (or raises) what fn did
+    """
+    return _pool.submit(fn, *args, **kwargs)
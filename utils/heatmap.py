@@ -0,0 +1,196 @@
+"""
+Study heatmap utilities for StudyOS
+Rolling weekday x hour session counts per institution and per class, aggregated at write time
+"""
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Tuple
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from .logger import logger
+
+HEATMAP_COL = 'heatmap_buckets'
+
+# Days of sessions the heatmap covers
+WINDOW_DAYS = 30
+
+# Counter documents per bucket; each takes about one sustained write per second
+SHARDS = 10
+
+# Firestore rejects batches with more than 500 writes
+_WRITE_BATCH_SIZE = 400
+
+
+def institution_scope(institution_id: str) -> str:
+    """Bucket document id for an institution"""
+    return f"institution_{institution_id}"
+
+
+def class_scope(class_id: str) -> str:
+    """Bucket document id for a class"""
+    return f"class_{class_id}"
+
+
+def scopes_for_user(user_data: Dict[str, Any]) -> List[str]:
+    """Bucket documents a student's sessions count towards"""
+    scopes = []
+    if user_data.get('institution_id'):
+        scopes.append(institution_scope(user_data['institution_id']))
+    scopes.extend(class_scope(cid) for cid in user_data.get('class_ids') or [])
+    return scopes
+
+
+def _day(when: datetime) -> str:
+    return when.strftime('%Y-%m-%d')
+
+
+class HeatmapAggregator:
+    """
+    Heatmap buckets stored per institution/class as {'days': {'YYYY-MM-DD':
+    {'<weekday>-<hour>': count}}}, split over `shards` counter documents so a
+    school starting sessions together doesn't contend on one document. Shard 0
+    keeps the bucket's own id; the others are '<scope>~<n>'. Sessions are
+    counted once, when their document is created, in a random shard; reads sum
+    every shard over the days inside the window and drop older days (daily
+    roll-off).
+    """
+
+    def __init__(self, db, collection: str = HEATMAP_COL, window_days: int = WINDOW_DAYS,
+                 shards: int = SHARDS, max_attempts: int = 3, backoff: float = 0.05):
+        self.db = db
+        self.collection = collection
+        self.window_days = window_days
+        self.shards = max(1, shards)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def _ref(self, scope: str, shard: int = 0):
+        return self.db.collection(self.collection).document(f"{scope}~{shard}" if shard else scope)
+
+    def _shard_refs(self, scope: str) -> List[Any]:
+        return [self._ref(scope, shard) for shard in range(self.shards)]
+
+    def _window_start(self, now: datetime = None) -> str:
+        """First day (UTC) inside the window"""
+        return _day((now or datetime.utcnow()) - timedelta(days=self.window_days - 1))
+
+    def record_session(self, user_data: Dict[str, Any], local_weekday: Any, local_hour: Any, when: datetime = None):
+        """
+        Count a new study session in every bucket the student belongs to
+        Args:
+            user_data: Student's user document
+            local_weekday: Weekday of the session in the student's timezone
+            local_hour: Hour of the session in the student's timezone
+            when: Session time (UTC), defaults to now
+        """
+        if local_weekday is None or local_hour is None:
+            return
+        scopes = scopes_for_user(user_data)
+        if not scopes:
+            return
+        now = datetime.utcnow()
+        day = _day(when or now)
+        for attempt in range(1, self.max_attempts + 1):
+            # A fresh shard per attempt, so a retry moves away from a contended document
+            batch = self.db.batch()
+            for scope in scopes:
+                batch.set(self._ref(scope, random.randrange(self.shards)), {
+                    'days': {day: {f"{local_weekday}-{local_hour}": firestore.Increment(1)}},
+                    'updated_at': now.isoformat()
+                }, merge=True)
+            try:
+                batch.commit()
+                return
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    raise
+                logger.warning("heatmap_record_retry", attempt=attempt, error=str(e))
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def read(self, scopes: Iterable[str], now: datetime = None) -> Dict[str, int]:
+        """
+        Get the heatmap for one or more buckets (one batched read)
+        Args:
+            scopes: Bucket document ids (see institution_scope / class_scope)
+            now: Reference time for the window, defaults to now
+        Returns:
+            Dictionary mapping "<weekday>-<hour>" to session counts
+        """
+        scopes = list(dict.fromkeys(scopes))
+        if not scopes:
+            return {}
+        start = self._window_start(now)
+        heatmap = defaultdict(int)
+        expired = {}
+        for snapshot in self.db.get_all([ref for scope in scopes for ref in self._shard_refs(scope)]):
+            if not snapshot.exists:
+                continue
+            for day, buckets in ((snapshot.to_dict() or {}).get('days') or {}).items():
+                if day < start:
+                    expired.setdefault(snapshot.reference, []).append(day)
+                    continue
+                for key, count in buckets.items():
+                    heatmap[key] += count
+        if expired:
+            self._prune(expired)
+        return dict(heatmap)
+
+    def roll_off(self, now: datetime = None) -> int:
+        """
+        Drop day buckets older than the window from every document (daily job)
+        Returns:
+            Number of day buckets removed
+        """
+        start = self._window_start(now)
+        expired = {}
+        for snapshot in self.db.collection(self.collection).stream():
+            days = [day for day in ((snapshot.to_dict() or {}).get('days') or {}) if day < start]
+            if days:
+                expired[snapshot.reference] = days
+        self._prune(expired)
+        return sum(len(days) for days in expired.values())
+
+    def _prune(self, expired: Dict[Any, List[str]]):
+        """Delete the given day buckets (document reference -> days)"""
+        refs = list(expired.items())
+        for start in range(0, len(refs), _WRITE_BATCH_SIZE):
+            batch = self.db.batch()
+            for ref, days in refs[start:start + _WRITE_BATCH_SIZE]:
+                batch.update(ref, {FieldPath('days', day).to_api_repr(): firestore.DELETE_FIELD for day in days})
+            batch.commit()
+
+    def rebuild(self, sessions: Iterable[Tuple[Dict[str, Any], str, Any, Any]], now: datetime = None) -> int:
+        """
+        Replace every bucket touched by the given sessions (backfills and repairs)
+        Args:
+            sessions: Iterable of (user_data, day 'YYYY-MM-DD', local_weekday, local_hour)
+            now: Reference time for the window, defaults to now
+        Returns:
+            Number of buckets written
+        """
+        start = self._window_start(now)
+        buckets: Dict[str, Dict[str, Dict[str, int]]] = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+        for user_data, day, local_weekday, local_hour in sessions:
+            if day < start or local_weekday is None or local_hour is None:
+                continue
+            for scope in scopes_for_user(user_data):
+                buckets[scope][day][f"{local_weekday}-{local_hour}"] += 1
+        stamp = (now or datetime.utcnow()).isoformat()
+        scopes = list(buckets.items())
+        # Each bucket is one full write to shard 0 and a delete per other shard
+        per_batch = max(1, _WRITE_BATCH_SIZE // self.shards)
+        for offset in range(0, len(scopes), per_batch):
+            batch = self.db.batch()
+            for scope, days in scopes[offset:offset + per_batch]:
+                batch.set(self._ref(scope), {
+                    'days': {day: dict(counts) for day, counts in days.items()},
+                    'updated_at': stamp
+                })
+                for ref in self._shard_refs(scope)[1:]:
+                    batch.delete(ref)
+            batch.commit()
+        return len(scopes)
@@ -0,0 +1,136 @@
+"""
+Notification inbox utilities for StudyOS
+Per-user notification inbox with a maintained unread counter, so polling costs one small read
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+INBOX_COL = 'inbox'
+INBOX_STATE_COL = 'inbox_state'
+COUNTER_DOC = 'counter'
+
+PAGE_SIZE = 10
+# Writes a delivered notification costs in a batch (the item and the counter)
+WRITES_PER_NOTIFICATION = 2
+
+# Firestore rejects batches with more than 500 writes
+_WRITE_BATCH_SIZE = 400
+
+
+class NotificationInbox:
+    """
+    Notifications live in users/{uid}/inbox, newest first by created_at.
+    users/{uid}/inbox_state/counter holds the unread count and the time of
+    the newest notification; every write that changes an item's read state
+    adjusts the counter in the same batch or transaction.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def _items(self, uid: str):
+        return self.db.collection('users').document(uid).collection(INBOX_COL)
+
+    def _counter(self, uid: str):
+        return self.db.collection('users').document(uid).collection(INBOX_STATE_COL).document(COUNTER_DOC)
+
+    def add_to_batch(self, batch, uid: str, notification: Dict[str, Any], notif_id: str = None) -> str:
+        """
+        Queue a notification for a user on an existing batch (WRITES_PER_NOTIFICATION writes)
+        Args:
+            batch: Firestore WriteBatch
+            uid: Recipient
+            notification: Notification fields (sender_uid, sender_name, message, type, created_at)
+            notif_id: Document id; with one the item is created, so committing a batch that
+                was already applied fails with AlreadyExists instead of counting it twice
+        Returns:
+            Notification id
+        """
+        ref = self._items(uid).document(notif_id) if notif_id else self._items(uid).document()
+        created_at = notification.get('created_at') or datetime.utcnow().isoformat()
+        item = {**notification, 'recipient_uid': uid, 'read': False, 'created_at': created_at}
+        if notif_id:
+            batch.create(ref, item)
+        else:
+            batch.set(ref, item)
+        batch.set(self._counter(uid), {'unread': firestore.Increment(1), 'latest_at': created_at}, merge=True)
+        return ref.id
+
+    def send(self, uid: str, notification: Dict[str, Any], notif_id: str = None) -> str:
+        """Deliver one notification to a user"""
+        batch = self.db.batch()
+        notif_id = self.add_to_batch(batch, uid, notification, notif_id)
+        batch.commit()
+        return notif_id
+
+    def state(self, uid: str) -> Tuple[int, Optional[str]]:
+        """
+        Read the counter
+        Returns:
+            Tuple of (unread count, created_at of the newest notification or None)
+        """
+        doc = self._counter(uid).get()
+        if not doc.exists:
+            return 0, None
+        data = doc.to_dict() or {}
+        return max(0, int(data.get('unread', 0))), data.get('latest_at')
+
+    def latest_unread(self, uid: str, limit: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+        """Newest unread notifications (served by the inbox read/created_at index)"""
+        query = self._items(uid).where('read', '==', False)\
+            .order_by('created_at', direction=firestore.Query.DESCENDING).limit(limit)
+        return [{**doc.to_dict(), 'id': doc.id} for doc in query.stream()]
+
+    def mark_read(self, uid: str, notif_id: str) -> bool:
+        """
+        Mark one notification read
+        Returns:
+            False if the user has no such notification
+        """
+        item_ref = self._items(uid).document(notif_id)
+        counter_ref = self._counter(uid)
+
+        @firestore.transactional
+        def apply(transaction):
+            snapshot = item_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return False
+            if not snapshot.to_dict().get('read'):
+                transaction.update(item_ref, {'read': True})
+                transaction.set(counter_ref, {'unread': firestore.Increment(-1)}, merge=True)
+            return True
+
+        return apply(self.db.transaction())
+
+    def mark_all_read(self, uid: str) -> int:
+        """
+        Mark every unread notification read in batched writes
+        Returns:
+            Number of notifications marked
+        """
+        marked = 0
+        unread = self._items(uid).where('read', '==', False)
+        while True:
+            refs = [doc.reference for doc in unread.limit(_WRITE_BATCH_SIZE - 1).stream()]
+            if not refs:
+                break
+            batch = self.db.batch()
+            for ref in refs:
+                batch.update(ref, {'read': True})
+            # Decrement by what was marked, so notifications arriving meanwhile stay counted
+            batch.set(self._counter(uid), {'unread': firestore.Increment(-len(refs))}, merge=True)
+            batch.commit()
+            marked += len(refs)
+        return marked
+
+    def recount(self, uid: str) -> int:
+        """Reset the counter from the inbox itself (migrations and repairs)"""
+        unread = self._items(uid).where('read', '==', False).count().get()[0][0].value
+        newest = list(self._items(uid).order_by('created_at', direction=firestore.Query.DESCENDING).limit(1).stream())
+        self._counter(uid).set({
+            'unread': unread,
+            'latest_at': newest[0].to_dict().get('created_at') if newest else None
+        })
+        return unread
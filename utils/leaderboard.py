@@ -0,0 +1,272 @@
+"""
+Leaderboard utilities for StudyOS
+Keeps a precomputed, ranked score per student so leaderboard pages never scan users
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+LEADERBOARD_COL = 'leaderboard_scores'
+BUBBLE_LEADERBOARD_COL = 'bubble_leaderboards'
+
+# Firestore rejects batches with more than 500 writes
+_WRITE_BATCH_SIZE = 400
+
+
+def build_leaderboard_entry(uid: str, user_data: Dict[str, Any], progress: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the stored leaderboard row for a user
+    Args:
+        uid: User identifier
+        user_data: User document
+        progress: Result of calculate_academic_progress for the user
+    Returns:
+        Leaderboard entry dictionary
+    """
+    purpose = user_data.get('purpose') or ''
+    grade = None
+    if purpose == 'high_school' and user_data.get('highschool'):
+        grade = user_data['highschool'].get('grade')
+    elif purpose == 'after_tenth' and user_data.get('after_tenth'):
+        grade = user_data['after_tenth'].get('grade')
+    return {
+        'uid': uid,
+        'name': user_data.get('name', 'Anonymous'),
+        'purpose_display': purpose.replace('_', ' ').title(),
+        'overall_score': progress.get('overall', 0),
+        'total_chapters': progress.get('total_chapters', 0),
+        'completed_chapters': progress.get('total_completed', 0),
+        'grade': grade,
+        'updated_at': datetime.utcnow().isoformat()
+    }
+
+
+def _count(query) -> int:
+    """Run a server-side count aggregation and return the integer result"""
+    results = query.count(alias='total').get()
+    for batch in results:
+        for result in batch:
+            return int(result.value)
+    return 0
+
+
+class GlobalLeaderboard:
+    """
+    Ranked store of academic scores backed by a Firestore collection.
+    Entries are written when a score changes; reads use the overall_score
+    index (top N) and count aggregations (rank) instead of streaming users.
+    """
+
+    def __init__(self, db, collection: str = LEADERBOARD_COL):
+        self.db = db
+        self.collection = collection
+
+    def _ref(self, uid: str):
+        return self.db.collection(self.collection).document(uid)
+
+    def upsert(self, uid: str, user_data: Dict[str, Any], progress: Dict[str, Any]) -> Dict[str, Any]:
+        """Store the latest score for a user and return the stored entry"""
+        entry = build_leaderboard_entry(uid, user_data, progress)
+        self._ref(uid).set(entry)
+        return entry
+
+    def remove(self, uid: str):
+        """Drop a user from the leaderboard"""
+        self._ref(uid).delete()
+
+    def get_entry(self, uid: str) -> Optional[Dict[str, Any]]:
+        """Get the stored entry for a user, or None if not ranked yet"""
+        doc = self._ref(uid).get()
+        return doc.to_dict() if doc.exists else None
+
+    def top(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Get the highest scoring entries with competition ranks (ties share a rank)
+        Args:
+            limit: Number of entries to return
+        Returns:
+            List of entries ordered by score, each with a 'rank' key
+        """
+        query = self.db.collection(self.collection)\
+            .order_by('overall_score', direction=firestore.Query.DESCENDING)\
+            .limit(limit)
+        entries = []
+        previous_score = None
+        rank = 0
+        for position, doc in enumerate(query.stream(), 1):
+            entry = doc.to_dict()
+            score = entry.get('overall_score', 0)
+            if score != previous_score:
+                rank = position
+                previous_score = score
+            entry['rank'] = rank
+            entries.append(entry)
+        return entries
+
+    def rank_of(self, uid: str, entry: Dict[str, Any] = None) -> Tuple[Optional[int], Optional[Dict[str, Any]]]:
+        """
+        Get a user's rank without scanning the leaderboard
+        Args:
+            uid: User identifier
+            entry: Already loaded entry for the user (skips one read)
+        Returns:
+            Tuple of (rank, entry), or (None, None) if the user is not ranked
+        """
+        if entry is None:
+            entry = self.get_entry(uid)
+        if not entry:
+            return None, None
+        ahead = _count(
+            self.db.collection(self.collection).where('overall_score', '>', entry.get('overall_score', 0))
+        )
+        return ahead + 1, entry
+
+    def total(self) -> int:
+        """Number of ranked users"""
+        return _count(self.db.collection(self.collection))
+
+    def upsert_many(self, users: Iterable[Tuple[str, Dict[str, Any]]],
+                    progress_by_uid: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Store the latest scores for many users in chunked batches
+        Args:
+            users: Iterable of (uid, user_data) pairs
+            progress_by_uid: Progress per uid (e.g. from calculate_academic_progress_bulk)
+        Returns:
+            Stored entries by uid (users without progress are left out)
+        """
+        entries = {}
+        batch = self.db.batch()
+        pending = 0
+        for uid, user_data in users:
+            progress = progress_by_uid.get(uid)
+            if progress is None:
+                continue
+            entries[uid] = build_leaderboard_entry(uid, user_data, progress)
+            batch.set(self._ref(uid), entries[uid])
+            pending += 1
+            if pending >= _WRITE_BATCH_SIZE:
+                batch.commit()
+                batch = self.db.batch()
+                pending = 0
+        if pending:
+            batch.commit()
+        return entries
+
+    def rebuild(self, users: Iterable[Tuple[str, Dict[str, Any]]],
+                progress_by_uid: Dict[str, Dict[str, Any]]) -> Tuple[int, int, int]:
+        """
+        Recompute every entry from user documents (backfills and repairs)
+        Args:
+            users: Every (uid, user_data) pair; entries of other uids (deleted users) are dropped
+            progress_by_uid: Progress per uid (e.g. from calculate_academic_progress_bulk)
+        Returns:
+            Tuple of (entries written, users skipped because they could not be scored, entries of deleted users removed)
+        """
+        users = list(users)
+        written = len(self.upsert_many(users, progress_by_uid))
+        removed = purge_missing(self.db, self.db.collection(self.collection), {uid for uid, _ in users})
+        return written, len(users) - written, removed
+
+
+def purge_missing(db, collection, uids) -> int:
+    """
+    Delete the documents of a per-user collection whose id is not in uids
+    Returns:
+        Number of documents deleted
+    """
+    removed = 0
+    batch = db.batch()
+    pending = 0
+    # Only the ids are needed
+    for doc in collection.select(['uid']).stream():
+        if doc.id in uids:
+            continue
+        batch.delete(doc.reference)
+        removed += 1
+        pending += 1
+        if pending >= _WRITE_BATCH_SIZE:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    return removed
+
+
+def rank_entries(entries: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Order entries by score (highest first) and number them 1..n"""
+    ranked = sorted((dict(e) for e in entries), key=lambda e: e.get('overall_score', 0), reverse=True)
+    for position, entry in enumerate(ranked, 1):
+        entry['rank'] = position
+    return ranked
+
+
+class BubbleLeaderboard:
+    """
+    One ranking document per bubble holding an entry per consenting member.
+    Member entries are written incrementally when scores, consent or
+    membership change; the whole document is recomputed when it is older
+    than max_age seconds, which bounds how long a missed update can last.
+    """
+
+    def __init__(self, db, collection: str = BUBBLE_LEADERBOARD_COL, max_age: int = 3600):
+        self.db = db
+        self.collection = collection
+        self.max_age = max_age
+
+    def _ref(self, bubble_id: str):
+        return self.db.collection(self.collection).document(bubble_id)
+
+    def get(self, bubble_id: str) -> Optional[Dict[str, Any]]:
+        """Get a bubble's ranking document, or None if it was never built"""
+        doc = self._ref(bubble_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def is_stale(self, ranking: Optional[Dict[str, Any]]) -> bool:
+        """Whether a ranking document is missing or past the staleness bound"""
+        if not ranking or not ranking.get('computed_at'):
+            return True
+        try:
+            computed_at = datetime.fromisoformat(ranking['computed_at'])
+        except (TypeError, ValueError):
+            return True
+        return datetime.utcnow() - computed_at > timedelta(seconds=self.max_age)
+
+    def set_member(self, bubble_ids: Iterable[str], uid: str, entry: Optional[Dict[str, Any]]):
+        """
+        Write (or, with entry None, drop) one member's entry in each of their bubbles
+        Args:
+            bubble_ids: Bubbles the user belongs to
+            uid: User identifier
+            entry: Leaderboard entry, or None if the user must not be ranked
+        """
+        self.set_members({bubble_id: {uid: entry} for bubble_id in bubble_ids or []})
+
+    def set_members(self, updates: Dict[str, Dict[str, Optional[Dict[str, Any]]]]):
+        """
+        Write (or, with entry None, drop) member entries, one merge per bubble
+        Args:
+            updates: Bubble id -> {uid: leaderboard entry or None}
+        """
+        bubble_ids = [bubble_id for bubble_id, members in updates.items() if members]
+        now = datetime.utcnow().isoformat()
+        for start in range(0, len(bubble_ids), _WRITE_BATCH_SIZE):
+            batch = self.db.batch()
+            for bubble_id in bubble_ids[start:start + _WRITE_BATCH_SIZE]:
+                entries = {uid: entry if entry is not None else firestore.DELETE_FIELD
+                           for uid, entry in updates[bubble_id].items()}
+                batch.set(self._ref(bubble_id), {'entries': entries, 'updated_at': now}, merge=True)
+            batch.commit()
+
+    def replace(self, bubble_id: str, entries: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Store a freshly computed ranking for a bubble and return it"""
+        now = datetime.utcnow().isoformat()
+        ranking = {'entries': entries, 'computed_at': now, 'updated_at': now}
+        self._ref(bubble_id).set(ranking)
+        return ranking
+
+    def remove(self, bubble_id: str):
+        """Drop a bubble's ranking (the bubble was deleted)"""
+        self._ref(bubble_id).delete()
@@ -0,0 +1,191 @@
+"""
+Generative model selection for StudyOS
+Picks the Gemini model for AI requests without probing on the request path; the last known good model is shared by all workers through the disk cache
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from .cache import cache
+from .logger import logger
+
+# Models in order of preference
+MODEL_CANDIDATES = (
+    'models/gemini-2.5-flash',
+    'models/gemini-2.5-pro',
+    'models/gemini-2.0-flash',
+    'models/gemini-flash-latest',
+)
+
+LAST_GOOD_KEY = 'ai:last_good_model'
+PROBE_LOCK_KEY = 'ai:probe_lock'
+
+# Smallest request that proves a model answers
+PROBE_PROMPT = 'Reply with OK.'
+PROBE_CONFIG = {'max_output_tokens': 1}
+
+
+class ModelSelector:
+    """
+    Orders candidate models for each request: the last known good model
+    first, then the rest by preference, with models that failed recently
+    moved to the back. A request falls through to the next model when one
+    raises and records whichever model answered, so no request ever waits
+    for a probe. A background thread probes the models preferred over the
+    current one, moving back to them once they recover; one worker per
+    interval does the probing.
+    """
+
+    def __init__(self, genai, candidates: Sequence[str] = MODEL_CANDIDATES, store=cache,
+                 probe_interval: int = 600, failure_cooldown: int = 60):
+        """
+        Args:
+            genai: The google.generativeai module (already configured)
+            candidates: Model names in order of preference
+            store: diskcache.Cache shared by the worker processes
+            probe_interval: Seconds between background probes (0 to probe once)
+            failure_cooldown: Seconds a failed model is tried last
+        """
+        self.genai = genai
+        self.candidates = list(candidates)
+        self.store = store
+        self.probe_interval = probe_interval
+        self.failure_cooldown = failure_cooldown
+        self._models: Dict[str, Any] = {}
+        self._failed: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    def last_good(self) -> Optional[str]:
+        """The model that answered most recently (any worker), if it is still a candidate"""
+        name = self.store.get(LAST_GOOD_KEY)
+        return name if name in self.candidates else None
+
+    def order(self) -> List[str]:
+        """Candidates in the order a request should try them"""
+        last_good = self.last_good()
+        ordered = ([last_good] if last_good else []) + [name for name in self.candidates if name != last_good]
+        now = time.monotonic()
+        healthy = [name for name in ordered if self._failed.get(name, 0) <= now]
+        return healthy + [name for name in ordered if name not in healthy]
+
+    def model(self, name: str):
+        """GenerativeModel for a name (built once per process)"""
+        with self._lock:
+            if name not in self._models:
+                self._models[name] = self.genai.GenerativeModel(model_name=name)
+            return self._models[name]
+
+    def mark_good(self, name: str):
+        self._failed.pop(name, None)
+        if self.store.get(LAST_GOOD_KEY) != name:
+            self.store.set(LAST_GOOD_KEY, name)
+            logger.info("ai_model_selected", model=name)
+
+    def mark_failed(self, name: str, error: Exception):
+        self._failed[name] = time.monotonic() + self.failure_cooldown
+        logger.warning("ai_model_failed", model=name, error=str(error))
+
+    def generate(self, prompt: Any, **kwargs) -> Any:
+        """
+        generate_content on the first model that answers
+        Raises:
+            The last model's error if every candidate failed
+        """
+        last_error = None
+        for name in self.order():
+            try:
+                response = self.model(name).generate_content(prompt, **kwargs)
+            except Exception as e:
+                self.mark_failed(name, e)
+                last_error = e
+                continue
+            self.mark_good(name)
+            return response
+        raise last_error or RuntimeError('No AI models configured')
+
+    def stream(self, prompt: Any, **kwargs) -> Iterator[str]:
+        """
+        Text chunks of a streamed answer from the first model that starts answering
+        Falls through to the next model only before the first chunk; closing
+        the generator (client gone) cancels the model's stream.
+        Raises:
+            The last model's error if every candidate failed
+        """
+        last_error = None
+        for name in self.order():
+            started = False
+            response = chunks = None
+            try:
+                response = self.model(name).generate_content(prompt, stream=True, **kwargs)
+                chunks = iter(response)
+                for chunk in chunks:
+                    text = chunk.text
+                    if text:
+                        started = True
+                        yield text
+            except Exception as e:
+                self.mark_failed(name, e)
+                if started:
+                    raise
+                last_error = e
+                continue
+            finally:
+                _cancel(chunks)
+                # google.generativeai keeps the underlying gRPC stream in _iterator
+                _cancel(getattr(response, '_iterator', None))
+            self.mark_good(name)
+            return
+        raise last_error or RuntimeError('No AI models configured')
+
+    def probe(self) -> Optional[str]:
+        """
+        Try the models preferred over the last known good one, best first
+        Returns:
+            The model now selected, or None if none answered
+        """
+        last_good = self.last_good()
+        for name in self.candidates:
+            if name == last_good:
+                return name
+            try:
+                self.model(name).generate_content(PROBE_PROMPT, generation_config=PROBE_CONFIG)
+            except Exception as e:
+                self.mark_failed(name, e)
+                continue
+            self.mark_good(name)
+            return name
+        return None
+
+    def start_probe(self):
+        """Probe in a daemon thread (once, or every probe_interval seconds)"""
+        with self._lock:
+            if self._probe_thread is not None:
+                return
+            self._probe_thread = threading.Thread(target=self._run_probe, name='ai-model-probe', daemon=True)
+        self._probe_thread.start()
+
+    def _run_probe(self):
+        while True:
+            # One worker probes per interval; the others pick up its result from the store
+            if self.store.add(PROBE_LOCK_KEY, os.getpid(), expire=max(self.probe_interval, 60)):
+                try:
+                    logger.info("ai_model_probed", model=self.probe())
+                except Exception as e:
+                    logger.error("ai_model_probe_error", error=str(e))
+            if not self.probe_interval:
+                return
+            time.sleep(self.probe_interval)
+
+
+def _cancel(response: Any):
+    """Stop a model response stream (gRPC streams cancel, generators close)"""
+    for method in ('cancel', 'close'):
+        stop = getattr(response, method, None)
+        if callable(stop):
+            try:
+                stop()
+            except Exception:
+                pass
+            return
@@ -0,0 +1,221 @@
+"""
+People search utilities for StudyOS
+Keeps a name-prefix index of searchable users so search never streams the users collection
+"""
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .leaderboard import purge_missing
+from .syllabus import SYLLABUS_INDEX
+
+PEOPLE_SEARCH_COL = 'people_search'
+
+MIN_QUERY_LENGTH = 2
+# Longer queries are matched on their first MAX_PREFIX_LENGTH characters, then checked in full
+MAX_PREFIX_LENGTH = 20
+MAX_PAGE_SIZE = 50
+# Index documents read per search at most (bounds post-filtering on subject)
+_MAX_SCANNED = 200
+
+# Firestore rejects batches with more than 500 writes
+_WRITE_BATCH_SIZE = 400
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_name(name: Any) -> str:
+    """Lowercase a name and collapse whitespace"""
+    return _WHITESPACE.sub(' ', str(name or '')).strip().lower()
+
+
+def name_prefixes(name: str) -> List[str]:
+    """
+    Build the prefixes a name can be found by
+    Every word prefix ("smi" -> "John Smith") and every prefix of the whole
+    name from the start of each word ("john sm", "smith") of at least
+    MIN_QUERY_LENGTH characters, capped at MAX_PREFIX_LENGTH.
+    """
+    normalized = normalize_name(name)
+    prefixes = set()
+    start = 0
+    while start < len(normalized):
+        tail = normalized[start:start + MAX_PREFIX_LENGTH]
+        for end in range(MIN_QUERY_LENGTH, len(tail) + 1):
+            prefixes.add(tail[:end].rstrip())
+        next_space = normalized.find(' ', start)
+        if next_space == -1:
+            break
+        start = next_space + 1
+    prefixes.discard('')
+    return sorted(p for p in prefixes if len(p) >= MIN_QUERY_LENGTH)
+
+
+def _grade_of(user_data: Dict[str, Any]) -> Optional[str]:
+    purpose = user_data.get('purpose')
+    if purpose == 'high_school' and user_data.get('highschool'):
+        grade = user_data['highschool'].get('grade')
+    elif purpose == 'after_tenth' and user_data.get('after_tenth'):
+        grade = user_data['after_tenth'].get('grade')
+    else:
+        grade = None
+    return str(grade) if grade else None
+
+
+def _word_suffixes(name_lower: str) -> List[str]:
+    """The name from the start of each word ("john smith" -> ["john smith", "smith"])"""
+    suffixes = [name_lower]
+    index = name_lower.find(' ')
+    while index != -1:
+        suffixes.append(name_lower[index + 1:])
+        index = name_lower.find(' ', index + 1)
+    return suffixes
+
+
+def build_search_entry(uid: str, user_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Build the stored search row for a user
+    Fields hidden by profile_visibility are left empty so filters cannot match on them.
+    Args:
+        uid: User identifier
+        user_data: User document
+    Returns:
+        Search entry dictionary, or None if the user must not be searchable by name
+    """
+    visibility = user_data.get('profile_visibility', {}) or {}
+    name = user_data.get('name') or ''
+    name_lower = normalize_name(name)
+    if not visibility.get('name', True) or len(name_lower) < MIN_QUERY_LENGTH:
+        return None
+    subjects = []
+    if visibility.get('subjects', True):
+        subjects = list(SYLLABUS_INDEX.for_user(user_data).subjects)
+    return {
+        'uid': uid,
+        'name': name,
+        'name_lower': name_lower,
+        'name_prefixes': name_prefixes(name),
+        # Unique, name-ordered pagination key
+        'sort_key': f"{name_lower}\x00{uid}",
+        'purpose_display': (user_data.get('purpose') or '').replace('_', ' ').title(),
+        'grade': _grade_of(user_data) if visibility.get('grade', True) else None,
+        'institution_id': (user_data.get('institution_id') or None) if visibility.get('school', True) else None,
+        'subjects': subjects,
+        'updated_at': datetime.utcnow().isoformat()
+    }
+
+
+class PeopleSearchIndex:
+    """
+    Name-prefix search over a Firestore collection of search entries.
+    Queries use array-contains on name_prefixes plus equality filters on
+    grade and institution, ordered by sort_key, so each page costs at most
+    a bounded number of index reads.
+    """
+
+    def __init__(self, db, collection: str = PEOPLE_SEARCH_COL):
+        self.db = db
+        self.collection = collection
+
+    def _ref(self, uid: str):
+        return self.db.collection(self.collection).document(uid)
+
+    def upsert(self, uid: str, user_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Store the search entry for a user (or drop it if the name is hidden) and return it"""
+        entry = build_search_entry(uid, user_data)
+        if entry is None:
+            self.remove(uid)
+            return None
+        self._ref(uid).set(entry)
+        return entry
+
+    def remove(self, uid: str):
+        """Drop a user from search"""
+        self._ref(uid).delete()
+
+    def search(self, query: str, grade: str = None, school: str = None, subject: str = None,
+               limit: int = 20, cursor: str = None, exclude_uid: str = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Find users whose name (a word or the whole name) starts with the query
+        Args:
+            query: Search text (at least MIN_QUERY_LENGTH characters)
+            grade: Only users in this grade
+            school: Only users in this institution
+            subject: Only users studying this subject
+            limit: Page size (capped at MAX_PAGE_SIZE)
+            cursor: next_cursor from the previous page
+            exclude_uid: User to leave out (the searcher)
+        Returns:
+            Tuple of (entries, next_cursor or None when there are no more results)
+        """
+        normalized = normalize_name(query)
+        if len(normalized) < MIN_QUERY_LENGTH:
+            return [], None
+        limit = max(1, min(int(limit or 20), MAX_PAGE_SIZE))
+        base = self.db.collection(self.collection).where('name_prefixes', 'array_contains', normalized[:MAX_PREFIX_LENGTH])
+        if grade:
+            base = base.where('grade', '==', str(grade))
+        if school:
+            base = base.where('institution_id', '==', school)
+        base = base.order_by('sort_key')
+
+        results = []
+        scanned = 0
+        last_key = cursor
+        more = True
+        while more and len(results) < limit and scanned < _MAX_SCANNED:
+            page_query = base.start_after({'sort_key': last_key}) if last_key else base
+            # One extra document tells whether another page exists
+            batch_size = limit - len(results) + 1
+            docs = list(page_query.limit(batch_size).stream())
+            more = len(docs) == batch_size
+            for doc in docs:
+                if len(results) == limit:
+                    break
+                entry = doc.to_dict()
+                scanned += 1
+                last_key = entry.get('sort_key')
+                if entry.get('uid') == exclude_uid:
+                    continue
+                # Queries longer than the indexed prefix are checked against the full name
+                if len(normalized) > MAX_PREFIX_LENGTH and not any(
+                    suffix.startswith(normalized) for suffix in _word_suffixes(entry.get('name_lower', ''))
+                ):
+                    continue
+                if subject and subject.lower() not in {s.lower() for s in entry.get('subjects') or []}:
+                    continue
+                results.append(entry)
+        return results, (last_key if more else None)
+
+    def rebuild(self, users: Iterable[Tuple[str, Dict[str, Any]]]) -> Tuple[int, int]:
+        """
+        Recompute every entry from user documents (backfills and repairs)
+        Args:
+            users: Every (uid, user_data) pair; entries of other uids (deleted users) are dropped
+        Returns:
+            Tuple of (entries written, entries removed because the name is hidden or missing or the user was deleted)
+        """
+        written = 0
+        removed = 0
+        seen = set()
+        batch = self.db.batch()
+        pending = 0
+        for uid, user_data in users:
+            seen.add(uid)
+            entry = build_search_entry(uid, user_data)
+            if entry is None:
+                batch.delete(self._ref(uid))
+                removed += 1
+            else:
+                batch.set(self._ref(uid), entry)
+                written += 1
+            pending += 1
+            if pending >= _WRITE_BATCH_SIZE:
+                batch.commit()
+                batch = self.db.batch()
+                pending = 0
+        if pending:
+            batch.commit()
+        removed += purge_missing(self.db, self.db.collection(self.collection), seen)
+        return written, removed
+
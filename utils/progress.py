@@ -0,0 +1,243 @@
+"""
+Academic progress utilities for StudyOS
+Scalar and bulk (cohort) progress calculation over the compiled syllabus index
+"""
+from itertools import compress
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Mapping, Tuple
+
+from .syllabus import SYLLABUS_INDEX, CompiledSyllabus
+
+_EMPTY_SET: FrozenSet[str] = frozenset()
+
+EMPTY_PROGRESS = {
+    'overall': 0,
+    'by_subject': {},
+    'total_chapters': 0,
+    'total_completed': 0,
+    'momentum': 0,
+    'consistency': 0,
+    'readiness': 0
+}
+
+# (completed, valid) -> rounded percentage; counts are small so this stays tiny
+_PERCENTAGES: Dict[Tuple[int, int], float] = {}
+
+
+def syllabus_for_user(user_data: Dict[str, Any]) -> Mapping[str, Any]:
+    """Get the (read-only) syllabus a user's progress is measured against"""
+    return SYLLABUS_INDEX.for_user(user_data).syllabus
+
+
+def exam_analytics(user_data: Dict[str, Any]) -> Tuple[float, int, float]:
+    """
+    Exam and activity analytics shared by the scalar and bulk paths
+    Args:
+        user_data: User document
+    Returns:
+        Tuple of (momentum, consistency, average exam score)
+    """
+    momentum = 0
+    # 1. Momentum: Last 4 exams gradient
+    results = user_data.get('exam_results', [])
+    if len(results) >= 2:
+        sorted_res = sorted(results, key=lambda x: x.get('date', ''), reverse=True)
+        try:
+            series = [float(r.get('percentage', r.get('score', 0))) for r in sorted_res[:4]][::-1]
+            momentum = round(series[-1] - series[0], 1)
+        except: pass
+    # 2. Consistency: More sessions per week = higher consistency
+    sessions_count = len(user_data.get('recent_sessions', []))
+    consistency = min(100, sessions_count * 15)
+    # 3. Average score feeds readiness
+    avg_score = 0
+    if results:
+        avg_score = sum([float(r.get('percentage', r.get('score', 0))) for r in results]) / len(results)
+    return momentum, consistency, avg_score
+
+
+def _finish(user_data, by_subject, chapters_by_subject, total_chapters, total_completed) -> Dict[str, Any]:
+    momentum, consistency, avg_score = exam_analytics(user_data)
+    overall = round((total_completed / total_chapters) * 100, 1) if total_chapters > 0 else 0
+    readiness = round((overall * 0.4) + (avg_score * 0.6), 1)
+    return {
+        'overall': overall,
+        'by_subject': by_subject,
+        'chapters_by_subject': chapters_by_subject,
+        'total_chapters': total_chapters,
+        'total_completed': total_completed,
+        'momentum': momentum,
+        'consistency': consistency,
+        'readiness': readiness
+    }
+
+
+def compute_progress(user_data: Dict[str, Any], syllabus: Dict[str, Any],
+                     all_exclusions: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Calculate progress for one student
+    Args:
+        user_data: User document
+        syllabus: Syllabus the student follows
+        all_exclusions: Merged institution, class and personal exclusions
+    Returns:
+        Progress dictionary (overall, by_subject, chapters_by_subject, momentum, ...)
+    """
+    chapters_completed = user_data.get('chapters_completed', {})
+    if not syllabus:
+        return dict(EMPTY_PROGRESS, by_subject={})
+    by_subject = {}
+    chapters_by_subject = {}
+    total_chapters = 0
+    total_completed = 0
+    for subject_name, subject_data in syllabus.items():
+        chapters = subject_data.get('chapters', {})
+        subject_completed_data = chapters_completed.get(subject_name, {})
+        subject_valid_count = 0
+        subject_completed_count = 0
+        for chapter_name in chapters.keys():
+            exclusion_key = f"{subject_name}::{chapter_name}"
+            # If chapter is excluded at ANY level, skip it
+            if all_exclusions.get(exclusion_key):
+                continue
+            subject_valid_count += 1
+            if subject_completed_data.get(chapter_name, False):
+                subject_completed_count += 1
+        if subject_valid_count > 0:
+            by_subject[subject_name] = round((subject_completed_count / subject_valid_count) * 100, 1)
+        else:
+            by_subject[subject_name] = 0
+        chapters_by_subject[subject_name] = {
+            'total': subject_valid_count,
+            'completed': subject_completed_count
+        }
+        total_chapters += subject_valid_count
+        total_completed += subject_completed_count
+    return _finish(user_data, by_subject, chapters_by_subject, total_chapters, total_completed)
+
+
+def _exclusion_sets(compiled: CompiledSyllabus, exclusions: Dict[str, Any]) -> Tuple[Dict[int, set], Dict[int, set]]:
+    """
+    Encode an exclusion map per subject
+    Returns:
+        Tuple of (chapters with a truthy value, chapters present with a falsy value), keyed by subject index
+    """
+    truthy: Dict[int, set] = {}
+    falsy: Dict[int, set] = {}
+    key_ids = compiled.key_ids
+    chapter_table = compiled.chapter_table
+    subject_index = compiled.subject_index
+    for key, value in exclusions.items():
+        for chapter_id in key_ids.get(key, ()):
+            subject_name, chapter_name = chapter_table[chapter_id]
+            (truthy if value else falsy).setdefault(subject_index[subject_name], set()).add(chapter_name)
+    return truthy, falsy
+
+
+def shared_exclusion_sets(compiled: CompiledSyllabus, exclusions: Dict[str, Any]) -> Tuple[FrozenSet[str], ...]:
+    """Excluded chapter set per subject for an institution/class exclusion map"""
+    truthy, _ = _exclusion_sets(compiled, exclusions)
+    return tuple(frozenset(truthy.get(i, _EMPTY_SET)) for i in range(len(compiled.subjects)))
+
+
+def _merge_personal(compiled: CompiledSyllabus, shared: Tuple[FrozenSet[str], ...],
+                    personal: Dict[str, Any]) -> Tuple[FrozenSet[str], ...]:
+    """Apply personal exclusions over shared ones (dict.update semantics: personal values win)"""
+    if not personal:
+        return shared
+    truthy, falsy = _exclusion_sets(compiled, personal)
+    if not truthy and not falsy:
+        return shared
+    merged = list(shared)
+    for index in set(truthy) | set(falsy):
+        merged[index] = (shared[index] - falsy.get(index, _EMPTY_SET)) | truthy.get(index, _EMPTY_SET)
+    return tuple(merged)
+
+
+def _progress_from_sets(compiled: CompiledSyllabus, user_data: Dict[str, Any],
+                        excluded: Tuple[FrozenSet[str], ...]) -> Dict[str, Any]:
+    """
+    Compute progress from compiled chapter sets.
+    Counts come from C-level set intersections (completed chapters are picked
+    out with itertools.compress) instead of a per-chapter walk.
+    """
+    chapters_completed = user_data.get('chapters_completed', {})
+    by_subject = {}
+    chapters_by_subject = {}
+    total_chapters = 0
+    total_completed = 0
+    for (subject_name, chapters, count), subject_excluded in zip(compiled.subject_chapters, excluded):
+        subject_completed_data = chapters_completed.get(subject_name, {})
+        done = chapters.intersection(compress(subject_completed_data, subject_completed_data.values()))
+        if subject_excluded:
+            subject_valid_count = count - len(subject_excluded)
+            subject_completed_count = len(done - subject_excluded)
+        else:
+            subject_valid_count = count
+            subject_completed_count = len(done)
+        # Percentages only depend on the two counts, so each pair is rounded once
+        percentage = _PERCENTAGES.get((subject_completed_count, subject_valid_count))
+        if percentage is None:
+            percentage = round((subject_completed_count / subject_valid_count) * 100, 1) if subject_valid_count > 0 else 0
+            _PERCENTAGES[(subject_completed_count, subject_valid_count)] = percentage
+        by_subject[subject_name] = percentage
+        chapters_by_subject[subject_name] = {
+            'total': subject_valid_count,
+            'completed': subject_completed_count
+        }
+        total_chapters += subject_valid_count
+        total_completed += subject_completed_count
+    return _finish(user_data, by_subject, chapters_by_subject, total_chapters, total_completed)
+
+
+def compute_progress_compiled(user_data: Dict[str, Any], shared_exclusions: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Calculate progress for one student from the syllabus index (same result as compute_progress)
+    Args:
+        user_data: User document
+        shared_exclusions: Institution + class exclusions for the student
+    Returns:
+        Progress dictionary
+    """
+    compiled = SYLLABUS_INDEX.for_user(user_data)
+    if not compiled:
+        return dict(EMPTY_PROGRESS, by_subject={})
+    excluded = _merge_personal(compiled, shared_exclusion_sets(compiled, shared_exclusions),
+                               user_data.get('academic_exclusions', {}) or {})
+    return _progress_from_sets(compiled, user_data, excluded)
+
+
+def compute_progress_bulk(user_docs: Iterable[Tuple[str, Dict[str, Any]]],
+                          shared_exclusions_for: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Calculate progress for a whole cohort.
+    Each distinct shared exclusion map is encoded once per syllabus, so
+    per-student work is a handful of set operations per subject. Results
+    equal compute_progress for every student.
+    Args:
+        user_docs: Iterable of (uid, user_data)
+        shared_exclusions_for: Returns the institution + class exclusions for a user
+    Returns:
+        Dictionary mapping uid to progress (students whose data cannot be scored are omitted)
+    """
+    results = {}
+    # (id(compiled), id(shared map)) -> (compiled, shared map, encoded sets); holding both keeps the ids unique
+    shared_sets: Dict[Tuple[int, int], Tuple[CompiledSyllabus, Dict[str, Any], Tuple[FrozenSet[str], ...]]] = {}
+    for uid, user_data in user_docs:
+        try:
+            compiled = SYLLABUS_INDEX.for_user(user_data)
+            if not compiled:
+                results[uid] = dict(EMPTY_PROGRESS, by_subject={})
+                continue
+            shared = shared_exclusions_for(user_data)
+            # Shared exclusion maps are the same object for students in the same classes
+            cache_key = (id(compiled), id(shared))
+            cached = shared_sets.get(cache_key)
+            if cached is None:
+                cached = (compiled, shared, shared_exclusion_sets(compiled, shared))
+                shared_sets[cache_key] = cached
+            excluded = _merge_personal(compiled, cached[2], user_data.get('academic_exclusions', {}) or {})
+            results[uid] = _progress_from_sets(compiled, user_data, excluded)
+        except Exception:
+            # Unscorable documents are left out, as the per-student loops skip them
+            continue
+    return results
@@ -0,0 +1,161 @@
+"""
+Publish/subscribe utilities for StudyOS
+Fans out server-push events to the streams connected to this process, relaying across worker processes through the disk cache
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Optional, Set
+
+from .logger import logger
+
+SEQUENCE_KEY = 'pubsub:seq'
+MESSAGE_PREFIX = 'pubsub:msg:'
+
+# Messages buffered per subscriber before new ones are dropped (slow or stalled clients)
+SUBSCRIPTION_BUFFER = 100
+
+
+class Subscription:
+    """Messages for one connected client, on one or more channels"""
+
+    def __init__(self, broker: 'LocalBroker', channels: Iterable[str]):
+        self.broker = broker
+        self.channels = tuple(dict.fromkeys(channels))
+        self._queue: 'queue.Queue[Any]' = queue.Queue(maxsize=SUBSCRIPTION_BUFFER)
+
+    def put(self, message: Any):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            logger.warning("pubsub_subscription_full", channels=list(self.channels))
+
+    def get(self, timeout: float = None) -> Optional[Any]:
+        """Wait for the next message, None on timeout"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """In-process pub/sub: a message reaches the subscribers of this process only"""
+
+    def __init__(self):
+        self._subscriptions: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels: Iterable[str]) -> Subscription:
+        subscription = Subscription(self, channels)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions[channel].add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            removed = False
+            for channel in subscription.channels:
+                subscribers = self._subscriptions.get(channel)
+                if subscribers and subscription in subscribers:
+                    subscribers.discard(subscription)
+                    removed = True
+                    if not subscribers:
+                        del self._subscriptions[channel]
+            if removed:
+                self._count -= 1
+
+    def connection_count(self) -> int:
+        """Subscriptions (connected streams) in this process"""
+        return self._count
+
+    def _deliver(self, channel: str, message: Any) -> int:
+        with self._lock:
+            subscribers = list(self._subscriptions.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+        return len(subscribers)
+
+    def publish(self, channel: str, message: Any) -> int:
+        """
+        Send a message to a channel
+        Returns:
+            Number of local subscribers it was handed to
+        """
+        return self._deliver(channel, message)
+
+
+class DiskCacheBroker(LocalBroker):
+    """
+    Pub/sub shared by every worker process on the host.
+    Messages are delivered locally at once and appended to the disk cache
+    under an increasing sequence number; a relay thread in each process
+    forwards messages published by other processes to its own subscribers.
+    """
+
+    def __init__(self, store, poll_interval: float = 0.5, retention: int = 60):
+        """
+        Args:
+            store: diskcache.Cache shared by the worker processes
+            poll_interval: Seconds between relay passes (0 to call relay_pending yourself)
+            retention: Seconds a published message stays available to other processes
+        """
+        super().__init__()
+        self.store = store
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._origin = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self._relay = None
+
+    def publish(self, channel: str, message: Any) -> int:
+        # One transaction, so a relay never sees the sequence number before its message
+        with self.store.transact():
+            sequence = self.store.incr(SEQUENCE_KEY)
+            self.store.set(f"{MESSAGE_PREFIX}{sequence}", (self._origin, channel, message), expire=self.retention)
+        return self._deliver(channel, message)
+
+    def subscribe(self, channels: Iterable[str]) -> Subscription:
+        self._start_relay()
+        return super().subscribe(channels)
+
+    def _start_relay(self):
+        if self._relay is not None or not self.poll_interval:
+            return
+        with self._lock:
+            if self._relay is None:
+                self._relay = threading.Thread(target=self._run_relay, name='pubsub-relay', daemon=True)
+                self._relay.start()
+
+    def relay_pending(self, last: int) -> int:
+        """
+        Forward messages other processes published after sequence number last
+        Returns:
+            The newest sequence number seen
+        """
+        current = self.store.get(SEQUENCE_KEY, 0)
+        for sequence in range(last + 1, current + 1):
+            item = self.store.get(f"{MESSAGE_PREFIX}{sequence}")
+            if item is not None and item[0] != self._origin:
+                self._deliver(item[1], item[2])
+        return current
+
+    def _run_relay(self):
+        last = self.store.get(SEQUENCE_KEY, 0)
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                if self._count:
+                    last = self.relay_pending(last)
+                else:
+                    # Nobody to deliver to; skip what was published meanwhile
+                    last = self.store.get(SEQUENCE_KEY, 0)
+            except Exception as e:
+                logger.error("pubsub_relay_error", error=str(e))
@@ -0,0 +1,113 @@
+"""
+Request-scoped document cache for StudyOS
+Identity map over Firestore document reads so each document is fetched at most once per request
+"""
+from typing import Any, Dict, Iterable, List
+
+from flask import g, has_request_context
+
+_CACHE_ATTR = '_firestore_documents'
+_READS_ATTR = '_firestore_reads'
+_HITS_ATTR = '_firestore_hits'
+
+
+def _documents() -> Dict[str, Any]:
+    """Get the snapshot map for the current request, or None outside a request"""
+    if not has_request_context():
+        return None
+    documents = g.get(_CACHE_ATTR)
+    if documents is None:
+        documents = {}
+        setattr(g, _CACHE_ATTR, documents)
+        setattr(g, _READS_ATTR, 0)
+        setattr(g, _HITS_ATTR, 0)
+    return documents
+
+
+def _record(reads: int = 0, hits: int = 0):
+    setattr(g, _READS_ATTR, g.get(_READS_ATTR, 0) + reads)
+    setattr(g, _HITS_ATTR, g.get(_HITS_ATTR, 0) + hits)
+
+
+def get_document(ref):
+    """
+    Read a document through the request cache
+    Args:
+        ref: Firestore DocumentReference
+    Returns:
+        DocumentSnapshot (to_dict() returns a fresh copy on every call)
+    """
+    documents = _documents()
+    if documents is None:
+        return ref.get()
+    snapshot = documents.get(ref.path)
+    if snapshot is not None:
+        _record(hits=1)
+        return snapshot
+    snapshot = ref.get()
+    documents[ref.path] = snapshot
+    _record(reads=1)
+    return snapshot
+
+
+def get_documents(db, refs: Iterable) -> List[Any]:
+    """
+    Read several documents, fetching all cache misses in one get_all round trip
+    Args:
+        db: Firestore client
+        refs: DocumentReferences to read
+    Returns:
+        List of DocumentSnapshots in the same order as refs
+    """
+    refs = list(refs)
+    documents = _documents()
+    if documents is None:
+        by_path = {snap.reference.path: snap for snap in db.get_all(refs)} if refs else {}
+        return [by_path[ref.path] for ref in refs]
+    missing = {ref.path: ref for ref in refs if ref.path not in documents}
+    if missing:
+        for snapshot in db.get_all(list(missing.values())):
+            documents[snapshot.reference.path] = snapshot
+    _record(reads=len(missing), hits=len(refs) - len(missing))
+    return [documents[ref.path] for ref in refs]
+
+
+def invalidate_document(*refs):
+    """Drop documents from the request cache after they were written elsewhere (e.g. in a batch)"""
+    documents = _documents()
+    if documents is None:
+        return
+    for ref in refs:
+        documents.pop(ref.path, None)
+
+
+def update_document(ref, data: Dict[str, Any]):
+    """Update a document and invalidate its cached snapshot"""
+    result = ref.update(data)
+    invalidate_document(ref)
+    return result
+
+
+def set_document(ref, data: Dict[str, Any], merge: bool = False):
+    """Set a document and invalidate its cached snapshot"""
+    result = ref.set(data, merge=merge)
+    invalidate_document(ref)
+    return result
+
+
+def delete_document(ref):
+    """Delete a document and invalidate its cached snapshot"""
+    result = ref.delete()
+    invalidate_document(ref)
+    return result
+
+
+def request_read_stats() -> Dict[str, int]:
+    """
+    Get document read counters for the current request
+    Returns:
+        Dictionary with Firestore reads performed and reads saved by the cache
+    """
+    if not has_request_context():
+        return {'reads': 0, 'reads_saved': 0}
+    return {'reads': g.get(_READS_ATTR, 0), 'reads_saved': g.get(_HITS_ATTR, 0)}
@@ -0,0 +1,212 @@
+"""
+At-risk student scoring for StudyOS
+Scores an institution's (or a teacher's classes') roster in one pass over batched reads, with a shared TTL cache
+"""
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from .logger import logger
+
+CLASSES_COL = 'classes'
+
+# Days without a login before a student counts as stagnating
+STAGNATION_DAYS = 7
+# Drop in percentage points over the last results that counts as declining
+DECLINE_THRESHOLD = -5
+# Most recent exam results the momentum is measured over
+MOMENTUM_WINDOW = 3
+
+# Documents per get_all round trip
+_GET_ALL_CHUNK = 300
+
+# Keys are (institution_id, frozenset(class_ids) or None for the whole institution)
+RiskKey = Tuple[str, Optional[FrozenSet[str]]]
+
+
+def _days_since(value: str, now: datetime) -> int:
+    when = datetime.fromisoformat(value)
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return (now - when).days
+
+
+def exam_momentum(results: List[Dict[str, Any]]) -> Optional[float]:
+    """
+    Change in percentage from the oldest to the newest of the latest exam results
+    Returns:
+        Momentum in percentage points, or None with fewer than two usable results
+    """
+    if len(results) < 2:
+        return None
+    try:
+        latest = heapq.nlargest(MOMENTUM_WINDOW, results, key=lambda r: r.get('date', ''))
+        series = [float(r.get('percentage', r.get('score', 0))) for r in latest][::-1]
+    except (TypeError, ValueError, AttributeError):
+        return None
+    return series[-1] - series[0]
+
+
+def score_student(user_data: Dict[str, Any], now: datetime = None) -> Tuple[str, float]:
+    """
+    Classify a student from their last login and exam momentum
+    Args:
+        user_data: Student's user document
+        now: Reference time (UTC), defaults to now
+    Returns:
+        Tuple of (status, momentum) where status is healthy, stagnating, declining or critical
+    """
+    now = now or datetime.utcnow()
+    status = 'healthy'
+    last_login = user_data.get('last_login_date')
+    try:
+        if not last_login or _days_since(last_login, now) > STAGNATION_DAYS:
+            status = 'stagnating'
+    except (TypeError, ValueError):
+        status = 'stagnating'
+
+    momentum = exam_momentum(user_data.get('exam_results') or [])
+    if momentum is None:
+        return status, 0
+    if momentum < DECLINE_THRESHOLD:
+        status = 'critical' if status == 'stagnating' else 'declining'
+    return status, momentum
+
+
+def student_classes(classes_map: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """Invert classes into student uid -> class name (the first class listing the student wins)"""
+    mapping = {}
+    for cid, cdata in classes_map.items():
+        name = cdata.get('name', cid)
+        for sid in cdata.get('student_uids', []):
+            mapping.setdefault(sid, name)
+    return mapping
+
+
+class RiskScorer:
+    """
+    Score every student of an institution (optionally limited to some classes).
+    Classes are read with one query and the roster in chunked get_all calls;
+    reports are memoized in a thread-safe TTL/LRU cache shared across requests.
+    """
+
+    def __init__(self, db, ttl: int = 60, maxsize: int = 256):
+        self.db = db
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: 'OrderedDict[RiskKey, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key: RiskKey) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, report = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return report
+
+    def _store(self, key: RiskKey, report: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), report)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _load_classes(self, institution_id: str, class_ids: Optional[FrozenSet[str]]) -> Dict[str, Dict[str, Any]]:
+        docs = self.db.collection(CLASSES_COL).where('institution_id', '==', institution_id).stream()
+        return {d.id: d.to_dict() for d in docs if class_ids is None or d.id in class_ids}
+
+    def _load_roster(self, student_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        collection = self.db.collection('users')
+        roster = {}
+        for start in range(0, len(student_ids), _GET_ALL_CHUNK):
+            refs = [collection.document(sid) for sid in student_ids[start:start + _GET_ALL_CHUNK]]
+            for snapshot in self.db.get_all(refs):
+                if snapshot.exists:
+                    roster[snapshot.id] = snapshot.to_dict()
+        return roster
+
+    def assess(self, institution_id: str, class_ids: Iterable[str] = None) -> Dict[str, Any]:
+        """
+        Get the classes and at-risk students of an institution
+        Args:
+            institution_id: Institution identifier
+            class_ids: Only students of these classes (all classes when None)
+        Returns:
+            Dictionary with 'class_ids' (classes considered), 'at_risk' (list of
+            uid, name, class, status, momentum) and 'timings' (milliseconds per stage)
+        """
+        key = (institution_id, frozenset(class_ids) if class_ids is not None else None)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        timings = {}
+        started = stage = time.perf_counter()
+
+        def lap(name):
+            nonlocal stage
+            now = time.perf_counter()
+            timings[name] = round((now - stage) * 1000, 2)
+            stage = now
+
+        classes_map = self._load_classes(institution_id, key[1])
+        class_of = student_classes(classes_map)
+        lap('classes_ms')
+        roster = self._load_roster(sorted(class_of))
+        lap('roster_ms')
+        at_risk = self.score_roster(roster, class_of)
+        lap('score_ms')
+        timings['total_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+        report = {'class_ids': list(classes_map), 'at_risk': at_risk, 'timings': timings}
+        self._store(key, report)
+        logger.info("risk_scoring", institution_id=institution_id, classes=len(classes_map),
+                    students=len(roster), at_risk=len(at_risk), **timings)
+        return report
+
+    @staticmethod
+    def score_roster(roster: Dict[str, Dict[str, Any]], class_of: Dict[str, str],
+                     now: datetime = None) -> List[Dict[str, Any]]:
+        """
+        Score a loaded roster in one pass
+        Args:
+            roster: uid -> user document
+            class_of: uid -> class name (see student_classes)
+            now: Reference time (UTC), defaults to now
+        Returns:
+            At-risk entries ordered by uid
+        """
+        now = now or datetime.utcnow()
+        at_risk = []
+        for sid in sorted(roster):
+            s_data = roster[sid]
+            status, momentum = score_student(s_data, now)
+            if status == 'healthy':
+                continue
+            at_risk.append({
+                'uid': sid,
+                'name': s_data.get('name', 'Student'),
+                'class': class_of.get(sid, 'Unknown'),
+                'status': status,
+                'momentum': round(momentum, 2)
+            })
+        return at_risk
+
+    def invalidate_institution(self, institution_id: str):
+        """Drop cached reports for an institution (call after its rosters change)"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == institution_id]:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop all cached reports"""
+        with self._lock:
+            self._entries.clear()
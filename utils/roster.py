@@ -0,0 +1,136 @@
+"""
+Institution roster utilities for StudyOS
+Loads an institution's classes and students once and joins them in memory for listing pages
+"""
+import math
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+CLASSES_COL = 'classes'
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Shown for students who never logged in (or whose login date is unreadable)
+NEVER_ACTIVE = 999
+
+# Documents per get_all round trip
+_GET_ALL_CHUNK = 300
+
+
+def days_inactive(last_login: Any, today: date = None) -> int:
+    """Days since a student's last login, NEVER_ACTIVE if unknown"""
+    if not last_login:
+        return NEVER_ACTIVE
+    try:
+        last_date = datetime.fromisoformat(last_login).date() if isinstance(last_login, str) else last_login
+        if isinstance(last_date, datetime):
+            last_date = last_date.date()
+        return ((today or date.today()) - last_date).days
+    except (TypeError, ValueError):
+        return NEVER_ACTIVE
+
+
+class Roster:
+    """
+    Classes and students of an institution with both directions of the
+    membership join (class -> students, student -> classes) built in one
+    pass over the students' class_ids.
+    """
+
+    def __init__(self, classes: Dict[str, Dict[str, Any]], students: Dict[str, Dict[str, Any]]):
+        self.classes = classes
+        self.students = students
+        self.class_students: Dict[str, List[str]] = {cid: [] for cid in classes}
+        self.student_classes: Dict[str, List[str]] = {}
+        for uid, s_data in students.items():
+            joined = [cid for cid in s_data.get('class_ids') or [] if cid in self.class_students]
+            for cid in joined:
+                self.class_students[cid].append(uid)
+            self.student_classes[uid] = joined
+
+    @classmethod
+    def load(cls, db, institution_id: str, teacher_id: str = None, referenced_classes: bool = False) -> 'Roster':
+        """
+        Read an institution's students (one query) and classes (one query)
+        Args:
+            db: Firestore client
+            institution_id: Institution identifier
+            teacher_id: Only this teacher's classes
+            referenced_classes: Also fetch (batched) classes outside the institution that students still list
+        """
+        classes_query = db.collection(CLASSES_COL).where('institution_id', '==', institution_id)
+        if teacher_id:
+            classes_query = classes_query.where('teacher_id', '==', teacher_id)
+        classes = {doc.id: doc.to_dict() for doc in classes_query.stream()}
+        students = {doc.id: doc.to_dict() for doc in db.collection('users').where('institution_id', '==', institution_id).stream()}
+        if referenced_classes:
+            referenced = sorted({cid for s in students.values() for cid in s.get('class_ids') or []} - set(classes))
+            collection = db.collection(CLASSES_COL)
+            for start in range(0, len(referenced), _GET_ALL_CHUNK):
+                refs = [collection.document(cid) for cid in referenced[start:start + _GET_ALL_CHUNK]]
+                for snapshot in db.get_all(refs):
+                    if snapshot.exists:
+                        classes[snapshot.id] = snapshot.to_dict()
+        return cls(classes, students)
+
+    def class_names(self, uid: str) -> List[str]:
+        """Names of the classes a student belongs to"""
+        return [self.classes[cid].get('name', cid) for cid in self.student_classes.get(uid, [])]
+
+    def classes_with_students(self) -> List[Dict[str, Any]]:
+        """Class dictionaries (with 'id') and the uids of their students under 'students'"""
+        return [{'id': cid, **c_data, 'students': list(self.class_students[cid])} for cid, c_data in self.classes.items()]
+
+    def student_rows(self, today: date = None) -> List[Dict[str, Any]]:
+        """Student dictionaries (with 'uid') and their class names and inactivity"""
+        rows = []
+        for uid, s_data in self.students.items():
+            names = self.class_names(uid)
+            rows.append({
+                **s_data,
+                'uid': uid,
+                'class_names': ', '.join(names) if names else 'No class',
+                'days_inactive': days_inactive(s_data.get('last_login_date'), today)
+            })
+        return rows
+
+
+# Sort keys for student rows; uid breaks ties so pages are stable
+STUDENT_SORTS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    'name': lambda row: ((row.get('name') or '').lower(), row['uid']),
+    'classes': lambda row: (row['class_names'].lower(), (row.get('name') or '').lower(), row['uid']),
+    'last_active': lambda row: (row['days_inactive'], (row.get('name') or '').lower(), row['uid']),
+    'progress': lambda row: (row.get('progress_overall', 0), (row.get('name') or '').lower(), row['uid']),
+}
+
+
+def paginate(rows: List[Dict[str, Any]], sort: str = 'name', order: str = 'asc',
+             page: Any = 1, per_page: Any = DEFAULT_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Sort rows and cut out one page
+    Args:
+        rows: Student rows (see Roster.student_rows)
+        sort: Key from STUDENT_SORTS (unknown keys fall back to name)
+        order: 'asc' or 'desc'
+        page: 1-based page number (clamped to the available pages)
+        per_page: Page size (capped at MAX_PAGE_SIZE)
+    Returns:
+        Tuple of (rows on the page, pagination dictionary)
+    """
+    sort = sort if sort in STUDENT_SORTS else 'name'
+    order = 'desc' if order == 'desc' else 'asc'
+    try:
+        per_page = max(1, min(int(per_page), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        per_page = DEFAULT_PAGE_SIZE
+    pages = max(1, math.ceil(len(rows) / per_page))
+    try:
+        page = max(1, min(int(page), pages))
+    except (TypeError, ValueError):
+        page = 1
+    ordered = sorted(rows, key=STUDENT_SORTS[sort], reverse=order == 'desc')
+    start = (page - 1) * per_page
+    return ordered[start:start + per_page], {
+        'sort': sort, 'order': order, 'page': page, 'pages': pages,
+        'per_page': per_page, 'total': len(rows)
+    }
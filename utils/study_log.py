@@ -0,0 +1,265 @@
+"""
+Study time utilities for StudyOS
+One session store per user plus daily/weekly rollups maintained at write time, so dashboards read a single document
+"""
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Tuple
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+
+STUDY_SESSIONS_COL = 'study_sessions'
+STUDY_ROLLUPS_COL = 'study_rollups'
+TOTALS_DOC = 'totals'
+
+# History kept in the rollup document (older days/weeks are pruned by the writes that follow)
+ROLLUP_DAYS = 35
+ROLLUP_WEEKS = 12
+
+# Firestore rejects batches with more than 500 writes
+_WRITE_BATCH_SIZE = 400
+
+
+def week_key(day: str) -> str:
+    """ISO week ('YYYY-Www') of a 'YYYY-MM-DD' day"""
+    year, week, _ = date.fromisoformat(day).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _shift(day: str, days: int) -> str:
+    return (date.fromisoformat(day) + timedelta(days=days)).isoformat()
+
+
+def summarize(rollup: Dict[str, Any], today: str, days: int = 7, weeks: int = 4) -> Dict[str, Any]:
+    """
+    Dashboard figures from a rollup document
+    Args:
+        rollup: Rollup document ({'day_seconds': {...}, 'week_seconds': {...}})
+        today: The user's local day 'YYYY-MM-DD'
+        days: Days in the daily series (ending today)
+        weeks: Weeks in the weekly series (ending this week)
+    Returns:
+        Dictionary with 'daily' [{date, minutes}], 'weekly' [{week, minutes}] and 'total_week_hours'
+    """
+    day_seconds = rollup.get('day_seconds') or {}
+    week_seconds = rollup.get('week_seconds') or {}
+    daily = []
+    for offset in range(days - 1, -1, -1):
+        day = _shift(today, -offset)
+        daily.append({'date': day, 'minutes': int(day_seconds.get(day, 0)) // 60})
+    weekly = []
+    for offset in range(weeks - 1, -1, -1):
+        week = week_key(_shift(today, -7 * offset))
+        weekly.append({'week': week, 'minutes': int(week_seconds.get(week, 0)) // 60})
+    return {
+        'daily': daily,
+        'weekly': weekly,
+        'total_week_hours': round(sum(day['minutes'] for day in daily) / 60, 1)
+    }
+
+
+def expired_keys(rollup: Dict[str, Any], today: str, keep_days: int = ROLLUP_DAYS,
+                 keep_weeks: int = ROLLUP_WEEKS) -> Tuple[List[str], List[str]]:
+    """Days and weeks of a rollup document older than the kept history"""
+    first_day = _shift(today, -(keep_days - 1))
+    first_week = week_key(_shift(today, -7 * (keep_weeks - 1)))
+    return (
+        [day for day in rollup.get('day_seconds') or {} if day < first_day],
+        [week for week in rollup.get('week_seconds') or {} if week < first_week]
+    )
+
+
+def to_client(session_id: str, session_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Session document as sent to the browser (also under the legacy field names)"""
+    seconds = session_data.get('duration_seconds')
+    return {
+        **session_data,
+        'id': session_id,
+        'session_date': session_data.get('start_time', ''),
+        'duration_minutes': int(seconds) // 60 if isinstance(seconds, (int, float)) else 0
+    }
+
+
+class StudyLog:
+    """
+    Study sessions of a user live in users/{uid}/study_sessions, whether
+    recorded by the study-mode timer (one document per hour) or logged by
+    hand. users/{uid}/study_rollups/totals holds seconds studied per local
+    day and per ISO week; every session write increments it in the same
+    batch, so the totals never drift from the sessions.
+    """
+
+    def __init__(self, db, keep_days: int = ROLLUP_DAYS, keep_weeks: int = ROLLUP_WEEKS):
+        self.db = db
+        self.keep_days = keep_days
+        self.keep_weeks = keep_weeks
+
+    def _sessions(self, uid: str):
+        return self.db.collection('users').document(uid).collection(STUDY_SESSIONS_COL)
+
+    def _rollup(self, uid: str):
+        return self.db.collection('users').document(uid).collection(STUDY_ROLLUPS_COL).document(TOTALS_DOC)
+
+    def _expiring(self, day: str) -> Tuple[List[str], List[str]]:
+        """Days and weeks within one kept history before the window ending on day"""
+        first_day = _shift(day, -(self.keep_days - 1))
+        first_week = _shift(day, -7 * (self.keep_weeks - 1))
+        return (
+            [_shift(first_day, -n) for n in range(1, self.keep_days + 1)],
+            [week_key(_shift(first_week, -7 * n)) for n in range(1, self.keep_weeks + 1)]
+        )
+
+    def _add_rollup(self, batch, uid: str, day: str, seconds: int):
+        # Each write also deletes the keys that recently left the kept history; keys of users
+        # away longer than that are ignored by summarize and dropped by rebuild
+        days_expired, weeks_expired = self._expiring(day)
+        batch.set(self._rollup(uid), {
+            'day_seconds': {day: firestore.Increment(seconds), **dict.fromkeys(days_expired, firestore.DELETE_FIELD)},
+            'week_seconds': {week_key(day): firestore.Increment(seconds),
+                             **dict.fromkeys(weeks_expired, firestore.DELETE_FIELD)},
+            'updated_at': datetime.utcnow().isoformat()
+        }, merge=True)
+
+    def record_time(self, uid: str, session_id: str, session_data: Dict[str, Any], seconds: int) -> bool:
+        """
+        Add timer seconds to a session (created if new) and to the rollups, atomically
+        Args:
+            uid: User identifier
+            session_id: Session document id (one per hour of study)
+            session_data: Session fields; start_time is the user's local ISO time
+            seconds: Seconds studied since the last report
+        Returns:
+            True if the session document was created by this call
+        """
+        ref = self._sessions(uid).document(session_id)
+        day = session_data['start_time'][:10]
+        batch = self.db.batch()
+        # create() fails the whole batch if the session exists, so each session is created once
+        batch.create(ref, {**session_data, 'duration_seconds': seconds})
+        self._add_rollup(batch, uid, day, seconds)
+        try:
+            batch.commit()
+            return True
+        except AlreadyExists:
+            batch = self.db.batch()
+            batch.set(ref, {**session_data, 'duration_seconds': firestore.Increment(seconds)}, merge=True)
+            self._add_rollup(batch, uid, day, seconds)
+            batch.commit()
+            return False
+
+    def log_session(self, uid: str, subject: str, minutes: int, session_date: str) -> Dict[str, Any]:
+        """
+        Record a manually logged session and count it in the rollups, atomically
+        Args:
+            uid: User identifier
+            subject: Subject studied
+            minutes: Duration in minutes
+            session_date: ISO date/time of the session (its first 10 characters give the day)
+        Returns:
+            The session as sent to the browser
+        """
+        now = datetime.utcnow()
+        # Timer sessions are keyed by UTC hour; a random suffix keeps manual ones apart
+        session_id = f"{now.strftime('%Y-%m-%d-%H')}-{uuid.uuid4().hex}"
+        session_data = {
+            'uid': uid,
+            'subject': subject,
+            'source': 'manual',
+            'start_time': session_date,
+            'duration_seconds': minutes * 60,
+            'last_updated': now.isoformat()
+        }
+        batch = self.db.batch()
+        batch.set(self._sessions(uid).document(session_id), session_data)
+        if minutes:
+            self._add_rollup(batch, uid, session_date[:10], minutes * 60)
+        batch.commit()
+        return to_client(session_id, session_data)
+
+    def summary(self, uid: str, today: str, days: int = 7, weeks: int = 4) -> Dict[str, Any]:
+        """
+        Daily and weekly study minutes ending today (one document read, no writes)
+        Returns:
+            Dictionary with 'daily' [{date, minutes}], 'weekly' [{week, minutes}] and 'total_week_hours'
+        """
+        snapshot = self._rollup(uid).get()
+        rollup = (snapshot.to_dict() or {}) if snapshot.exists else {}
+        return summarize(rollup, today, days, weeks)
+
+    def recent_sessions(self, uid: str, since: str = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """Newest sessions first, optionally only those starting on or after since ('YYYY-MM-DD')"""
+        query = self._sessions(uid)
+        if since:
+            query = query.where('start_time', '>=', since)
+        query = query.order_by('start_time', direction=firestore.Query.DESCENDING).limit(limit)
+        return [to_client(doc.id, doc.to_dict()) for doc in query.stream()]
+
+    def rebuild(self, uid: str, today: str) -> int:
+        """
+        Recompute a user's rollups from their sessions (backfills and repairs)
+        Returns:
+            Number of sessions counted
+        """
+        first_day = min(_shift(today, -(self.keep_days - 1)), _shift(today, -7 * self.keep_weeks))
+        day_seconds: Dict[str, int] = {}
+        week_seconds: Dict[str, int] = {}
+        counted = 0
+        for doc in self._sessions(uid).where('start_time', '>=', first_day).stream():
+            data = doc.to_dict()
+            seconds = data.get('duration_seconds')
+            day = str(data.get('start_time', ''))[:10]
+            if not isinstance(seconds, (int, float)) or len(day) != 10:
+                continue
+            day_seconds[day] = day_seconds.get(day, 0) + int(seconds)
+            week_seconds[week_key(day)] = week_seconds.get(week_key(day), 0) + int(seconds)
+            counted += 1
+        rollup = {'day_seconds': day_seconds, 'week_seconds': week_seconds}
+        days_expired, weeks_expired = expired_keys(rollup, today, self.keep_days, self.keep_weeks)
+        for day in days_expired:
+            del day_seconds[day]
+        for week in weeks_expired:
+            del week_seconds[week]
+        self._rollup(uid).set({
+            'day_seconds': day_seconds,
+            'week_seconds': week_seconds,
+            'updated_at': datetime.utcnow().isoformat()
+        })
+        return counted
+
+
+def migrate_legacy_sessions(db, sessions: Iterable[Any]) -> int:
+    """
+    Copy sessions from the old top-level study_sessions collection into the users' own stores
+    Args:
+        sessions: Legacy session snapshots
+    Returns:
+        Number of sessions copied (deterministic ids, so reruns overwrite rather than duplicate)
+    """
+    copied = 0
+    batch = db.batch()
+    pending = 0
+    for doc in sessions:
+        data = doc.to_dict() or {}
+        if not data.get('uid'):
+            continue
+        session_date = data.get('session_date')
+        if not isinstance(session_date, str):
+            session_date = session_date.isoformat() if hasattr(session_date, 'isoformat') else ''
+        ref = db.collection('users').document(data['uid']).collection(STUDY_SESSIONS_COL).document(f"legacy-{doc.id}")
+        batch.set(ref, {
+            'uid': data['uid'],
+            'subject': data.get('subject', 'General'),
+            'source': 'manual',
+            'start_time': session_date,
+            'duration_seconds': int(data.get('duration_minutes', 0)) * 60
+        })
+        copied += 1
+        pending += 1
+        if pending == _WRITE_BATCH_SIZE:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    return copied
@@ -0,0 +1,187 @@
+"""
+Syllabus index for StudyOS
+Compiles the syllabus skeleton once at import into shared, read-only lookups
+"""
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+from .syllabus_store import SyllabusStore, load_store
+
+# Profile purpose -> syllabus purpose
+SYLLABUS_PURPOSES = {
+    'high_school': 'highschool',
+    'exam_prep': 'exam',
+    'after_tenth': 'after_tenth'
+}
+
+_EMPTY_MAPPING: Mapping[str, Any] = MappingProxyType({})
+
+# Upper bound on memoized syllabi (after_tenth subject subsets are compiled on demand)
+_MAX_COMPILED = 4096
+
+
+def freeze(value: Any) -> Any:
+    """Recursively convert dicts to read-only mappings and lists to tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def syllabus_args(user_data: Dict[str, Any]) -> Optional[Tuple]:
+    """
+    Get the syllabus lookup arguments for a user
+    Args:
+        user_data: User document
+    Returns:
+        Tuple of (purpose, board_or_exam[, grade[, subjects]]), or None if the user has no academic setup
+    """
+    purpose = user_data.get('purpose')
+    syllabus_purpose = SYLLABUS_PURPOSES.get(purpose, purpose)
+    if purpose == 'high_school' and user_data.get('highschool'):
+        hs = user_data['highschool']
+        return (syllabus_purpose, hs.get('board'), hs.get('grade'))
+    if purpose == 'exam_prep' and user_data.get('exam'):
+        return (syllabus_purpose, user_data['exam'].get('type'))
+    if purpose == 'after_tenth' and user_data.get('after_tenth'):
+        at = user_data['after_tenth']
+        return (syllabus_purpose, 'CBSE', at.get('grade'), at.get('subjects', []))
+    return None
+
+
+class CompiledSyllabus:
+    """
+    One syllabus (subject -> chapters) compiled for lookups.
+    Holds a read-only view of the syllabus, precomputed per-subject chapter
+    counts, a flat chapter id table and a reverse map from "Subject::Chapter"
+    keys to chapter ids. Instances are shared; never mutate them.
+    """
+
+    def __init__(self, key: Tuple, syllabus: Mapping[str, Any]):
+        self.key = key
+        self.syllabus: Mapping[str, Any] = syllabus
+        self.subjects: Tuple[str, ...] = tuple(syllabus.keys())
+        # chapter id -> (subject, chapter)
+        chapter_table: List[Tuple[str, str]] = []
+        # "Subject::Chapter" -> chapter ids (a key may in theory name more than one chapter)
+        key_ids: Dict[str, List[int]] = {}
+        chapter_counts = {}
+        # (subject, chapter set, chapter count) in syllabus order
+        subject_chapters: List[Tuple[str, FrozenSet[str], int]] = []
+        for subject_name, subject_data in syllabus.items():
+            chapters = tuple(subject_data.get('chapters', _EMPTY_MAPPING).keys())
+            for chapter_name in chapters:
+                key_ids.setdefault(f"{subject_name}::{chapter_name}", []).append(len(chapter_table))
+                chapter_table.append((subject_name, chapter_name))
+            chapter_counts[subject_name] = len(chapters)
+            subject_chapters.append((subject_name, frozenset(chapters), len(chapters)))
+        self.chapter_table: Tuple[Tuple[str, str], ...] = tuple(chapter_table)
+        self.key_ids: Mapping[str, Tuple[int, ...]] = MappingProxyType({k: tuple(v) for k, v in key_ids.items()})
+        self.chapter_counts: Mapping[str, int] = MappingProxyType(chapter_counts)
+        self.subject_chapters: Tuple[Tuple[str, FrozenSet[str], int], ...] = tuple(subject_chapters)
+        self.subject_index: Mapping[str, int] = MappingProxyType({s: i for i, s in enumerate(self.subjects)})
+        self.total_chapters = len(chapter_table)
+
+    def __bool__(self):
+        return bool(self.subjects)
+
+    def subject(self, subject_name: str) -> Mapping[str, Any]:
+        """Get a subject's data, or an empty mapping"""
+        return self.syllabus.get(subject_name, _EMPTY_MAPPING)
+
+    def chapter(self, subject_name: str, chapter_name: str) -> Mapping[str, Any]:
+        """Get a chapter's data in O(1), or an empty mapping"""
+        return self.subject(subject_name).get('chapters', _EMPTY_MAPPING).get(chapter_name, _EMPTY_MAPPING)
+
+    def chapter_id(self, key: str) -> Optional[int]:
+        """Get the id of a "Subject::Chapter" key, or None"""
+        ids = self.key_ids.get(key)
+        return ids[0] if ids else None
+
+
+EMPTY_SYLLABUS = CompiledSyllabus(('none',), _EMPTY_MAPPING)
+
+
+class SyllabusIndex:
+    """
+    Every syllabus compiled once, keyed by (purpose, board/exam, grade,
+    subjects). Lookups follow get_syllabus exactly (including the CBSE board
+    fallback and after_tenth subject filters). Only the store skeleton (topic
+    names and overviews) is held here; full topics are read through topics().
+    """
+
+    def __init__(self, syllabi: Dict[str, Any] = None, store: SyllabusStore = None):
+        if store is None:
+            store = load_store() if syllabi is None else SyllabusStore.from_syllabi(syllabi)
+        self.store = store
+        syllabi = freeze(store.skeleton())
+        self._highschool: Mapping[str, Any] = syllabi.get('highschool', _EMPTY_MAPPING)
+        self._exams: Mapping[str, Any] = syllabi.get('exams', _EMPTY_MAPPING)
+        self._compiled: Dict[Tuple, CompiledSyllabus] = {}
+        for board, grades in self._highschool.items():
+            for grade in grades:
+                self._compile(('highschool', board, grade, None))
+        for exam in self._exams:
+            self._compile(('exam', exam, None, None))
+
+    def _compile(self, key: Tuple) -> CompiledSyllabus:
+        compiled = self._compiled.get(key)
+        if compiled is not None:
+            return compiled
+        family, board_or_exam, grade, subjects = key
+        if family == 'exam':
+            syllabus = self._exams.get(board_or_exam, _EMPTY_MAPPING)
+        else:
+            grade_syllabus = self._highschool.get(board_or_exam, _EMPTY_MAPPING).get(grade, _EMPTY_MAPPING)
+            if subjects is None:
+                syllabus = grade_syllabus
+            else:
+                syllabus = MappingProxyType({s: grade_syllabus[s] for s in subjects})
+        compiled = CompiledSyllabus(key, syllabus) if syllabus else EMPTY_SYLLABUS
+        if len(self._compiled) < _MAX_COMPILED:
+            self._compiled[key] = compiled
+        return compiled
+
+    def get(self, purpose: str, board_or_exam: Any, grade: Any = None, subjects: Any = None) -> CompiledSyllabus:
+        """
+        Get a compiled syllabus (same arguments and results as get_syllabus)
+        Returns:
+            CompiledSyllabus, falsy when there is no syllabus
+        """
+        if purpose in ('highschool', 'after_tenth'):
+            board_data = self._highschool.get(board_or_exam)
+            board = board_or_exam if board_data else 'CBSE'
+            grade_str = str(grade) if grade else None
+            subject_key = None
+            if purpose == 'after_tenth' and subjects and isinstance(subjects, list):
+                # Key on the subjects that exist, so keys are bounded by the real subject names
+                grade_syllabus = self._highschool.get(board, _EMPTY_MAPPING).get(grade_str, _EMPTY_MAPPING)
+                subject_key = tuple(s for s in subjects if s in grade_syllabus)
+            return self._compile(('highschool', board, grade_str, subject_key))
+        if purpose in ('exam', 'exams'):
+            if board_or_exam not in self._exams:
+                return EMPTY_SYLLABUS
+            return self._compile(('exam', board_or_exam, None, None))
+        return EMPTY_SYLLABUS
+
+    def topics(self, compiled: CompiledSyllabus, subject_name: str, chapter_name: str) -> List[Dict[str, Any]]:
+        """Get a chapter's full topics from the store (decoded on first use)"""
+        if not compiled.chapter(subject_name, chapter_name):
+            return []
+        family, board_or_exam, grade, _ = compiled.key
+        return self.store.topics(family, board_or_exam, grade, subject_name, chapter_name)
+
+    def for_user(self, user_data: Dict[str, Any]) -> CompiledSyllabus:
+        """Get the compiled syllabus a user's progress is measured against"""
+        args = syllabus_args(user_data)
+        return self.get(*args) if args else EMPTY_SYLLABUS
+
+    def for_class(self, class_data: Dict[str, Any]) -> CompiledSyllabus:
+        """Get the compiled syllabus for a class document (purpose, board, grade)"""
+        purpose = class_data.get('purpose', 'highschool')
+        return self.get(SYLLABUS_PURPOSES.get(purpose, purpose), class_data.get('board', 'CBSE'), class_data.get('grade', '10'))
+
+
+# Built once per process at import
+SYLLABUS_INDEX = SyllabusIndex()
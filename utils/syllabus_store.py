@@ -0,0 +1,219 @@
+"""
+Syllabus content store for StudyOS
+Compact on-disk syllabus: a small in-memory skeleton plus mmap-backed, lazily decoded topic bodies
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from .logger import logger
+
+# File layout: magic | header and skeleton lengths (8 bytes each, big endian) | header JSON
+# | skeleton JSON | topic bodies (JSON, one per chapter)
+_MAGIC = b'STUDYOS-SYLLABUS-1\n'
+_LENGTHS = struct.Struct('>QQ')
+
+# The skeleton is stored HTML-safe (same escapes as Jinja's tojson) so it can be embedded in pages as-is
+_HTML_ESCAPES = (('<', '\\u003c'), ('>', '\\u003e'), ('&', '\\u0026'), ("'", '\\u0027'))
+
+# Topic fields kept in the skeleton (what the library and chapter lists render)
+SKELETON_TOPIC_FIELDS = ('name', 'overview')
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_PATH = os.path.join(_ROOT, 'templates', 'academic_data.py')
+
+# Decoded chapter bodies kept per process
+_DECODED_CHAPTERS = 256
+
+
+def source_hash(path: str = SOURCE_PATH) -> Optional[str]:
+    """Hash the syllabus source file, or None if it is not shipped"""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def body_key(family: str, board_or_exam: str, grade: Optional[str], subject: str, chapter: str) -> str:
+    """Key of a chapter's topic body ('\\x1f' never appears in syllabus names)"""
+    return '\x1f'.join((family, board_or_exam, grade or '', subject, chapter))
+
+
+def _split_subjects(subjects: Dict[str, Any], prefix: Tuple, bodies: Dict[str, List]) -> Dict[str, Any]:
+    """Split one syllabus (subject -> chapters) into its skeleton, collecting full topic lists in bodies"""
+    skeleton = {}
+    for subject_name, subject_data in subjects.items():
+        chapters = {}
+        for chapter_name, chapter_data in subject_data.get('chapters', {}).items():
+            topics = chapter_data.get('topics', [])
+            bodies[body_key(*prefix, subject_name, chapter_name)] = topics
+            chapters[chapter_name] = dict(
+                chapter_data,
+                topics=[{k: t[k] for k in SKELETON_TOPIC_FIELDS if k in t} for t in topics]
+            )
+        skeleton[subject_name] = dict(subject_data, chapters=chapters)
+    return skeleton
+
+
+def split_syllabi(syllabi: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, List]]:
+    """
+    Split ACADEMIC_SYLLABI into a skeleton and per-chapter topic bodies
+    Returns:
+        Tuple of (skeleton with topic names/overviews only, body key -> full topic list)
+    """
+    bodies: Dict[str, List] = {}
+    skeleton: Dict[str, Any] = {'highschool': {}, 'exams': {}}
+    for board, grades in syllabi.get('highschool', {}).items():
+        skeleton['highschool'][board] = {
+            grade: _split_subjects(subjects, ('highschool', board, grade), bodies)
+            for grade, subjects in grades.items()
+        }
+    for exam, subjects in syllabi.get('exams', {}).items():
+        skeleton['exams'][exam] = _split_subjects(subjects, ('exam', exam, None), bodies)
+    return skeleton, bodies
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def encode_store(syllabi: Dict[str, Any], digest: Optional[str] = None) -> bytes:
+    """Encode syllabi into the store format"""
+    skeleton, bodies = split_syllabi(syllabi)
+    offsets = {}
+    chunks = []
+    position = 0
+    for key, topics in bodies.items():
+        chunk = _dumps(topics).encode('utf-8')
+        offsets[key] = (position, len(chunk))
+        chunks.append(chunk)
+        position += len(chunk)
+    header = _dumps({'source_hash': digest, 'bodies': offsets}).encode('utf-8')
+    skeleton_json = _dumps(skeleton)
+    for char, escape in _HTML_ESCAPES:
+        skeleton_json = skeleton_json.replace(char, escape)
+    skeleton_bytes = skeleton_json.encode('utf-8')
+    return b''.join([_MAGIC, _LENGTHS.pack(len(header), len(skeleton_bytes)), header, skeleton_bytes] + chunks)
+
+
+def build_store(syllabi: Dict[str, Any], path: str, digest: Optional[str] = None) -> int:
+    """
+    Write the store file atomically
+    Returns:
+        Size of the written file in bytes
+    """
+    data = encode_store(syllabi, digest)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.syllabus-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return len(data)
+
+
+class SyllabusStore:
+    """
+    Read side of the store. Only the body offsets are held in memory; the
+    skeleton and topic bodies stay in the (memory-mapped) buffer and are
+    decoded on use, so the pages are shared between worker processes via
+    the page cache.
+    """
+
+    def __init__(self, buffer, owner=None):
+        if buffer[:len(_MAGIC)] != _MAGIC:
+            raise ValueError('Not a syllabus store')
+        start = len(_MAGIC) + _LENGTHS.size
+        header_length, skeleton_length = _LENGTHS.unpack(buffer[len(_MAGIC):start])
+        header = json.loads(bytes(buffer[start:start + header_length]).decode('utf-8'))
+        self._buffer = buffer
+        self._owner = owner
+        self._skeleton_span = (start + header_length, start + header_length + skeleton_length)
+        self._base = self._skeleton_span[1]
+        self._offsets: Dict[str, List[int]] = header['bodies']
+        self.source_hash: Optional[str] = header.get('source_hash')
+        self._decode = lru_cache(maxsize=_DECODED_CHAPTERS)(self._decode_body)
+
+    @classmethod
+    def open(cls, path: str) -> 'SyllabusStore':
+        """Memory-map a store file"""
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, owner=buffer)
+
+    @classmethod
+    def from_syllabi(cls, syllabi: Dict[str, Any]) -> 'SyllabusStore':
+        """Build an in-memory store (used when the file cannot be written, and in tests)"""
+        return cls(encode_store(syllabi))
+
+    def skeleton_json(self) -> str:
+        """Get the skeleton (subjects, chapters, topic names and overviews) as HTML-safe JSON"""
+        start, end = self._skeleton_span
+        return bytes(self._buffer[start:end]).decode('utf-8')
+
+    def skeleton(self) -> Dict[str, Any]:
+        """Decode the skeleton (a fresh dictionary on every call)"""
+        return json.loads(self.skeleton_json())
+
+    def _decode_body(self, key: str) -> List[Dict[str, Any]]:
+        offset, length = self._offsets[key]
+        start = self._base + offset
+        return json.loads(bytes(self._buffer[start:start + length]).decode('utf-8'))
+
+    def topics(self, family: str, board_or_exam: str, grade: Optional[str],
+               subject: str, chapter: str) -> List[Dict[str, Any]]:
+        """
+        Get a chapter's full topics (explanations, key points, images, resources)
+        Returns:
+            List of topic dictionaries (shared between callers; do not mutate), empty if unknown
+        """
+        key = body_key(family, board_or_exam, grade, subject, chapter)
+        if key not in self._offsets:
+            return []
+        return self._decode(key)
+
+    def close(self):
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+
+
+def load_store(path: Optional[str] = None) -> SyllabusStore:
+    """
+    Open the syllabus store, rebuilding it first when it is missing or older than academic_data.py
+    Args:
+        path: Store file (defaults to Config.SYLLABUS_STORE_PATH)
+    Returns:
+        SyllabusStore
+    """
+    path = path or Config.SYLLABUS_STORE_PATH
+    digest = source_hash()
+    if os.path.exists(path):
+        try:
+            store = SyllabusStore.open(path)
+            # Without the source (digest None) the built store is authoritative
+            if digest is None or store.source_hash == digest:
+                return store
+            store.close()
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("syllabus_store_unreadable", path=path, error=str(e))
+    from templates.academic_data import ACADEMIC_SYLLABI
+    try:
+        size = build_store(ACADEMIC_SYLLABI, path, digest)
+        logger.info("syllabus_store_built", path=path, bytes=size)
+        return SyllabusStore.open(path)
+    except OSError as e:
+        logger.warning("syllabus_store_build_failed", path=path, error=str(e))
+        return SyllabusStore.from_syllabi(ACADEMIC_SYLLABI)